@@ -2,8 +2,21 @@ import streamlit as st
 import pandas as pd
 from auth import get_all_users, get_all_admin_users, delete_user
 from data_generator import generate_energy_data
-from model import prepare_data, train_model, predict_future, load_model, save_model
+from model import (prepare_data, train_model, predict_future, load_model, save_model, model_version, evaluate_model,
+                   model_config, feature_args)
+from tuning import train_tuned
+from metrics_store import (load_metrics, record_data, record_backtest, record_user_counts,
+                           data_metrics_stale, model_metrics_stale)
+import numpy as np
 import matplotlib.pyplot as plt
+from hierarchy import Hierarchy, HIERARCHY_FILE, RECONCILE_METHODS, hierarchical_forecast
+from anomaly import get_anomaly_detector
+from sessions import get_session_manager
+from storage import file_version, VersionConflict
+from retention import RAW_DAYS, HOURLY_DAYS, get_store, load_history
+from governor import get_governor, ResourceLimitExceeded
+from timeindex import TimeIndex, PERIODS, DEFAULT_PERIOD
+from drift import DEFAULT_THRESHOLD, SYSTEM_METER, get_drift_scheduler, model_replaced, run_drift_check
 import os
 
 def admin_dashboard():
@@ -22,7 +35,10 @@ def admin_dashboard():
         "Dashboard Overview",
         "User Management",
         "System Data",
-        "Analytics"
+        "Analytics",
+        "Fleet Hierarchy",
+        "Anomaly Alerts",
+        "Model Drift"
     ])
 
     if page == "Dashboard Overview":
@@ -33,13 +49,38 @@ def admin_dashboard():
         system_data_management()
     elif page == "Analytics":
         analytics_section()
+    elif page == "Fleet Hierarchy":
+        hierarchy_section()
+    elif page == "Anomaly Alerts":
+        anomaly_section()
+    elif page == "Model Drift":
+        drift_section()
 
     # Logout button
     if st.sidebar.button("Logout"):
+        get_session_manager().revoke(st.session_state.get('session_token'))
         for key in list(st.session_state.keys()):
             del st.session_state[key]
+        st.session_state.session_cookie = ''
         st.rerun()
 
+def system_metrics():
+    """Pre-aggregated system metrics, refreshed only when the underlying files have changed"""
+    metrics = load_metrics()
+    if 'user_count' not in metrics or 'admin_count' not in metrics:
+        metrics = record_user_counts(get_all_users(), get_all_admin_users())
+    if os.path.exists('energy_data.csv') and data_metrics_stale(metrics):
+        data = load_history()
+        metrics = record_data(data)
+    if os.path.exists('energy_model.pkl') and os.path.exists('energy_data.csv') and model_metrics_stale(metrics):
+        model = load_model()
+        if model:
+            data = load_history()
+            X, y = prepare_data(data, **feature_args(model_config(model)))
+            mse, test_points = evaluate_model(model, X, y)
+            metrics = record_backtest(mse, model_version(model), test_points)
+    return metrics
+
 def dashboard_overview():
     """Main dashboard overview"""
     st.header("Dashboard Overview")
@@ -47,13 +88,12 @@ def dashboard_overview():
     # System statistics
     col1, col2, col3, col4 = st.columns(4)
 
-    users_df = get_all_users()
-    admin_df = get_all_admin_users()
+    metrics = system_metrics()
 
     with col1:
-        st.metric("Total Users", len(users_df))
+        st.metric("Total Users", metrics['user_count'])
     with col2:
-        st.metric("Total Admins", len(admin_df))
+        st.metric("Total Admins", metrics['admin_count'])
     with col3:
         st.metric("System Status", "Active")
     with col4:
@@ -124,26 +164,64 @@ def system_data_management():
         if st.button("Generate New Data"):
             with st.spinner("Generating data..."):
                 data = generate_energy_data(periods=periods)
-                data.to_csv('energy_data.csv', index=False)
+                get_store().replace(data)
+                record_data(data)
                 st.success("System data generated successfully!")
 
     with col2:
         if os.path.exists('energy_data.csv'):
-            data = pd.read_csv('energy_data.csv')
-            st.metric("Current Data Points", len(data))
-            st.metric("Date Range", f"{data['date'].min()} to {data['date'].max()}")
+            metrics = system_metrics()
+            st.metric("Current Data Points", metrics['data_rows'])
+            st.metric("Date Range", f"{metrics['data_start']} to {metrics['data_end']}")
+
+    # Storage tiers: raw recent readings, hourly and daily rollups in compressed archives
+    st.subheader("Data Retention")
+    st.markdown(f"Readings older than {RAW_DAYS} days are rolled up to hourly totals, and older than "
+                f"{HOURLY_DAYS} days to daily totals, in compressed monthly archives.")
+    store = get_store()
+    if st.button("Compact Now"):
+        with st.spinner("Rolling up old readings..."):
+            moved = store.compact()
+        st.success(f"Archived {moved['raw_to_hourly']} raw readings and rolled "
+                   f"{moved['hourly_to_daily']} hourly months up to daily")
+    tiers = store.summary()
+    if tiers.empty:
+        st.info("No readings stored yet")
+    else:
+        tiers['size_kb'] = (tiers.pop('bytes') / 1024).round(1)
+        st.dataframe(tiers, use_container_width=True)
 
     # Model training
     st.subheader("Model Training")
     if os.path.exists('energy_data.csv'):
+        tune = st.checkbox("Tune lag depth and regularization", value=False,
+                           help="Rolling-origin search over lag windows, feature sets and ridge penalties")
         if st.button("Train System Model"):
             with st.spinner("Training model..."):
-                data = pd.read_csv('energy_data.csv')
-                data['date'] = pd.to_datetime(data['date'])
-                X, y = prepare_data(data)
-                model = train_model(X, y)
-                save_model(model)
-                st.success("Model trained successfully!")
+                model_file_version = file_version('energy_model.pkl')
+                data = load_history()
+                try:
+                    with get_governor().heavy(st.session_state.user['username'], wait_seconds=30):
+                        if tune:
+                            # Inline so the governor charges the trials' CPU time
+                            model, X, y = train_tuned(data, workers=1)
+                        else:
+                            X, y = prepare_data(data)
+                            model = train_model(X, y)
+                        if model is None:
+                            raise ValueError("Not enough history to tune the model.")
+                        save_model(model, expected_version=model_file_version)
+                except ResourceLimitExceeded as e:
+                    st.warning(f"{e} Please try training again shortly.")
+                except VersionConflict:
+                    st.warning("The model was updated by another session while training. Please train again.")
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    mse, test_points = evaluate_model(model, X, y)
+                    record_backtest(mse, model_version(model), test_points)
+                    model_replaced(SYSTEM_METER)
+                    st.success("Model trained successfully!")
     else:
         st.warning("No data available. Generate data first.")
 
@@ -152,52 +230,183 @@ def analytics_section():
     st.header("System Analytics")
 
     if os.path.exists('energy_data.csv'):
-        data = pd.read_csv('energy_data.csv')
-        data['date'] = pd.to_datetime(data['date'])
+        metrics = system_metrics()
 
         # Basic analytics
         st.subheader("Data Analytics")
 
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Total Records", len(data))
+            st.metric("Total Records", metrics['data_rows'])
         with col2:
-            st.metric("Avg Consumption", f"{data['consumption_kwh'].mean():.1f} kWh")
+            st.metric("Avg Consumption", f"{metrics['mean_kwh']:.1f} kWh")
         with col3:
-            st.metric("Date Range", f"{len(data)} days")
+            st.metric("Date Range", f"{metrics['data_days']} days")
 
-        # Consumption chart
+        if metrics.get('meter_means'):
+            with st.expander(f"Per-meter averages ({metrics['meter_count']} meters)"):
+                meter_means = pd.Series(metrics['meter_means'], name='mean_kwh')
+                st.dataframe(meter_means.round(2))
+
+        # Consumption chart over the selected period of the pre-aggregated trend
         st.subheader("Consumption Trends")
-        fig, ax = plt.subplots(figsize=(10, 4))
-        ax.plot(data['date'], data['consumption_kwh'])
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Consumption (kWh)')
-        ax.set_title('System Energy Consumption Trends')
-        st.pyplot(fig)
+        trend = TimeIndex(pd.DataFrame({'date': pd.to_datetime(metrics['trend']['dates']),
+                                        'consumption_kwh': metrics['trend']['values']}))
+        period = st.selectbox("Period", list(PERIODS), index=list(PERIODS).index(DEFAULT_PERIOD),
+                              key="analytics_period")
+        shown = trend.between(*trend.period_bounds(period))
+        if shown.empty:
+            st.warning("No readings in the selected period")
+        else:
+            st.caption(f"{shown['date'].iloc[0].date()} to {shown['date'].iloc[-1].date()}, "
+                       f"average {shown['consumption_kwh'].mean():.1f} kWh")
+            fig, ax = plt.subplots(figsize=(10, 4))
+            ax.plot(shown['date'], shown['consumption_kwh'])
+            ax.set_xlabel('Date')
+            ax.set_ylabel('Consumption (kWh)')
+            ax.set_title('System Energy Consumption Trends')
+            st.pyplot(fig)
 
         # Model performance if available
         if os.path.exists('energy_model.pkl'):
             st.subheader("Model Performance")
-            model = load_model()
-            if model:
-                X, y = prepare_data(data)
-                if len(X) > 0:
-                    split_idx = int(len(X) * 0.8)
-                    X_test, y_test = X[split_idx:], y[split_idx:]
-                    if len(X_test) > 0:
-                        y_pred = model.predict(X_test)
-                        mse = ((y_test - y_pred) ** 2).mean()
-                        st.metric("Model MSE", f"{mse:.2f}")
-                    else:
-                        st.info("Not enough data for performance evaluation")
-                else:
-                    st.info("Model loaded but no test data available")
+            if metrics.get('model_mse') is not None:
+                st.metric("Model MSE", f"{metrics['model_mse']:.2f}")
+                st.caption(f"Evaluated on {metrics.get('model_test_points')} points "
+                           f"at {metrics.get('model_evaluated_at')}")
             else:
-                st.warning("Could not load model")
+                st.info("Not enough data for performance evaluation")
         else:
             st.info("No trained model available")
     else:
         st.warning("No system data available for analytics")
 
+def hierarchy_section():
+    """Reconciled forecasts for meters, buildings and regions"""
+    st.header("Fleet Hierarchy")
+
+    if not os.path.exists(HIERARCHY_FILE):
+        st.info(f"No hierarchy defined. Add '{HIERARCHY_FILE}' with meter_id, building and region columns.")
+        return
+    if not os.path.exists('energy_data.csv'):
+        st.warning("No system data available for analytics")
+        return
+
+    data = load_history()
+    if 'meter_id' not in data.columns:
+        st.info("System data has no meter_id column; hierarchy forecasts need per-meter readings.")
+        return
+
+    hierarchy = Hierarchy.from_file()
+    bottom, dates = hierarchy.bottom_matrix(data)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Meters", len(hierarchy.meters))
+    with col2:
+        st.metric("Buildings", len(hierarchy.level_slice('building')))
+    with col3:
+        st.metric("Regions", len(hierarchy.level_slice('region')))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        days_ahead = st.slider("Days to forecast", 1, 90, 30, key="hierarchy_days")
+    with col2:
+        method = st.selectbox("Reconciliation", RECONCILE_METHODS, index=2, key="hierarchy_method")
+
+    if st.button("Generate Hierarchy Forecast"):
+        with st.spinner("Forecasting and reconciling..."):
+            try:
+                forecast = hierarchical_forecast(hierarchy, bottom, days_ahead, method=method)
+            except Exception as e:
+                st.error(f"Error generating hierarchy forecast: {str(e)}")
+                return
+        forecast.columns = pd.date_range(start=dates.max() + pd.Timedelta(days=1), periods=days_ahead).date
+
+        st.subheader("Regional Totals")
+        regions = forecast.iloc[np.r_[0, hierarchy.level_slice('region')]]
+        st.dataframe(regions.T.round(2))
+
+        fig, ax = plt.subplots(figsize=(10, 4))
+        for node, values in regions.iterrows():
+            ax.plot(regions.columns, values, label=node)
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Consumption (kWh)')
+        ax.set_title('Reconciled Regional Forecast')
+        ax.legend()
+        st.pyplot(fig)
+
+        with st.expander("All nodes"):
+            st.dataframe(forecast.round(2))
+
+def anomaly_section():
+    """Spikes and drops flagged by the streaming detector across all meters"""
+    st.header("Anomaly Alerts")
+
+    detector = get_anomaly_detector()
+    summary = detector.summary()
+    if summary.empty:
+        st.info("No readings have been streamed to the anomaly detector yet")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Monitored Meters", len(summary))
+    with col2:
+        st.metric("Meters With Alerts", int((summary['alerts'] > 0).sum()))
+    with col3:
+        st.metric("Total Alerts", int(summary['alerts'].sum()))
+
+    st.subheader("Meters")
+    st.dataframe(summary.sort_values('alerts', ascending=False).round(2))
+
+    st.subheader("Recent Alerts")
+    alerts = detector.alerts(limit=200)
+    if alerts:
+        st.dataframe(pd.DataFrame(alerts).round(2))
+    else:
+        st.info("No anomalies detected")
+
+def drift_section():
+    """Rolling forecast error per meter and drift-triggered retraining"""
+    st.header("Model Drift")
+    st.markdown("Logged forecasts are scored against actuals as they arrive. Only meters whose "
+                f"rolling error exceeds {DEFAULT_THRESHOLD:g}x their baseline are queued for retraining.")
+
+    if not os.path.exists('energy_data.csv'):
+        st.warning("No data available. Generate data first.")
+        return
+
+    if st.button("Run Drift Check"):
+        with st.spinner("Scoring forecasts against actuals..."):
+            scored, scheduled, issued = run_drift_check()
+        st.success(f"Scored {scored} days, logged {issued} new forecasts")
+        for meter_id, mode, ratio in scheduled:
+            st.warning(f"Meter {meter_id}: error at {ratio:.1f}x baseline, {mode} retrain queued")
+
+    _, monitor, scheduler = get_drift_scheduler()
+    summary = monitor.summary()
+    if summary.empty:
+        st.info("No forecasts have been scored yet. Run a drift check now and again once new data arrives.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Tracked Meters", len(summary))
+    with col2:
+        st.metric("Drifting Meters", int(summary['drifted'].sum()))
+    with col3:
+        st.metric("Retrains Queued", len(scheduler.pending()))
+
+    st.subheader("Meters")
+    st.dataframe(summary.sort_values('drift_ratio', ascending=False)
+                 .round({'rolling_rmse': 2, 'baseline_rmse': 2, 'drift_ratio': 2}))
+
+    if scheduler.history:
+        st.subheader("Recent Retrains")
+        history = pd.DataFrame(scheduler.history[-50:])
+        history['finished_at'] = pd.to_datetime(history['finished_at'], unit='s')
+        st.dataframe(history)
+
 if __name__ == "__main__":
     admin_dashboard()
@@ -0,0 +1,175 @@
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ALPHA = 0.1
+DEFAULT_THRESHOLD = 3.5
+DEFAULT_WARMUP = 14
+MAX_ALERTS = 1000
+
+# Marks a meter with no timestamped readings absorbed yet
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+
+class StreamingAnomalyDetector:
+    """
+    Per-meter spike/drop detector with O(1) work per appended reading.
+
+    State for all meters lives in flat NumPy arrays indexed by meter slot:
+    Welford running mean/variance for long-run statistics and an EWMA
+    mean/variance that tracks the recent level. A reading is scored against
+    the EWMA baseline (or against a supplied forecast value) before it is
+    folded into the state. The newest timestamp absorbed per meter is kept
+    too, so readings at or before it are skipped when a history is fed
+    again (e.g. from another session of the same user).
+    """
+
+    def __init__(self, alpha=DEFAULT_ALPHA, threshold=DEFAULT_THRESHOLD,
+                 warmup=DEFAULT_WARMUP, max_alerts=MAX_ALERTS, capacity=64):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self._slots = {}
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._mean = np.zeros(capacity)
+        self._m2 = np.zeros(capacity)
+        self._ewm_mean = np.zeros(capacity)
+        self._ewm_var = np.zeros(capacity)
+        self._last = np.full(capacity, NO_TIMESTAMP, dtype=np.int64)
+        self._alerts = deque(maxlen=max_alerts)
+        self._lock = threading.Lock()
+
+    def _slot(self, meter_id):
+        slot = self._slots.get(meter_id)
+        if slot is None:
+            slot = len(self._slots)
+            if slot == len(self._count):
+                grow = len(self._count)
+                self._count = np.concatenate([self._count, np.zeros(grow, dtype=np.int64)])
+                self._mean, self._m2, self._ewm_mean, self._ewm_var = (
+                    np.concatenate([a, np.zeros(grow)])
+                    for a in (self._mean, self._m2, self._ewm_mean, self._ewm_var))
+                self._last = np.concatenate([self._last, np.full(grow, NO_TIMESTAMP, dtype=np.int64)])
+            self._slots[meter_id] = slot
+        return slot
+
+    def _update(self, slot, meter_id, value, timestamp, expected):
+        count = self._count[slot]
+        baseline = self._ewm_mean[slot] if expected is None else expected
+        sigma = np.sqrt(self._ewm_var[slot])
+        alert = None
+        if count >= self.warmup and sigma > 0:
+            zscore = (value - baseline) / sigma
+            if abs(zscore) > self.threshold:
+                alert = {
+                    'meter_id': meter_id,
+                    'timestamp': timestamp,
+                    'value': float(value),
+                    'expected': float(baseline),
+                    'zscore': float(zscore),
+                    'kind': 'spike' if zscore > 0 else 'drop'
+                }
+                self._alerts.append(alert)
+
+        # Welford update
+        count += 1
+        delta = value - self._mean[slot]
+        self._mean[slot] += delta / count
+        self._m2[slot] += delta * (value - self._mean[slot])
+        self._count[slot] = count
+
+        # EWMA update; the first reading seeds the level
+        if count == 1:
+            self._ewm_mean[slot] = value
+        else:
+            diff = value - self._ewm_mean[slot]
+            increment = self.alpha * diff
+            self._ewm_mean[slot] += increment
+            self._ewm_var[slot] = (1 - self.alpha) * (self._ewm_var[slot] + diff * increment)
+        return alert
+
+    def update(self, meter_id, value, timestamp=None, expected=None):
+        """Score and absorb one reading; returns the alert dict or None (also when already seen)"""
+        with self._lock:
+            slot = self._slot(meter_id)
+            if timestamp is not None:
+                ns = pd.Timestamp(timestamp).value
+                if ns <= self._last[slot]:
+                    return None
+                self._last[slot] = ns
+            return self._update(slot, meter_id, float(value), timestamp, expected)
+
+    def last_seen(self, meter_id):
+        """Newest timestamp absorbed for a meter, or None"""
+        with self._lock:
+            slot = self._slots.get(meter_id)
+            if slot is None or self._last[slot] == NO_TIMESTAMP:
+                return None
+            return np.datetime64(int(self._last[slot]), 'ns')
+
+    def feed(self, meter_id, timestamps, values, expected=None):
+        """
+        Absorb a batch of readings in order; returns the alerts raised.
+        Readings at or before the newest one already absorbed are skipped.
+        """
+        alerts = []
+        stamps = np.asarray(timestamps, dtype='datetime64[ns]').astype(np.int64)
+        with self._lock:
+            slot = self._slot(meter_id)
+            for i in range(len(values)):
+                if stamps[i] <= self._last[slot]:
+                    continue
+                self._last[slot] = stamps[i]
+                alert = self._update(slot, meter_id, float(values[i]), pd.Timestamp(timestamps[i]),
+                                     None if expected is None else float(expected[i]))
+                if alert is not None:
+                    alerts.append(alert)
+        return alerts
+
+    def reset(self, meter_id):
+        """Forget one meter's state and alerts, e.g. after its history is replaced"""
+        with self._lock:
+            slot = self._slots.get(meter_id)
+            if slot is None:
+                return
+            self._count[slot] = 0
+            self._mean[slot] = self._m2[slot] = 0.0
+            self._ewm_mean[slot] = self._ewm_var[slot] = 0.0
+            self._last[slot] = NO_TIMESTAMP
+            kept = [a for a in self._alerts if a['meter_id'] != meter_id]
+            self._alerts.clear()
+            self._alerts.extend(kept)
+
+    def alerts(self, meter_id=None, limit=None):
+        """Most recent alerts first, optionally for one meter"""
+        with self._lock:
+            selected = [a for a in reversed(self._alerts) if meter_id is None or a['meter_id'] == meter_id]
+        return selected[:limit] if limit else selected
+
+    def summary(self):
+        """One row per meter with running statistics and alert counts"""
+        with self._lock:
+            meters = list(self._slots)
+            slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(meters))
+            counts = self._count[slots]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                std = np.sqrt(np.where(counts > 1, self._m2[slots] / (counts - 1), np.nan))
+            alert_counts = pd.Series([a['meter_id'] for a in self._alerts], dtype=object).value_counts()
+            return pd.DataFrame({
+                'meter_id': meters,
+                'readings': counts,
+                'mean_kwh': self._mean[slots],
+                'std_kwh': std,
+                'recent_level_kwh': self._ewm_mean[slots],
+                'alerts': alert_counts.reindex(meters).fillna(0).astype(int).to_numpy()
+            })
+
+
+_detector = StreamingAnomalyDetector()
+
+
+def get_anomaly_detector():
+    """Process-wide detector shared by the user and admin dashboards"""
+    return _detector
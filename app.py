@@ -3,9 +3,113 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from data_generator import generate_energy_data
-from model import prepare_data, train_model, predict_future, load_model, save_model
+from model import (prepare_data, train_model, predict_future, load_model, save_model, model_version, evaluate_model,
+                   model_config)
+from tuning import train_tuned
+from metrics_store import record_data, record_backtest
+from forecast_cache import get_forecast_cache
+from ingestion import ReadingIngestor
+from preprocessing import clean_series
+from anomaly import get_anomaly_detector
+from export import EXPORT_FORMATS, iter_chunks, combined_chunks, export_bytes, export_filename, export_mime
+from sessions import get_session_manager
+from retention import get_store, load_history
+from drift import SYSTEM_METER, model_replaced
+from timeseries import CompactSeries
+from timeindex import TimeIndex, PERIODS, DEFAULT_PERIOD
+from scenarios import PRESETS, Scenario, get_scenario_engine, summarize
+from tariffs import PLANS, CURRENCY, compute_costs
+from governor import (get_governor, get_training_queue, BudgetExceeded, ResourceLimitExceeded, MAX_UPLOAD_MB,
+                      upload_too_large, frame_too_large, decimate, sample_rows)
+import calendar
+import html
 import os
 
+def export_button(kind, label, stem, make_chunks, fmt, compress):
+    """Build an export only when asked for, then offer it for download"""
+    key = (kind, fmt, compress)
+    exports = st.session_state.exports
+    if key not in exports:
+        if st.button(f"⚙️ Prepare {label}", key=f"prepare_{kind}", use_container_width=True):
+            with st.spinner(f"Preparing {label.lower()}..."):
+                exports[key] = export_bytes(make_chunks(), fmt, compress)
+    if key in exports:
+        st.download_button(
+            label=f"📥 Download {label}",
+            data=exports[key],
+            file_name=export_filename(stem, fmt, compress),
+            mime=export_mime(fmt, compress),
+            key=f"download_{kind}",
+            use_container_width=True
+        )
+
+def get_time_index(data):
+    """TimeIndex for the session's data, rebuilt only when the data changes"""
+    cached = st.session_state.get('time_index')
+    if cached is None or cached[0] is not data:
+        cached = (data, TimeIndex(data))
+        st.session_state.time_index = cached
+    return cached[1]
+
+def get_data_quality(data, impute):
+    """
+    clean_series report for the session's data, computed once per dataset
+    and gap filling method in a governor slot charged to the user
+    """
+    cached = st.session_state.get('data_quality')
+    if cached is None or cached[0] is not data:
+        cached = (data, {})
+        st.session_state.data_quality = cached
+    if impute not in cached[1]:
+        with get_governor().heavy(st.session_state.user['username']):
+            cached[1][impute] = clean_series(data, impute=impute)
+    return cached[1][impute]
+
+def date_range_filter(index, key):
+    """Period selector over a TimeIndex; returns the selected rows as a view"""
+    periods = list(PERIODS) + ["Custom"]
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        period = st.selectbox("🗓️ Period", periods, index=periods.index(DEFAULT_PERIOD), key=f"{key}_period")
+    with col2:
+        if period == "Custom":
+            picked = st.date_input("Date range", value=(index.start.date(), index.end.date()),
+                                   min_value=index.start.date(), max_value=index.end.date(), key=f"{key}_range")
+            t0, t1 = index.start, index.end
+            if len(picked) == 2:
+                # Include the whole end day for sub-daily data
+                t0, t1 = pd.Timestamp(picked[0]), pd.Timestamp(picked[1]) + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        else:
+            t0, t1 = index.period_bounds(period)
+            st.caption(f"📅 {t0.date()} to {t1.date()}")
+    view = index.between(t0, t1)
+    if view.empty:
+        st.warning("⚠️ No readings in the selected period; showing all data.")
+        return index.df
+    return view
+
+def train_and_save(data, tune=False):
+    """
+    Train, save and evaluate a model; returns (model, message) with model None on failure.
+    With `tune` the lag depth, features and regularization are searched first.
+    """
+    if tune:
+        # Inline: trials in worker processes would escape the governor's CPU accounting
+        model, X, y = train_tuned(data, workers=1)
+        if model is None:
+            return None, "❌ Not enough history to tune the model. Train without tuning or add more data."
+    else:
+        X, y = prepare_data(data)
+        if len(X) < 7:
+            return None, "❌ Need at least 7 days of data to train the model."
+        model = train_model(X, y)
+    save_model(model)
+    # The drift baseline belongs to the model just replaced
+    model_replaced(SYSTEM_METER)
+    mse, test_points = evaluate_model(model, X, y)
+    record_backtest(mse, model_version(model), test_points)
+    return model, "✅ AI Model trained successfully!"
+
 def user_dashboard():
     """User dashboard with navigation bar and enhanced UI"""
     st.set_page_config(page_title="EcoWatt: Smart Energy Consumption Forecasting", page_icon="⚡")
@@ -50,14 +154,14 @@ def user_dashboard():
     </style>
     """, unsafe_allow_html=True)
 
-    # Header with user info
+    # Header with user info; profile fields are user-supplied, so they are escaped
     st.markdown(f"""
     <div class="user-dashboard">
         <h1 style="margin: 0; display: inline-block;">⚡ EcoWatt: Smart Energy Consumption Forecasting</h1>
         <div class="user-info">
-            <strong>User:</strong> {st.session_state.user['full_name']}<br>
-            <strong>Email:</strong> {st.session_state.user['email']}<br>
-            <strong>Role:</strong> {st.session_state.user['role'].title()}
+            <strong>User:</strong> {html.escape(str(st.session_state.user['full_name']))}<br>
+            <strong>Email:</strong> {html.escape(str(st.session_state.user['email']))}<br>
+            <strong>Role:</strong> {html.escape(str(st.session_state.user['role']).title())}
         </div>
     </div>
     """, unsafe_allow_html=True)
@@ -78,8 +182,10 @@ def user_dashboard():
             st.session_state.nav_page = "results"
     with col5:
         if st.button("🚪 Logout", key="nav_logout", use_container_width=True):
+            get_session_manager().revoke(st.session_state.get('session_token'))
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
+            st.session_state.session_cookie = ''
             st.rerun()
 
     # Set default page
@@ -94,9 +200,10 @@ def user_dashboard():
         # Try to load existing data
         if os.path.exists('energy_data.csv'):
             try:
-                data = pd.read_csv('energy_data.csv')
-                data['date'] = pd.to_datetime(data['date'])
-                st.session_state.data = data
+                # Recent raw readings plus any archived history, at one resolution
+                data = load_history()
+                if data is not None:
+                    st.session_state.data = data
             except:
                 pass
 
@@ -106,6 +213,17 @@ def user_dashboard():
         if model:
             st.session_state.model = model
 
+    # Feed readings newer than the last one the shared detector absorbed for this user
+    if 'data' in st.session_state:
+        data = st.session_state.data
+        detector = get_anomaly_detector()
+        meter_id = st.session_state.user['username']
+        last_seen = detector.last_seen(meter_id)
+        dates = data['date'].values
+        start = 0 if last_seen is None else int(np.searchsorted(dates, last_seen, side='right'))
+        if start < len(data):
+            detector.feed(meter_id, dates[start:], data['consumption_kwh'].values[start:])
+
     # Page content based on navigation
     if page == "upload":
         st.header("📤 Upload Energy Data")
@@ -113,8 +231,8 @@ def user_dashboard():
 
         # Show current data status
         if 'data' in st.session_state:
-            data = st.session_state.data
-            st.success(f"✅ Data loaded: {len(data)} records from {data['date'].min().date()} to {data['date'].max().date()}")
+            index = get_time_index(st.session_state.data)
+            st.success(f"✅ Data loaded: {len(index)} records from {index.start.date()} to {index.end.date()}")
             st.info("💡 You can proceed to Analyze Data tab or generate new data below.")
 
         # Option to generate or upload data
@@ -126,15 +244,26 @@ def user_dashboard():
             if st.button("Generate Data", key="generate_btn"):
                 with st.spinner("Generating synthetic energy consumption data..."):
                     data = generate_energy_data(periods=periods)
-                    data.to_csv('energy_data.csv', index=False)
+                    get_store().replace(data)
+                    record_data(data)
                     st.session_state.data = data
+                    st.session_state.pop('ingestor', None)
+                    get_anomaly_detector().reset(st.session_state.user['username'])
                     st.success("✅ Data generated successfully!")
                     st.info("📊 Data saved as 'energy_data.csv' - you can now analyze it in the next tab!")
                     st.balloons()
         else:
             st.subheader("Upload Your Data")
+            merge_existing = st.checkbox("Merge with existing data", value='data' in st.session_state,
+                                         key="merge_upload",
+                                         help="Append new readings to the current series; overlapping dates are replaced by the upload.")
             uploaded_file = st.file_uploader("Upload CSV file", type="csv", key="upload_file")
-            if uploaded_file is not None:
+            upload_id = (uploaded_file.name, uploaded_file.size) if uploaded_file is not None else None
+            if uploaded_file is not None and upload_id == st.session_state.get('last_upload_id'):
+                st.info("📄 This file has already been loaded.")
+            elif uploaded_file is not None and upload_too_large(uploaded_file.size):
+                st.error(f"❌ File is too large. The upload limit is {MAX_UPLOAD_MB:.0f} MB.")
+            elif uploaded_file is not None:
                 data = pd.read_csv(uploaded_file)
                 # Check if required columns exist
                 if 'date' not in data.columns or 'consumption_kwh' not in data.columns:
@@ -145,19 +274,37 @@ def user_dashboard():
                 else:
                     try:
                         # Handle date and optional time columns
-                        if 'time' in data.columns:
+                        has_time = 'time' in data.columns
+                        if has_time:
                             # Combine date and time if time column exists
                             data['date'] = pd.to_datetime(data['date'] + ' ' + data['time'], format='%Y-%m-%d %H:%M:%S')
                         else:
                             # Use date only
                             data['date'] = pd.to_datetime(data['date'])
 
-                        # Sort by date to ensure chronological order
-                        data = data.sort_values('date').reset_index(drop=True)
+                        if merge_existing and 'data' in st.session_state:
+                            # Merge into the stored series, newest reading wins on duplicate dates
+                            ingestor = st.session_state.get('ingestor')
+                            if ingestor is None or len(ingestor) != len(st.session_state.data):
+                                ingestor = ReadingIngestor(st.session_state.data)
+                            ingestor.append(data)
+                            data = ingestor.to_frame()
+                            st.session_state.ingestor = ingestor
+                            st.info(f"🔗 Merged upload: {ingestor.stats['duplicates']} duplicate and "
+                                    f"{ingestor.stats['late']} out-of-order readings handled so far.")
+                        else:
+                            # Sort by date to ensure chronological order
+                            data = data.sort_values('date').reset_index(drop=True)
+                            st.session_state.pop('ingestor', None)
+                            get_anomaly_detector().reset(st.session_state.user['username'])
+        
+                        if frame_too_large(data):
+                            raise ValueError("the data exceeds this session's memory limit; upload a shorter date range")
 
                         st.session_state.data = data
+                        st.session_state.last_upload_id = upload_id
                         st.success("✅ Data uploaded successfully!")
-                        if 'time' in data.columns:
+                        if has_time:
                             st.info("📅 Date and time columns combined successfully.")
                         else:
                             st.info("📅 Date column processed successfully.")
@@ -173,24 +320,53 @@ def user_dashboard():
 
         if 'data' in st.session_state:
             data = st.session_state.data
+            index = get_time_index(data)
 
             # Data overview with enhanced metrics
             st.subheader("📈 Data Overview")
+            view = date_range_filter(index, "analyze")
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("📊 Total Records", len(data))
+                st.metric("📊 Total Records", len(view))
             with col2:
-                st.metric("📅 Date Range", f"{data['date'].min().date()} to {data['date'].max().date()}")
+                st.metric("📅 Date Range", f"{view['date'].iloc[0].date()} to {view['date'].iloc[-1].date()}")
             with col3:
-                st.metric("⚡ Avg Consumption", f"{data['consumption_kwh'].mean():.1f} kWh")
+                st.metric("⚡ Avg Consumption", f"{view['consumption_kwh'].mean():.1f} kWh")
             with col4:
-                st.metric("🔋 Total Consumption", f"{data['consumption_kwh'].sum():.0f} kWh")
+                st.metric("🔋 Total Consumption", f"{view['consumption_kwh'].sum():.0f} kWh")
+
+            # Data quality: gaps, duplicates and outliers found by the cleaning stage
+            st.subheader("🧹 Data Quality")
+            impute_method = st.selectbox("Gap filling method", ["linear", "seasonal"], key="impute_method",
+                                         help="Linear interpolation or the value from the same point one season earlier.")
+            try:
+                cleaned, quality = get_data_quality(data, impute_method)
+            except ResourceLimitExceeded as e:
+                st.info(f"⏳ {e} The data quality check will run when capacity frees up.")
+            else:
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("✅ Completeness", f"{quality['completeness']:.1%}")
+                with col2:
+                    st.metric("🕳️ Missing Points", quality['missing'],
+                              help=f"{quality['gaps']} gaps, longest {quality['longest_gap']} points")
+                with col3:
+                    st.metric("♻️ Duplicates", quality['duplicates'])
+                with col4:
+                    st.metric("⚠️ Outliers", quality['outliers'])
+                if quality['dropped']:
+                    st.warning(f"⚠️ {quality['dropped']} readings far outside the rest of the series were ignored.")
+                if quality['missing'] or quality['outliers']:
+                    with st.expander("View flagged points"):
+                        st.dataframe(cleaned[cleaned['is_imputed'] | cleaned['is_outlier']], use_container_width=True)
 
             # Time series plot with enhanced visualization
             st.subheader("📈 Consumption Over Time")
             fig, ax = plt.subplots(figsize=(14, 7))
-            ax.plot(data['date'], data['consumption_kwh'], linewidth=2, color='#1f77b4', alpha=0.8)
-            ax.fill_between(data['date'], data['consumption_kwh'], alpha=0.3, color='#1f77b4')
+            # Long histories are decimated so plotting cost stays bounded
+            plot_dates, plot_values = decimate(view['date'].values, view['consumption_kwh'].values)
+            ax.plot(plot_dates, plot_values, linewidth=2, color='#1f77b4', alpha=0.8)
+            ax.fill_between(plot_dates, plot_values, alpha=0.3, color='#1f77b4')
             ax.set_xlabel('Date', fontsize=12)
             ax.set_ylabel('Consumption (kWh)', fontsize=12)
             ax.set_title('Historical Energy Consumption Trends', fontsize=14, fontweight='bold')
@@ -200,29 +376,30 @@ def user_dashboard():
 
             # Statistical analysis with insights
             st.subheader("📊 Statistical Analysis & Insights")
+            analytics_data, sampled = sample_rows(view)
+            if sampled:
+                st.caption(f"ℹ️ Statistics below are estimated from a sample of {len(analytics_data):,} of {len(view):,} records.")
             col1, col2 = st.columns(2)
 
             with col1:
                 st.markdown("**📋 Basic Statistics**")
-                stats_df = data['consumption_kwh'].describe()
+                stats_df = analytics_data['consumption_kwh'].describe()
                 st.dataframe(stats_df.apply(lambda x: f"{x:.2f}"), use_container_width=True)
 
                 # Key insights
                 st.markdown("**💡 Key Insights**")
-                max_consumption = data['consumption_kwh'].max()
-                min_consumption = data['consumption_kwh'].min()
-                std_dev = data['consumption_kwh'].std()
+                max_consumption = view['consumption_kwh'].max()
+                min_consumption = view['consumption_kwh'].min()
+                std_dev = analytics_data['consumption_kwh'].std()
                 st.info(f"🔺 Peak consumption: {max_consumption:.1f} kWh")
                 st.info(f"🔻 Lowest consumption: {min_consumption:.1f} kWh")
                 st.info(f"📊 Variability (Std Dev): {std_dev:.1f} kWh")
 
             with col2:
                 st.markdown("**📅 Monthly Trends**")
-                data_copy = data.copy()
-                data_copy['month'] = data_copy['date'].dt.month
-                data_copy['month_name'] = data_copy['date'].dt.strftime('%B')
-                monthly_avg = data_copy.groupby(['month', 'month_name'])['consumption_kwh'].mean().reset_index()
-                monthly_avg = monthly_avg.sort_values('month')
+                # Group on month numbers; names are only looked up for the 12 bars
+                monthly_avg = view['consumption_kwh'].groupby(view['date'].dt.month.rename('month')).mean().reset_index()
+                monthly_avg['month_name'] = [calendar.month_name[m] for m in monthly_avg['month']]
 
                 fig, ax = plt.subplots(figsize=(10, 5))
                 bars = ax.bar(monthly_avg['month_name'], monthly_avg['consumption_kwh'],
@@ -247,9 +424,7 @@ def user_dashboard():
 
             with col1:
                 st.markdown("**📈 Daily Patterns**")
-                data_copy = data.copy()
-                data_copy['hour'] = data_copy['date'].dt.hour
-                hourly_avg = data_copy.groupby('hour')['consumption_kwh'].mean()
+                hourly_avg = view['consumption_kwh'].groupby(view['date'].dt.hour.rename('hour')).mean()
 
                 fig, ax = plt.subplots(figsize=(8, 4))
                 ax.plot(hourly_avg.index, hourly_avg.values, marker='o', linewidth=2, color='#2ca02c')
@@ -263,20 +438,46 @@ def user_dashboard():
             with col2:
                 st.markdown("**📊 Consumption Distribution**")
                 fig, ax = plt.subplots(figsize=(8, 4))
-                ax.hist(data['consumption_kwh'], bins=30, alpha=0.7, color='#d62728', edgecolor='black')
+                ax.hist(analytics_data['consumption_kwh'], bins=30, alpha=0.7, color='#d62728', edgecolor='black')
                 ax.set_xlabel('Consumption (kWh)')
                 ax.set_ylabel('Frequency')
                 ax.set_title('Consumption Distribution')
                 ax.grid(True, alpha=0.3)
                 st.pyplot(fig)
 
+            # Streaming anomaly alerts
+            st.markdown("**🚨 Anomaly Alerts**")
+            alerts = get_anomaly_detector().alerts(st.session_state.user['username'], limit=50)
+            if alerts:
+                alerts_df = pd.DataFrame(alerts)[['timestamp', 'kind', 'value', 'expected', 'zscore']]
+                st.warning(f"⚠️ {len(alerts)} unusual readings detected (most recent first)")
+                st.dataframe(alerts_df.round(2), use_container_width=True)
+            else:
+                st.success("✅ No unusual spikes or drops detected.")
+
             # Model training section with enhanced feedback
             st.subheader("🤖 AI Model Training")
             st.markdown("Train a machine learning model to forecast future energy consumption.")
 
+            # Pick up a training job that was queued while the server was busy
+            training_job = st.session_state.get('training_job')
+            if training_job is not None and training_job.done():
+                del st.session_state['training_job']
+                try:
+                    model, message = training_job.result()
+                    if model is None:
+                        st.error(message)
+                    else:
+                        st.session_state.model = model
+                except Exception as e:
+                    st.error(f"❌ Error training model: {str(e)}")
+
             if 'model' in st.session_state:
                 st.success("✅ Forecasting model is already trained and ready!")
                 st.info("💡 You can proceed to generate forecasts in the next tab.")
+            elif 'training_job' in st.session_state:
+                st.info(f"⏳ Training is queued and will run shortly ({get_training_queue().pending} job(s) waiting). "
+                        "Revisit this tab to pick up the model.")
             else:
                 col1, col2 = st.columns([2, 1])
                 with col1:
@@ -286,20 +487,35 @@ def user_dashboard():
                     - Uses time series forecasting techniques
                     - Predicts future consumption based on past trends
                     """)
+                    tune = st.checkbox("🔍 Tune lag depth and regularization", value=False, key="tune_model",
+                                       help="Searches lag windows, feature sets and ridge penalties "
+                                            "with rolling-origin validation. Slower, usually more accurate.")
                 with col2:
                     if st.button("🚀 Train Forecasting Model", key="train_model", use_container_width=True):
                         with st.spinner("🤖 Training AI model... This may take a moment..."):
                             try:
-                                X, y = prepare_data(data)
-                                if len(X) < 7:
-                                    st.error("❌ Need at least 7 days of data to train the model.")
+                                with get_governor().heavy(st.session_state.user['username']):
+                                    model, message = train_and_save(data, tune)
+                                if model is None:
+                                    st.error(message)
                                 else:
-                                    model = train_model(X, y)
-                                    save_model(model)
                                     st.session_state.model = model
                                     st.success("✅ AI Model trained successfully!")
+                                    if tune:
+                                        config = model_config(model)
+                                        st.info(f"🔍 Best configuration: {config['lag_days']}-day window, "
+                                                f"{config['feature_set']} features, ridge α={config['alpha']:g}")
                                     st.info("🎯 The model is now ready for forecasting future consumption!")
                                     st.balloons()
+                            except BudgetExceeded as e:
+                                st.error(f"⏳ {e}")
+                            except ResourceLimitExceeded as e:
+                                # Defer rather than fail: run training on the background queue, still
+                                # in a governor slot and charged to this user
+                                username = st.session_state.user['username']
+                                st.session_state.training_job = get_training_queue().submit(
+                                    username, train_and_save, data, tune)
+                                st.warning(f"⏳ {e} Training has been queued instead.")
                             except Exception as e:
                                 st.error(f"❌ Error training model: {str(e)}")
                                 st.info("💡 Try with more data points or check data quality.")
@@ -325,7 +541,8 @@ def user_dashboard():
             with col2:
                 confidence_level = st.selectbox("🎯 Confidence Level", ["80%", "90%", "95%"], index=1, key="confidence")
             with col3:
-                forecast_type = st.selectbox("📊 Forecast Type", ["Standard", "Conservative", "Optimistic"], index=0, key="forecast_type")
+                forecast_type = st.selectbox("📊 Scenario", list(PRESETS), index=0, key="forecast_type",
+                                             help="Compare more scenarios on the Results tab")
 
             # Forecast explanation
             st.info(f"🤖 The AI will predict energy consumption for the next {days_ahead} days based on patterns learned from your historical data.")
@@ -335,29 +552,40 @@ def user_dashboard():
                 with st.spinner("🔮 AI is generating your energy consumption forecast..."):
                     try:
                         # Get last known data for prediction
-                        last_known = data['consumption_kwh'].values[-7:]  # Last 7 days
-                        predictions = predict_future(st.session_state.model, last_known, days_ahead)
+                        # Model's lag window on a regular grid, so gaps don't shorten it
+                        series = CompactSeries.from_frame(clean_series(data)[0])
+                        model = st.session_state.model
+                        last_known = series.tail(model_config(model)['lag_days'])
 
-                        # Apply forecast type adjustments
-                        if forecast_type == "Conservative":
-                            predictions = predictions * 0.9  # 10% reduction
-                        elif forecast_type == "Optimistic":
-                            predictions = predictions * 1.1  # 10% increase
+                        def compute_forecast(horizon):
+                            with get_governor().heavy(st.session_state.user['username']):
+                                return np.asarray(predict_future(model, last_known, horizon))
+
+                        # Reuse a cached base forecast for the same model and window
+                        base = get_forecast_cache().get_or_compute(
+                            model_version(model), last_known, days_ahead, compute_forecast)
 
                         # Create forecast dates
-                        last_date = data['date'].max()
+                        last_date = pd.Timestamp(series.end)
                         forecast_dates = pd.date_range(start=last_date + pd.Timedelta(days=1), periods=days_ahead)
 
+                        # Scenario adjustments are applied to the base forecast, not re-predicted
+                        predictions = get_scenario_engine().evaluate(
+                            base, [PRESETS[forecast_type]], forecast_dates[0])[0]
+
                         forecast_df = pd.DataFrame({
                             'date': forecast_dates,
                             'predicted_consumption': predictions
                         })
 
                         st.session_state.forecast = forecast_df
+                        st.session_state.base_forecast = base
                         st.success(f"✅ AI Forecast generated for {days_ahead} days!")
                         st.info("📊 Check the Results tab to view your forecast and download the data!")
                         st.balloons()
 
+                    except ResourceLimitExceeded as e:
+                        st.warning(f"⏳ {e} Previously cached forecasts are still available; please try again shortly.")
                     except Exception as e:
                         st.error(f"❌ Error generating forecast: {str(e)}")
                         st.info("💡 Try training the model again or check your data.")
@@ -396,8 +624,11 @@ def user_dashboard():
             st.subheader("📊 Historical vs AI Forecast")
             fig, ax = plt.subplots(figsize=(16, 8))
 
-            # Historical data
-            ax.plot(data['date'], data['consumption_kwh'], label='Historical Data',
+            # Historical data for the selected period
+            index = get_time_index(data)
+            view = date_range_filter(index, "results")
+            plot_dates, plot_values = decimate(view['date'].values, view['consumption_kwh'].values)
+            ax.plot(plot_dates, plot_values, label='Historical Data',
                    color='#1f77b4', linewidth=3, alpha=0.8)
 
             # Forecast data
@@ -405,11 +636,11 @@ def user_dashboard():
                    label='AI Forecast', color='#ff7f0e', linewidth=3, linestyle='--', alpha=0.9)
 
             # Forecast start line
-            ax.axvline(x=data['date'].max(), color='#d62728', linestyle=':', alpha=0.8, linewidth=2,
+            ax.axvline(x=index.end, color='#d62728', linestyle=':', alpha=0.8, linewidth=2,
                       label='Forecast Start')
 
             # Fill areas
-            ax.fill_between(data['date'], data['consumption_kwh'], alpha=0.2, color='#1f77b4')
+            ax.fill_between(plot_dates, plot_values, alpha=0.2, color='#1f77b4')
             ax.fill_between(forecast_df['date'], forecast_df['predicted_consumption'],
                            alpha=0.3, color='#ff7f0e')
 
@@ -490,7 +721,7 @@ def user_dashboard():
             with col2:
                 st.markdown("**📈 Forecast Trend**")
                 fig, ax = plt.subplots(figsize=(8, 4))
-                ax.plot(forecast_df['day'], forecast_df['predicted_consumption'],
+                ax.plot(display_df['day'], forecast_df['predicted_consumption'],
                        marker='o', linewidth=2, color='#2ca02c', markersize=4)
                 ax.set_xlabel('Day')
                 ax.set_ylabel('Predicted Consumption (kWh)')
@@ -498,45 +729,117 @@ def user_dashboard():
                 ax.grid(True, alpha=0.3)
                 st.pyplot(fig)
 
+            # What-if comparison over the base forecast
+            scenario_costs = []
+            if 'base_forecast' in st.session_state and len(st.session_state.base_forecast) == len(forecast_df):
+                st.subheader("🧪 What-if Scenarios")
+                st.markdown("Edit or add rows to compare adjustments. Fractions are entered as decimals "
+                            "(0.15 = 15%); `shift` moves weekday load to the weekend; `load_profile` "
+                            "spreads the added load over the week with seven weights, Monday first.")
+                scenario_table = st.data_editor(
+                    pd.DataFrame([s.to_record() for s in PRESETS.values()]),
+                    num_rows="dynamic", use_container_width=True, key="scenario_table",
+                    column_config={'load_profile': st.column_config.TextColumn(
+                        help="Seven comma-separated weekday weights for the added load; blank for a flat load")})
+                try:
+                    scenarios = [Scenario.from_record(row) for row in scenario_table.to_dict('records')
+                                 if pd.notna(row.get('name')) and str(row['name']).strip()]
+                except (TypeError, ValueError) as e:
+                    st.error(f"❌ Invalid scenario: {str(e)}")
+                    scenarios = []
+
+                if scenarios:
+                    base = st.session_state.base_forecast
+                    results = get_scenario_engine().evaluate(base, scenarios, forecast_df['date'].iloc[0])
+
+                    fig, ax = plt.subplots(figsize=(14, 6))
+                    ax.plot(forecast_df['date'], base, color='black', linewidth=2, label='Base Forecast')
+                    for scenario, row in zip(scenarios, results):
+                        ax.plot(forecast_df['date'], row, linewidth=1.5, alpha=0.8, label=scenario.name)
+                    ax.set_xlabel('Date')
+                    ax.set_ylabel('Predicted Consumption (kWh)')
+                    ax.legend(fontsize=9, ncol=2)
+                    ax.grid(True, alpha=0.3)
+                    ax.tick_params(axis='x', rotation=45)
+                    st.pyplot(fig)
+
+                    st.dataframe(summarize(base, results, scenarios).style.format({
+                        'total_kwh': '{:.0f} kWh', 'average_kwh': '{:.1f} kWh',
+                        'peak_kwh': '{:.1f} kWh', 'change_pct': '{:+.1f}%'
+                    }), use_container_width=True)
+                    scenario_costs = list(zip((s.name for s in scenarios), results))
+
+            # Bills under each tariff plan, for the forecast and the same number of past days
+            st.subheader("💰 Cost Estimate")
+            plan_names = st.multiselect("Tariff plans", list(PLANS), default=list(PLANS), key="tariff_plans")
+            if plan_names:
+                plans = [PLANS[name] for name in plan_names]
+                # The same span of days, however many readings per day the history has
+                days = len(forecast_df)
+                recent = index.between(index.end - pd.Timedelta(days=days) + pd.Timedelta(1, 'ns'), None)
+                past = compute_costs(recent['date'].values, recent['consumption_kwh'].values, plans)
+                # The forecast and every what-if scenario are billed together, one row each
+                rows = np.vstack([forecast_df['predicted_consumption'].to_numpy()] +
+                                 [values for _, values in scenario_costs])
+                future = compute_costs(forecast_df['date'].values, rows, plans)
+
+                cost_df = pd.DataFrame({
+                    'plan': plan_names,
+                    'past_cost': past['total'][:, 0],
+                    'forecast_cost': future['total'][:, 0],
+                    'energy': future['energy'][:, 0],
+                    'demand': future['demand'][:, 0],
+                    'fixed': future['fixed'][:, 0],
+                })
+                cost_df['change_pct'] = (cost_df['forecast_cost'] / cost_df['past_cost'] - 1) * 100
+                cost_df['rate_per_kwh'] = cost_df['forecast_cost'] / future['kwh'][:, 0]
+                money = f"{CURRENCY}{{:,.2f}}"
+                st.markdown(f"Forecast costs compared with the last {days} days of history.")
+                st.dataframe(cost_df.style.format({
+                    'past_cost': money, 'forecast_cost': money, 'energy': money, 'demand': money,
+                    'fixed': money, 'change_pct': '{:+.1f}%', 'rate_per_kwh': f"{CURRENCY}{{:.3f}}"
+                }), use_container_width=True)
+
+                fig, ax = plt.subplots(figsize=(14, 5))
+                for name, daily in zip(plan_names, future['cost'][:, 0, :]):
+                    ax.plot(forecast_df['date'], np.cumsum(daily), linewidth=2, label=name)
+                ax.set_xlabel('Date')
+                ax.set_ylabel(f'Cumulative Energy Cost ({CURRENCY})')
+                ax.legend(fontsize=9)
+                ax.grid(True, alpha=0.3)
+                ax.tick_params(axis='x', rotation=45)
+                st.pyplot(fig)
+
+                if scenario_costs:
+                    st.markdown("**Forecast cost by scenario**")
+                    st.dataframe(pd.DataFrame(future['total'][:, 1:].T, columns=plan_names,
+                                              index=[name for name, _ in scenario_costs])
+                                 .style.format(money), use_container_width=True)
+
             # Download options with enhanced UI
             st.subheader("💾 Download Your Results")
             st.markdown("Export your AI forecast data for further analysis or reporting.")
 
-            col1, col2, col3 = st.columns(3)
+            col1, col2 = st.columns(2)
             with col1:
-                csv_forecast = forecast_df.to_csv(index=False)
-                st.download_button(
-                    label="📥 Download Forecast CSV",
-                    data=csv_forecast,
-                    file_name=f"energy_forecast_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
-                    mime="text/csv",
-                    key="download_forecast",
-                    use_container_width=True
-                )
-
+                export_format = st.selectbox("📄 Format", list(EXPORT_FORMATS), key="export_format")
             with col2:
-                # Combined historical + forecast data
-                combined_df = pd.concat([
-                    data[['date', 'consumption_kwh']].assign(data_type='historical'),
-                    forecast_df.rename(columns={'predicted_consumption': 'consumption_kwh'}).assign(data_type='forecast')
-                ], ignore_index=True)
-                csv_combined = combined_df.to_csv(index=False)
-                st.download_button(
-                    label="📥 Download Combined Data CSV",
-                    data=csv_combined,
-                    file_name=f"energy_data_complete_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
-                    mime="text/csv",
-                    key="download_combined",
-                    use_container_width=True
-                )
+                compress = st.checkbox("🗜️ Compress", value=False, key="export_compress",
+                                       disabled=export_format == "Excel",
+                                       help="gzip for CSV, zstd for Parquet")
 
-            with col3:
-                # Summary report
+            # Exports are only rendered on request and dropped when the data or forecast changes
+            export_version = (id(data), id(forecast_df))
+            if st.session_state.get('exports_version') != export_version:
+                st.session_state.exports = {}
+                st.session_state.exports_version = export_version
+
+            def summary_chunks():
                 summary_data = {
                     'Metric': ['Historical Period', 'Forecast Period', 'Historical Average', 'Forecast Average',
                               'Change %', 'Peak Historical', 'Peak Forecast'],
                     'Value': [
-                        f"{data['date'].min().date()} to {data['date'].max().date()}",
+                        f"{index.start.date()} to {index.end.date()}",
                         f"{forecast_df['date'].min().date()} to {forecast_df['date'].max().date()}",
                         f"{hist_avg:.2f} kWh",
                         f"{forecast_avg:.2f} kWh",
@@ -545,16 +848,19 @@ def user_dashboard():
                         f"{forecast_df['predicted_consumption'].max():.2f} kWh"
                     ]
                 }
-                summary_df = pd.DataFrame(summary_data)
-                csv_summary = summary_df.to_csv(index=False)
-                st.download_button(
-                    label="📊 Download Summary Report",
-                    data=csv_summary,
-                    file_name=f"forecast_summary_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
-                    mime="text/csv",
-                    key="download_summary",
-                    use_container_width=True
-                )
+                yield pd.DataFrame(summary_data)
+
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                export_button("forecast", "Forecast", "energy_forecast",
+                              lambda: iter_chunks(forecast_df), export_format, compress)
+            with col2:
+                # Combined historical + forecast data, streamed chunk by chunk
+                export_button("combined", "Combined Data", "energy_data_complete",
+                              lambda: combined_chunks(data, forecast_df), export_format, compress)
+            with col3:
+                export_button("summary", "Summary Report", "forecast_summary",
+                              summary_chunks, export_format, compress)
 
             # Final message
             st.success("🎉 Your AI-powered energy consumption forecast is complete!")
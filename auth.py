@@ -1,16 +1,157 @@
 import pandas as pd
 import os
+import re
+import time
+import base64
 import hashlib
+import hmac
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 import streamlit as st
 from datetime import datetime
+from metrics_store import record_user_counts
+from sessions import get_session_manager
+from storage import file_lock, save_excel
 
 # File paths
 USERS_FILE = 'users.xlsx'
 ADMIN_USERS_FILE = 'admin_users.xlsx'
 
+# Password hashing parameters (scrypt: ~16 MB and a few tens of ms per hash)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+PASSWORD_SCHEME = 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256'
+
+# Verification runs on a small pool so a login burst cannot take every core
+VERIFY_WORKERS = int(os.environ.get('ECOWATT_VERIFY_WORKERS', 2))
+VERIFY_MAX_PENDING = int(os.environ.get('ECOWATT_VERIFY_MAX_PENDING', 32))
+VERIFY_TIMEOUT = 10
+
+# Per-user login attempt limit
+LOGIN_ATTEMPTS = 5
+LOGIN_WINDOW_SECONDS = 60
+
+_LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+class LoginThrottled(Exception):
+    """Raised when a login attempt is rejected before the password is checked"""
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
 def hash_password(password):
-    """Hash password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with a random salt using scrypt (PBKDF2-SHA256 if scrypt is unavailable)"""
+    salt = os.urandom(SALT_BYTES)
+    if PASSWORD_SCHEME == 'scrypt':
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored hash.
+    Returns (matches, needs_rehash); legacy unsalted SHA-256 hashes and
+    hashes made with older parameters are flagged for rehashing.
+    """
+    stored = str(stored)
+    if _LEGACY_SHA256.match(stored):
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(candidate, stored), True
+
+    parts = stored.split('$')
+    if parts[0] == 'scrypt' and len(parts) == 6:
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        salt, expected = base64.b64decode(parts[4]), base64.b64decode(parts[5])
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=len(expected))
+        current = PASSWORD_SCHEME == 'scrypt' and (n, r, p) == (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return hmac.compare_digest(digest, expected), not current
+    if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        iterations = int(parts[1])
+        salt, expected = base64.b64decode(parts[2]), base64.b64decode(parts[3])
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=len(expected))
+        current = PASSWORD_SCHEME == 'pbkdf2_sha256' and iterations == PBKDF2_ITERATIONS
+        return hmac.compare_digest(digest, expected), not current
+    return False, False
+
+# Hash checked for unknown usernames so response time doesn't reveal which names exist
+_DUMMY_HASH = hash_password('ecowatt-dummy-password')
+
+_verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='ecowatt-verify')
+_verify_slots = threading.BoundedSemaphore(VERIFY_MAX_PENDING)
+_attempts = {}
+_attempts_lock = threading.Lock()
+_attempts_pruned = [0.0]
+
+def _prune_attempts(now):
+    """Drop usernames whose attempts have all expired; runs at most once per window"""
+    if now - _attempts_pruned[0] < LOGIN_WINDOW_SECONDS:
+        return
+    _attempts_pruned[0] = now
+    for key in [k for k, a in _attempts.items() if not a or now - a[-1] > LOGIN_WINDOW_SECONDS]:
+        del _attempts[key]
+
+def _check_rate_limit(username, user_type):
+    """Record a login attempt, raising LoginThrottled past the per-user limit"""
+    now = time.monotonic()
+    with _attempts_lock:
+        _prune_attempts(now)
+        attempts = _attempts.setdefault((user_type, username), deque())
+        while attempts and now - attempts[0] > LOGIN_WINDOW_SECONDS:
+            attempts.popleft()
+        if len(attempts) >= LOGIN_ATTEMPTS:
+            retry_in = int(LOGIN_WINDOW_SECONDS - (now - attempts[0])) + 1
+            raise LoginThrottled(f"Too many login attempts. Try again in {retry_in} seconds.")
+        attempts.append(now)
+
+def _clear_rate_limit(username, user_type):
+    with _attempts_lock:
+        _attempts.pop((user_type, username), None)
+
+def _submit_bounded(fn, *args):
+    """
+    Submit a hashing job to the worker pool, or return None when too many are
+    queued. The slot is held until the job itself finishes, not just until a
+    caller stops waiting, so timed-out checks still count against the cap.
+    """
+    if not _verify_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _verify_pool.submit(fn, *args)
+    except BaseException:
+        _verify_slots.release()
+        raise
+    future.add_done_callback(lambda _: _verify_slots.release())
+    return future
+
+def _verify_bounded(password, stored):
+    """
+    Verify on the worker pool, refusing work when too many checks are queued.
+    A check that does not finish within VERIFY_TIMEOUT counts as a mismatch.
+    """
+    future = _submit_bounded(verify_password, password, stored)
+    if future is None:
+        raise LoginThrottled("The server is busy. Please try again in a moment.")
+    try:
+        return future.result(timeout=VERIFY_TIMEOUT)
+    except FuturesTimeout:
+        future.cancel()
+        return False, False
+
+def _rehash_bounded(password):
+    """New hash computed on the worker pool, or None if the pool is busy or slow (retried next login)"""
+    future = _submit_bounded(hash_password, password)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=VERIFY_TIMEOUT)
+    except FuturesTimeout:
+        future.cancel()
+        return None
 
 def init_user_files():
     """Initialize user data files if they don't exist"""
@@ -37,7 +178,7 @@ def init_user_files():
             }
         ]
         users_df = pd.DataFrame(sample_users)
-        users_df.to_excel(USERS_FILE, index=False)
+        save_users(users_df)
 
     # Admin users file
     if not os.path.exists(ADMIN_USERS_FILE):
@@ -52,7 +193,7 @@ def init_user_files():
             'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }]
         admin_df = pd.DataFrame(sample_admin)
-        admin_df.to_excel(ADMIN_USERS_FILE, index=False)
+        save_admin_users(admin_df)
 
 def load_users():
     """Load regular users from Excel file"""
@@ -68,57 +209,90 @@ def load_admin_users():
 
 def save_users(users_df):
     """Save users to Excel file"""
-    users_df.to_excel(USERS_FILE, index=False)
+    save_excel(users_df, USERS_FILE)
+    record_user_counts(users=users_df)
 
 def save_admin_users(admin_df):
     """Save admin users to Excel file"""
-    admin_df.to_excel(ADMIN_USERS_FILE, index=False)
+    save_excel(admin_df, ADMIN_USERS_FILE)
+    record_user_counts(admins=admin_df)
+
+def _users_file(user_type):
+    return ADMIN_USERS_FILE if user_type == 'admin' else USERS_FILE
 
 def authenticate_user(username, password, user_type='user'):
-    """Authenticate user login"""
-    hashed_password = hash_password(password)
+    """
+    Authenticate user login.
+    Raises LoginThrottled when the user is rate limited or the server is busy.
+    """
+    _check_rate_limit(username, user_type)
 
     if user_type == 'admin':
         users_df = load_admin_users()
     else:
         users_df = load_users()
 
-    user = users_df[(users_df['username'] == username) & (users_df['password'] == hashed_password)]
-    if not user.empty:
-        return user.iloc[0].to_dict()
-    return None
+    matches = users_df.index[users_df['username'] == username]
+    if len(matches) == 0:
+        _verify_bounded(password, _DUMMY_HASH)
+        return None
+
+    row = matches[0]
+    valid, needs_rehash = _verify_bounded(password, users_df.at[row, 'password'])
+    if not valid:
+        return None
+
+    _clear_rate_limit(username, user_type)
+    user = users_df.loc[row].to_dict()
+    new_hash = _rehash_bounded(password) if needs_rehash else None
+    if new_hash is not None:
+        # Transparently migrate legacy or outdated hashes on successful login;
+        # re-read under the lock so concurrent registrations are not lost
+        with file_lock(_users_file(user_type)):
+            users_df = load_admin_users() if user_type == 'admin' else load_users()
+            users_df.loc[users_df['username'] == username, 'password'] = new_hash
+            if user_type == 'admin':
+                save_admin_users(users_df)
+            else:
+                save_users(users_df)
+        user['password'] = new_hash
+    return user
 
 def register_user(username, password, email, full_name, user_type='user'):
     """Register a new user"""
-    if user_type == 'admin':
-        users_df = load_admin_users()
-    else:
-        users_df = load_users()
+    # Hash before taking the lock so the expensive part doesn't serialize registrations
+    password_hash = hash_password(password)
 
-    # Check if username already exists
-    if username in users_df['username'].values:
-        return False, "Username already exists"
+    with file_lock(_users_file(user_type)):
+        if user_type == 'admin':
+            users_df = load_admin_users()
+        else:
+            users_df = load_users()
 
-    # Check if email already exists
-    if email in users_df['email'].values:
-        return False, "Email already exists"
+        # Check if username already exists
+        if username in users_df['username'].values:
+            return False, "Username already exists"
 
-    # Add new user
-    new_user = {
-        'username': username,
-        'password': hash_password(password),
-        'email': email,
-        'full_name': full_name,
-        'role': user_type,
-        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
+        # Check if email already exists
+        if email in users_df['email'].values:
+            return False, "Email already exists"
 
-    users_df = pd.concat([users_df, pd.DataFrame([new_user])], ignore_index=True)
+        # Add new user
+        new_user = {
+            'username': username,
+            'password': password_hash,
+            'email': email,
+            'full_name': full_name,
+            'role': user_type,
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
 
-    if user_type == 'admin':
-        save_admin_users(users_df)
-    else:
-        save_users(users_df)
+        users_df = pd.concat([users_df, pd.DataFrame([new_user])], ignore_index=True)
+
+        if user_type == 'admin':
+            save_admin_users(users_df)
+        else:
+            save_users(users_df)
 
     return True, "Registration successful"
 
@@ -132,16 +306,20 @@ def get_all_admin_users():
 
 def delete_user(username, user_type='user'):
     """Delete a user"""
-    if user_type == 'admin':
-        users_df = load_admin_users()
-    else:
-        users_df = load_users()
+    with file_lock(_users_file(user_type)):
+        if user_type == 'admin':
+            users_df = load_admin_users()
+        else:
+            users_df = load_users()
 
-    users_df = users_df[users_df['username'] != username]
+        users_df = users_df[users_df['username'] != username]
 
-    if user_type == 'admin':
-        save_admin_users(users_df)
-    else:
-        save_users(users_df)
+        if user_type == 'admin':
+            save_admin_users(users_df)
+        else:
+            save_users(users_df)
+
+    # Sign the user out everywhere
+    get_session_manager().revoke_user(username, user_type)
 
     return True, "User deleted successfully"
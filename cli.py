@@ -0,0 +1,404 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from export import EXPORT_FORMATS, meter_chunks, write_export
+from ingestion import DEDUPE_POLICIES, merge_readings
+from model import (DEFAULT_CONFIG, evaluate_model, load_model, model_config, model_version, predict_future,
+                   prepare_data, train_model)
+from pooled import DEFAULT_CLUSTERS, GLOBAL_MODEL_FILE, METER_DATA_DIR, GlobalModel, global_model_path
+from preprocessing import clean_series
+from scenarios import PRESETS, get_scenario_engine
+from storage import atomic_write, file_lock, save_csv, save_joblib
+from timeseries import CompactSeries
+from tuning import DEFAULT_FOLDS, DEFAULT_FOLD_SIZE, rolling_origin_folds, score_trial, shared_lag_block, train_tuned
+
+MODEL_SUBDIR = 'models'
+OUTPUT_SUBDIR = 'output'
+
+# Result columns, fixed up front so rows can be streamed out as meters finish
+TRAIN_COLUMNS = ['meter_id', 'rows', 'lag_days', 'feature_set', 'alpha', 'mse', 'test_points',
+                 'model_version', 'error']
+BACKTEST_COLUMNS = ['meter_id', 'folds', 'mse', 'rmse', 'worst_fold_mse', 'lag_days', 'error']
+
+
+class Timings:
+    """Wall-clock time per stage and per meter, for the run summary"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def start(self, stage):
+        self.stages[stage] = {'seconds': [], 'failed': 0, 'started': time.perf_counter()}
+
+    def add(self, stage, seconds, failed=False):
+        entry = self.stages[stage]
+        entry['seconds'].append(seconds)
+        entry['failed'] += int(failed)
+
+    def finish(self, stage):
+        entry = self.stages[stage]
+        entry['wall'] = time.perf_counter() - entry['started']
+
+    def summary(self):
+        rows = []
+        for stage, entry in self.stages.items():
+            seconds = np.asarray(entry['seconds'] or [0.0])
+            rows.append({
+                'stage': stage,
+                'meters': len(entry['seconds']),
+                'failed': entry['failed'],
+                'wall_s': round(entry.get('wall', 0.0), 3),
+                'mean_s': round(float(seconds.mean()), 4),
+                'p95_s': round(float(np.percentile(seconds, 95)), 4),
+                'max_s': round(float(seconds.max()), 4),
+            })
+        return pd.DataFrame(rows)
+
+
+def meter_files(data_dir, meters=None):
+    """{meter_id: path} for the meter CSVs in a directory"""
+    paths = sorted(glob.glob(os.path.join(data_dir, '*.csv')))
+    files = {os.path.splitext(os.path.basename(p))[0]: p for p in paths}
+    if meters:
+        missing = set(meters) - set(files)
+        if missing:
+            raise SystemExit(f"Unknown meters: {', '.join(sorted(missing))}")
+        files = {m: files[m] for m in meters}
+    return files
+
+
+def model_path(data_dir, meter_id):
+    return os.path.join(data_dir, MODEL_SUBDIR, f"{meter_id}.pkl")
+
+
+def load_series(path):
+    """Read one meter file onto a regular, gap-filled grid"""
+    df = pd.read_csv(path, parse_dates=['date'])
+    return CompactSeries.from_frame(clean_series(df[['date', 'consumption_kwh']])[0])
+
+
+def _timed(fn, meter_id, *args):
+    started = time.perf_counter()
+    try:
+        result, error = fn(meter_id, *args), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    return meter_id, result, error, time.perf_counter() - started
+
+
+def _train_meter(meter_id, path, data_dir, tune):
+    series = load_series(path)
+    if tune:
+        # Trials run inline: the batch already parallelizes across meters
+        model, X, y = train_tuned(series, workers=1)
+    else:
+        model = None
+    if model is None:
+        X, y = prepare_data(series)
+        model = train_model(X, y)
+    mse, test_points = evaluate_model(model, X, y)
+    save_joblib(model, model_path(data_dir, meter_id))
+    config = model_config(model)
+    return {'rows': len(series), 'lag_days': config['lag_days'], 'feature_set': config['feature_set'],
+            'alpha': config['alpha'], 'mse': mse, 'test_points': test_points,
+            'model_version': model_version(model)}
+
+
+def _backtest_meter(meter_id, path, data_dir, n_folds, fold_size):
+    model = load_model(model_path(data_dir, meter_id))
+    config = model_config(model) if model is not None else DEFAULT_CONFIG
+    block = shared_lag_block(load_series(path), config['lag_days'])
+    folds = rolling_origin_folds(len(block), n_folds, fold_size)
+    if not folds:
+        raise ValueError("not enough history for a backtest")
+    errors = np.array([score_trial(block, config, fold) for fold in folds])
+    return {'folds': len(folds), 'mse': float(errors.mean()), 'rmse': float(np.sqrt(errors.mean())),
+            'worst_fold_mse': float(errors.max()), 'lag_days': config['lag_days']}
+
+
+def _load_meter(meter_id, path):
+    return load_series(path)
+
+
+def _forecast_frame(series, base, scenario):
+    """Apply the scenario to a base forecast starting the day after the series ends"""
+    dates = pd.date_range(pd.Timestamp(series.end) + pd.Timedelta(days=1), periods=len(base))
+    predictions = get_scenario_engine().evaluate(base, [PRESETS[scenario]], dates[0])[0]
+    return pd.DataFrame({'date': dates, 'predicted_consumption': predictions, 'scenario': scenario})
+
+
+def _forecast_meter(meter_id, path, data_dir, days, scenario):
+    model = load_model(model_path(data_dir, meter_id))
+    if model is None:
+        raise ValueError("no trained model; run `train` first")
+    series = load_series(path)
+    return _forecast_frame(series, predict_future(model, series, days), scenario)
+
+
+def run_meters(fn, files, workers, timings, stage, *args):
+    """
+    Run `fn(meter_id, path, *args)` for every meter, in a process pool when
+    workers > 1, yielding (meter_id, result, error) as each one finishes.
+    """
+    timings.start(stage)
+    if workers <= 1 or len(files) <= 1:
+        for meter_id, path in files.items():
+            meter_id, result, error, seconds = _timed(fn, meter_id, path, *args)
+            timings.add(stage, seconds, error is not None)
+            yield meter_id, result, error
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_timed, fn, meter_id, path, *args) for meter_id, path in files.items()]
+            for future in as_completed(futures):
+                meter_id, result, error, seconds = future.result()
+                timings.add(stage, seconds, error is not None)
+                yield meter_id, result, error
+    timings.finish(stage)
+
+
+def _report(meter_id, error, out=sys.stderr):
+    if error is not None:
+        print(f"  {meter_id}: FAILED {error}", file=out)
+
+
+def cmd_ingest(args, timings):
+    """Merge new reading files into the per-meter series"""
+    timings.start('ingest')
+    for source in args.sources:
+        readings = pd.read_csv(source, parse_dates=['date'], dtype={'meter_id': str})
+        if 'meter_id' in readings.columns:
+            groups = readings.groupby('meter_id')
+        else:
+            groups = [(args.meter or os.path.splitext(os.path.basename(source))[0], readings)]
+        for meter_id, new in groups:
+            t0 = time.perf_counter()
+            path = os.path.join(args.data_dir, f"{meter_id}.csv")
+            # Hold the lock across the read-merge-write so concurrent ingests can't drop readings
+            with file_lock(path):
+                existing = pd.read_csv(path, parse_dates=['date']) if os.path.exists(path) else None
+                merged, stats = merge_readings(existing, new[['date', 'consumption_kwh']], args.dedupe)
+                save_csv(merged, path)
+            timings.add('ingest', time.perf_counter() - t0)
+            print(f"  {meter_id}: {stats['received']} received, {stats['duplicates']} duplicates, "
+                  f"{len(merged)} rows")
+    timings.finish('ingest')
+    return 0
+
+
+def _stream_table(rows, path, columns):
+    """Write result rows to CSV as they arrive; the file appears atomically at the end"""
+    failed = 0
+    with atomic_write(path, 'w', newline='') as f:
+        header = True
+        for meter_id, result, error in rows:
+            _report(meter_id, error)
+            failed += error is not None
+            record = {'meter_id': meter_id, **(result or {}), 'error': error}
+            pd.DataFrame([record], columns=columns).to_csv(f, index=False, header=header)
+            header = False
+    return failed
+
+
+def _load_all(files, args, timings):
+    """{meter_id: CompactSeries} for every meter that loads; failures are reported"""
+    series = {}
+    for meter_id, result, error in run_meters(_load_meter, files, args.workers, timings, 'load'):
+        _report(meter_id, error)
+        if error is None:
+            series[meter_id] = result
+    return series
+
+
+def _train_global(files, args, timings):
+    """One pooled model for all meters; rows report each meter's fit"""
+    series = _load_all(files, args, timings)
+    if not series:
+        raise SystemExit("No meter series could be loaded")
+    timings.start('train')
+    started = time.perf_counter()
+    try:
+        model = GlobalModel(n_clusters=args.clusters).fit(series)
+    except ValueError as e:
+        # Too little history or too few meters: every meter's row reports the failure
+        timings.add('train', time.perf_counter() - started, True)
+        timings.finish('train')
+        for meter_id in series:
+            yield meter_id, None, str(e)
+        return
+    save_joblib(model, global_model_path(args.data_dir))
+    timings.add('train', time.perf_counter() - started)
+    timings.finish('train')
+
+    version = model_version(model)
+    for meter_id, meter_series in series.items():
+        X, y = prepare_data(meter_series, lag_days=model.lag_days)
+        mse, test_points = evaluate_model(model.meter_model(meter_id), X, y) if len(y) else (None, 0)
+        yield meter_id, {'rows': len(meter_series), 'lag_days': model.lag_days, 'feature_set': 'lags',
+                         'alpha': model.alpha, 'mse': mse, 'test_points': test_points,
+                         'model_version': version}, None
+
+
+def cmd_train(args, timings):
+    files = meter_files(args.data_dir, args.meters)
+    os.makedirs(os.path.join(args.data_dir, MODEL_SUBDIR), exist_ok=True)
+    if args.pooled:
+        rows = _train_global(files, args, timings)
+        return _stream_table(rows, os.path.join(args.output_dir, 'train_results.csv'), TRAIN_COLUMNS)
+    rows = run_meters(_train_meter, files, args.workers, timings, 'train', args.data_dir, args.tune)
+    return _stream_table(rows, os.path.join(args.output_dir, 'train_results.csv'), TRAIN_COLUMNS)
+
+
+def cmd_backtest(args, timings):
+    files = meter_files(args.data_dir, args.meters)
+    rows = run_meters(_backtest_meter, files, args.workers, timings, 'backtest',
+                      args.data_dir, args.folds, args.fold_size)
+    return _stream_table(rows, os.path.join(args.output_dir, 'backtest_results.csv'), BACKTEST_COLUMNS)
+
+
+def _forecast_global(files, args, timings):
+    """Forecast every meter from the pooled model in one batched pass"""
+    model = load_model(global_model_path(args.data_dir))
+    if model is None:
+        raise SystemExit("No global model; run `train --global` first")
+    series = _load_all(files, args, timings)
+    timings.start('forecast')
+    started = time.perf_counter()
+    meter_ids, predictions = model.forecast(series, args.days)
+    frames = [(meter_id, _forecast_frame(series[meter_id], base, args.scenario), None)
+              for meter_id, base in zip(meter_ids, predictions)]
+    timings.add('forecast', time.perf_counter() - started)
+    timings.finish('forecast')
+    return frames
+
+
+def cmd_forecast(args, timings):
+    files = meter_files(args.data_dir, args.meters)
+    if args.pooled:
+        rows = _forecast_global(files, args, timings)
+    else:
+        rows = run_meters(_forecast_meter, files, args.workers, timings, 'forecast',
+                          args.data_dir, args.days, args.scenario)
+    failed = 0
+    with atomic_write(os.path.join(args.output_dir, 'forecast.csv'), 'w', newline='') as f:
+        header = True
+        for meter_id, forecast, error in rows:
+            _report(meter_id, error)
+            if error is not None:
+                failed += 1
+                continue
+            forecast.insert(0, 'meter_id', meter_id)
+            forecast.to_csv(f, index=False, header=header)
+            header = False
+    return failed
+
+
+def cmd_export(args, timings):
+    """Bundle history (and the latest forecast, if any) into one export file"""
+    timings.start('export')
+    started = time.perf_counter()
+    files = meter_files(args.data_dir, args.meters)
+    forecast_path = os.path.join(args.output_dir, 'forecast.csv')
+    forecasts = {}
+    if os.path.exists(forecast_path) and not args.history_only:
+        forecasts = dict(tuple(pd.read_csv(forecast_path, parse_dates=['date'], dtype={'meter_id': str})
+                               .groupby('meter_id')))
+
+    def frames():
+        # One meter in memory at a time
+        for meter_id, path in files.items():
+            history = pd.read_csv(path, parse_dates=['date'])[['date', 'consumption_kwh']]
+            yield meter_id, history.assign(data_type='historical')
+            if meter_id in forecasts:
+                forecast = forecasts[meter_id].rename(columns={'predicted_consumption': 'consumption_kwh'})
+                yield meter_id, forecast[['date', 'consumption_kwh']].assign(data_type='forecast')
+
+    def chunks():
+        for meter_id, frame in frames():
+            yield from meter_chunks({meter_id: frame})
+
+    extension = EXPORT_FORMATS[args.format][0]
+    suffix = '.gz' if args.compress and args.format == 'CSV' else ''
+    path = os.path.join(args.output_dir, f"export.{extension}{suffix}")
+    with atomic_write(path) as f:
+        write_export(chunks(), f, args.format, args.compress)
+    timings.add('export', time.perf_counter() - started)
+    timings.finish('export')
+    print(f"  wrote {path}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="EcoWatt batch forecasting pipeline")
+    parser.add_argument('--data-dir', default=METER_DATA_DIR, help="directory of <meter_id>.csv series")
+    parser.add_argument('--output-dir', help="where results are written (default: <data-dir>/output)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="parallel meter workers")
+    parser.add_argument('--timing-file', help="also write the timing summary as JSON")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help="merge new readings into the meter series")
+    ingest.add_argument('sources', nargs='+', help="CSV files with date, consumption_kwh[, meter_id]")
+    ingest.add_argument('--meter', help="meter id for sources without a meter_id column (default: file name)")
+    ingest.add_argument('--dedupe', choices=DEDUPE_POLICIES, default='last')
+    ingest.set_defaults(func=cmd_ingest)
+
+    train = commands.add_parser('train', help="train one model per meter")
+    train.add_argument('--tune', action='store_true', help="search lag depth and regularization first")
+    train.add_argument('--clusters', type=int, default=DEFAULT_CLUSTERS,
+                       help="with --global, group meters by weekly shape into this many clusters")
+    train.set_defaults(func=cmd_train)
+
+    backtest = commands.add_parser('backtest', help="rolling-origin backtest of each meter's model settings")
+    backtest.add_argument('--folds', type=int, default=DEFAULT_FOLDS)
+    backtest.add_argument('--fold-size', type=int, default=DEFAULT_FOLD_SIZE)
+    backtest.set_defaults(func=cmd_backtest)
+
+    forecast = commands.add_parser('forecast', help="forecast every meter")
+    forecast.add_argument('--days', type=int, default=30)
+    forecast.add_argument('--scenario', choices=list(PRESETS), default='Standard')
+    forecast.set_defaults(func=cmd_forecast)
+
+    export = commands.add_parser('export', help="export history and forecasts in one file")
+    export.add_argument('--format', choices=list(EXPORT_FORMATS), default='CSV')
+    export.add_argument('--compress', action='store_true')
+    export.add_argument('--history-only', action='store_true')
+    export.set_defaults(func=cmd_export)
+
+    for sub in (train, backtest, forecast, export):
+        sub.add_argument('--meters', nargs='+', help="limit to these meter ids")
+    for sub in (train, forecast):
+        sub.add_argument('--global', dest='pooled', action='store_true',
+                         help=f"one pooled model for all meters (<data-dir>/{GLOBAL_MODEL_FILE})")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.output_dir = args.output_dir or os.path.join(args.data_dir, OUTPUT_SUBDIR)
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    timings = Timings()
+    started = time.perf_counter()
+    failed = args.func(args, timings)
+
+    summary = timings.summary()
+    print(f"\n{args.command} finished in {time.perf_counter() - started:.2f}s")
+    if not summary.empty:
+        print(summary.to_string(index=False))
+    if args.timing_file:
+        with atomic_write(args.timing_file, 'w') as f:
+            json.dump({'command': args.command, 'total_s': time.perf_counter() - started,
+                       'stages': summary.to_dict('records')}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -39,6 +39,7 @@ def generate_energy_data(start_date='2020-01-01', periods=365*2, freq='D'):
     return df
 
 if __name__ == "__main__":
+    from retention import get_store
     data = generate_energy_data()
-    data.to_csv('energy_data.csv', index=False)
+    get_store().replace(data)
     print("Synthetic energy data generated and saved to energy_data.csv")
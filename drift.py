@@ -0,0 +1,458 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from governor import get_training_queue
+from model import (DEFAULT_CONFIG, evaluate_model, feature_args, load_model, model_config, model_version,
+                   predict_future, prepare_data, save_model, train_model)
+from pooled import get_global_model
+from preprocessing import clean_series
+from retention import get_store, load_history
+from storage import file_lock, save_csv, save_json
+from timeseries import CompactSeries
+from tuning import train_tuned
+
+DATA_FILE = 'energy_data.csv'
+MODEL_FILE = 'energy_model.pkl'
+MODEL_DIR = 'meter_models'
+FORECAST_LOG_FILE = 'forecast_log.csv'
+DRIFT_STATE_FILE = 'drift_state.json'
+
+# Key for the system-wide series when the data has no meter_id column
+SYSTEM_METER = 'system'
+
+DEFAULT_ALPHA = 0.05           # EWMA weight of each newly scored day
+DEFAULT_THRESHOLD = 3.0        # drift when rolling MSE exceeds this multiple of the baseline
+DEFAULT_FULL_RATIO = 4.0       # beyond this multiple a full (re-tuned) retrain is scheduled
+DEFAULT_MIN_POINTS = 28        # scored days needed before a meter can be flagged
+DEFAULT_HORIZON = 14           # days of forecast logged per check
+INCREMENTAL_DAYS = 365         # days of history used by an incremental refit
+
+DAY_NS = pd.Timedelta(days=1).value
+
+
+def meter_model_path(meter_id):
+    """Model file for a meter; the system series uses the main model file"""
+    if meter_id == SYSTEM_METER:
+        return MODEL_FILE
+    return os.path.join(MODEL_DIR, f"{meter_id}.pkl")
+
+
+def load_meter_model(meter_id, global_model_file=None):
+    """
+    The meter's own model, then the global pooled model's view of it, then
+    the system model. The global model defaults to the one `cli.py train
+    --global` saves in the meter data directory.
+    """
+    path = meter_model_path(meter_id)
+    if os.path.exists(path):
+        return load_model(path)
+    pooled = get_global_model(global_model_file)
+    if pooled is not None and meter_id in pooled.meters:
+        return pooled.meter_model(meter_id)
+    return load_model(MODEL_FILE)
+
+
+def series_step(series):
+    """Sampling step of a cleaned series in ns, one day if it has too few points to tell"""
+    return series.step or DAY_NS
+
+
+def steps_per_day(series):
+    """Samples per day (1 for daily or coarser data)"""
+    return max(DAY_NS // series_step(series), 1)
+
+
+def meter_series(data):
+    """Yield (meter_id, CompactSeries) for every meter in a readings frame"""
+    if 'meter_id' not in data.columns:
+        yield SYSTEM_METER, CompactSeries.from_frame(clean_series(data[['date', 'consumption_kwh']])[0])
+        return
+    for meter_id, readings in data.groupby('meter_id'):
+        yield str(meter_id), CompactSeries.from_frame(clean_series(readings[['date', 'consumption_kwh']])[0])
+
+
+class ForecastLog:
+    """
+    Latest issued prediction per (meter, target date), kept as sorted int64
+    date / float32 value arrays per meter so actuals can be matched with one
+    searchsorted.
+    """
+
+    def __init__(self):
+        self._meters = {}
+        self._issued = {}
+        self._lock = threading.Lock()
+
+    def record(self, meter_id, dates, predictions, version=None, origin=None):
+        """
+        Store a forecast; later forecasts replace earlier ones for the same
+        dates. `origin` is the last data timestamp the forecast was made from.
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]').astype(np.int64)
+        predictions = np.asarray(predictions, dtype=np.float32)
+        with self._lock:
+            old_dates, old_values, _ = self._meters.get(meter_id, (dates[:0], predictions[:0], None))
+            keep = ~np.isin(old_dates, dates)
+            merged_dates = np.concatenate([old_dates[keep], dates])
+            merged_values = np.concatenate([old_values[keep], predictions])
+            order = np.argsort(merged_dates, kind='stable')
+            self._meters[meter_id] = (merged_dates[order], merged_values[order], version)
+            self._issued[meter_id] = (version, origin)
+
+    def match(self, meter_id, dates, after=None):
+        """
+        Logged predictions for the given actual dates. Returns (mask, predicted)
+        where mask marks dates that had a forecast (and fall after `after`).
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]').astype(np.int64)
+        with self._lock:
+            entry = self._meters.get(meter_id)
+        if entry is None or len(entry[0]) == 0:
+            return np.zeros(len(dates), dtype=bool), np.empty(0, dtype=np.float32)
+        logged_dates, logged_values, _ = entry
+        idx = np.minimum(np.searchsorted(logged_dates, dates), len(logged_dates) - 1)
+        mask = logged_dates[idx] == dates
+        if after is not None:
+            mask &= dates > after
+        return mask, logged_values[idx[mask]]
+
+    def prune(self, meter_id, through):
+        """Drop predictions for dates up to `through` (int64 ns) once scored"""
+        with self._lock:
+            entry = self._meters.get(meter_id)
+            if entry is not None:
+                keep = entry[0] > through
+                self._meters[meter_id] = (entry[0][keep], entry[1][keep], entry[2])
+
+    def discard(self, meter_id):
+        """Forget a meter's forecasts, e.g. once its model has been replaced"""
+        with self._lock:
+            self._meters.pop(meter_id, None)
+            self._issued.pop(meter_id, None)
+
+    def issued(self, meter_id):
+        """(model version, origin) of the latest forecast recorded in this process"""
+        with self._lock:
+            return self._issued.get(meter_id)
+
+    def to_frame(self):
+        with self._lock:
+            frames = [pd.DataFrame({'meter_id': meter_id, 'date': dates.astype('datetime64[ns]'),
+                                    'predicted_kwh': values, 'model_version': version})
+                      for meter_id, (dates, values, version) in self._meters.items()]
+        if not frames:
+            return pd.DataFrame(columns=['meter_id', 'date', 'predicted_kwh', 'model_version'])
+        return pd.concat(frames, ignore_index=True)
+
+    def save(self, filename=FORECAST_LOG_FILE):
+        save_csv(self.to_frame(), filename)
+
+    @classmethod
+    def load(cls, filename=FORECAST_LOG_FILE):
+        log = cls()
+        if os.path.exists(filename):
+            df = pd.read_csv(filename, parse_dates=['date'], dtype={'meter_id': str})
+            for meter_id, rows in df.groupby('meter_id'):
+                version = rows['model_version'].iloc[-1]
+                log.record(meter_id, rows['date'].to_numpy(), rows['predicted_kwh'].to_numpy(),
+                           None if pd.isna(version) else version)
+        return log
+
+
+class DriftMonitor:
+    """
+    Rolling forecast error per meter in flat arrays indexed by meter slot:
+    an EWMA of squared error, a baseline MSE, the number of scored days and
+    the last scored date. The baseline is the mean error of the first
+    `min_points` days scored after (re)training, so logged multi-day
+    forecasts are compared with forecasts of the same kind.
+    """
+
+    def __init__(self, alpha=DEFAULT_ALPHA, threshold=DEFAULT_THRESHOLD,
+                 min_points=DEFAULT_MIN_POINTS, capacity=64):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_points = min_points
+        self._slots = {}
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._ewm_mse = np.zeros(capacity)
+        self._baseline = np.full(capacity, np.nan)
+        self._last_scored = np.full(capacity, np.iinfo(np.int64).min, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def _slot(self, meter_id):
+        slot = self._slots.get(meter_id)
+        if slot is None:
+            slot = len(self._slots)
+            if slot == len(self._count):
+                grow = len(self._count)
+                self._count = np.concatenate([self._count, np.zeros(grow, dtype=np.int64)])
+                self._ewm_mse = np.concatenate([self._ewm_mse, np.zeros(grow)])
+                self._baseline = np.concatenate([self._baseline, np.full(grow, np.nan)])
+                self._last_scored = np.concatenate(
+                    [self._last_scored, np.full(grow, np.iinfo(np.int64).min, dtype=np.int64)])
+            self._slots[meter_id] = slot
+        return slot
+
+    def observe(self, meter_id, dates, actuals, log):
+        """
+        Score newly arrived actuals against the logged forecasts. Returns the
+        number of days scored.
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        actuals = np.asarray(actuals, dtype=np.float64)
+        with self._lock:
+            slot = self._slot(meter_id)
+            mask, predicted = log.match(meter_id, dates, after=self._last_scored[slot])
+            if not mask.any():
+                return 0
+            errors = (actuals[mask] - predicted) ** 2
+            n = len(errors)
+
+            # Batched EWMA: weight (1 - a)^k on the old level, a(1 - a)^(n-1-i) on each error
+            decay = 1.0 - self.alpha
+            weights = self.alpha * decay ** np.arange(n - 1, -1, -1)
+            if self._count[slot] == 0:
+                # Seed with the first error so the level starts on the right scale
+                weights[0] += decay ** n
+                previous = 0.0
+            else:
+                previous = self._ewm_mse[slot]
+            self._ewm_mse[slot] = previous * decay ** n + weights @ errors
+            count = self._count[slot]
+            if count < self.min_points:
+                baseline = 0.0 if count == 0 else self._baseline[slot]
+                self._baseline[slot] = max((baseline * count + errors.sum()) / (count + n), 1e-9)
+            self._count[slot] += n
+            self._last_scored[slot] = dates[mask].astype(np.int64).max()
+        log.prune(meter_id, int(self._last_scored[slot]))
+        return n
+
+    def reset(self, meter_id):
+        """Forget a meter's error history after retraining"""
+        with self._lock:
+            slot = self._slot(meter_id)
+            self._baseline[slot] = np.nan
+            self._ewm_mse[slot] = 0.0
+            self._count[slot] = 0
+
+    def drift_ratio(self, meter_id):
+        with self._lock:
+            slot = self._slots.get(meter_id)
+            if slot is None or self._count[slot] < self.min_points:
+                return None
+            return float(self._ewm_mse[slot] / self._baseline[slot])
+
+    def drifted(self):
+        """{meter_id: ratio} for meters whose rolling error is past the threshold"""
+        ratios = {meter_id: self.drift_ratio(meter_id) for meter_id in list(self._slots)}
+        return {m: r for m, r in ratios.items() if r is not None and r > self.threshold}
+
+    def summary(self):
+        """Per-meter state as a DataFrame for display"""
+        with self._lock:
+            meters = list(self._slots)
+            slots = np.array([self._slots[m] for m in meters], dtype=np.int64)
+            count = self._count[slots]
+            ewm = self._ewm_mse[slots]
+            baseline = self._baseline[slots]
+            last = self._last_scored[slots]
+        ratio = np.where(count >= self.min_points, ewm / baseline, np.nan)
+        return pd.DataFrame({
+            'meter_id': meters,
+            'scored_days': count,
+            'rolling_rmse': np.sqrt(ewm),
+            'baseline_rmse': np.sqrt(baseline),
+            'drift_ratio': ratio,
+            'drifted': np.nan_to_num(ratio) > self.threshold,
+            'last_scored': pd.to_datetime(np.where(count > 0, last, np.iinfo(np.int64).min), errors='coerce')
+        })
+
+    def to_dict(self):
+        with self._lock:
+            return {meter_id: {'count': int(self._count[slot]), 'ewm_mse': float(self._ewm_mse[slot]),
+                               'baseline': None if np.isnan(self._baseline[slot]) else float(self._baseline[slot]),
+                               'last_scored': int(self._last_scored[slot])}
+                    for meter_id, slot in self._slots.items()}
+
+    def save(self, filename=DRIFT_STATE_FILE):
+        save_json(self.to_dict(), filename)
+
+    @classmethod
+    def load(cls, filename=DRIFT_STATE_FILE, **kwargs):
+        monitor = cls(**kwargs)
+        if os.path.exists(filename):
+            with open(filename) as f:
+                state = json.load(f)
+            for meter_id, entry in state.items():
+                slot = monitor._slot(meter_id)
+                monitor._count[slot] = entry['count']
+                monitor._ewm_mse[slot] = entry['ewm_mse']
+                monitor._baseline[slot] = np.nan if entry['baseline'] is None else entry['baseline']
+                monitor._last_scored[slot] = entry['last_scored']
+        return monitor
+
+
+def retrain_meter(meter_id, mode, data_file=DATA_FILE):
+    """
+    Retrain one meter's model. 'incremental' refits the current
+    configuration on recent history; 'full' re-tunes on all of it.
+    Returns the backtest MSE of the new model.
+    """
+    data = load_history(data_file)
+    if meter_id != SYSTEM_METER:
+        data = data[data['meter_id'] == meter_id]
+    series = CompactSeries.from_frame(clean_series(data[['date', 'consumption_kwh']])[0])
+
+    if mode == 'full':
+        # Runs in a governor slot, so tune inline rather than in worker processes
+        model, X, y = train_tuned(series, workers=1)
+        if model is None:
+            mode = 'incremental'
+    if mode == 'incremental':
+        current = load_meter_model(meter_id)
+        config = model_config(current) if current is not None else None
+        recent = series
+        keep = INCREMENTAL_DAYS * steps_per_day(series)
+        if series.is_regular and len(series) > keep:
+            skipped = len(series) - keep
+            recent = CompactSeries(series.start + skipped * series.step, series.values[skipped:], step=series.step)
+        X, y = prepare_data(recent, **feature_args(config or DEFAULT_CONFIG))
+        model = train_model(X, y, config)
+
+    path = meter_model_path(meter_id)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    save_model(model, path)
+    mse, _ = evaluate_model(model, X, y)
+    return mse
+
+
+class RetrainScheduler:
+    """
+    Checks the drift monitor and queues retraining only for meters past the
+    threshold, one job per meter at a time, on the shared training queue.
+    """
+
+    def __init__(self, monitor, log=None, queue=None, retrain=retrain_meter, full_ratio=DEFAULT_FULL_RATIO):
+        self.monitor = monitor
+        self.log = log
+        self.queue = queue or get_training_queue()
+        self.retrain = retrain
+        self.full_ratio = full_ratio
+        self._jobs = {}
+        self.history = []
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        """Queue retrains for drifted meters; returns [(meter_id, mode, ratio)]"""
+        scheduled = []
+        for meter_id, ratio in self.monitor.drifted().items():
+            with self._lock:
+                if meter_id in self._jobs:
+                    continue
+                mode = 'full' if ratio >= self.full_ratio else 'incremental'
+                # Background work: it takes a governor slot but no user's budget
+                future = self.queue.submit(None, self.retrain, meter_id, mode)
+                self._jobs[meter_id] = (mode, future)
+            future.add_done_callback(lambda f, m=meter_id, mode=mode: self._finished(m, mode, f))
+            scheduled.append((meter_id, mode, ratio))
+        return scheduled
+
+    def _finished(self, meter_id, mode, future):
+        error = future.exception()
+        if error is None:
+            # Forecasts from the replaced model no longer say anything about drift
+            with file_lock(DRIFT_STATE_FILE):
+                self.monitor.reset(meter_id)
+                self.monitor.save()
+                if self.log is not None:
+                    self.log.discard(meter_id)
+                    self.log.save()
+        with self._lock:
+            self._jobs.pop(meter_id, None)
+            self.history.append({'meter_id': meter_id, 'mode': mode, 'finished_at': time.time(),
+                                 'backtest_mse': None if error is not None else future.result(),
+                                 'error': None if error is None else str(error)})
+
+    def pending(self):
+        with self._lock:
+            return {meter_id: mode for meter_id, (mode, _) in self._jobs.items()}
+
+
+def issue_forecasts(data, log, horizon=DEFAULT_HORIZON):
+    """
+    Log a fresh forecast for every meter with new data or a new model.
+    Re-forecasting from each new origin keeps the scored errors at short,
+    comparable lead times instead of drifting out along one long horizon.
+    """
+    issued = 0
+    for meter_id, series in meter_series(data):
+        model = load_meter_model(meter_id)
+        if model is None or len(series) == 0:
+            continue
+        end = series.end
+        version = model_version(model)
+        origin = int(end.astype(np.int64))
+        if log.issued(meter_id) == (version, origin):
+            continue
+        lag_days = model_config(model)['lag_days']
+        if len(series) < lag_days:
+            continue
+        # One prediction per sample of the series, `horizon` days ahead
+        steps = horizon * steps_per_day(series)
+        predictions = predict_future(model, series, steps)
+        dates = end + np.arange(1, steps + 1, dtype=np.int64) * np.timedelta64(series_step(series), 'ns')
+        log.record(meter_id, dates, predictions, version, origin)
+        issued += 1
+    return issued
+
+
+_state = {'log': None, 'monitor': None, 'scheduler': None}
+_state_lock = threading.Lock()
+
+
+def get_drift_scheduler():
+    """Process-wide (log, monitor, scheduler), loaded from disk on first use"""
+    with _state_lock:
+        if _state['scheduler'] is None:
+            _state['log'] = ForecastLog.load()
+            _state['monitor'] = DriftMonitor.load()
+            _state['scheduler'] = RetrainScheduler(_state['monitor'], _state['log'])
+        return _state['log'], _state['monitor'], _state['scheduler']
+
+
+def model_replaced(meter_id=SYSTEM_METER):
+    """Restart drift tracking for a meter whose model was retrained outside the scheduler"""
+    log, monitor, _ = get_drift_scheduler()
+    with file_lock(DRIFT_STATE_FILE):
+        monitor.reset(meter_id)
+        log.discard(meter_id)
+        log.save()
+        monitor.save()
+
+
+def run_drift_check(data_file=DATA_FILE, horizon=DEFAULT_HORIZON):
+    """
+    Score arriving actuals against logged forecasts, queue retrains for
+    drifted meters and log forecasts for the next horizon. Returns
+    (scored days, scheduled retrains, forecasts issued).
+    """
+    log, monitor, scheduler = get_drift_scheduler()
+    # Scoring and new forecasts only need recent readings, which the raw tier holds in full
+    data = get_store(data_file).read_raw()
+    if data is None:
+        return 0, [], 0
+    with file_lock(DRIFT_STATE_FILE):
+        scored = 0
+        for meter_id, series in meter_series(data):
+            scored += monitor.observe(meter_id, series.timestamps, series.values, log)
+        scheduled = scheduler.schedule()
+        issued = issue_forecasts(data, log, horizon)
+        log.save()
+        monitor.save()
+    return scored, scheduled, issued
@@ -0,0 +1,125 @@
+import gzip
+import io
+
+import pandas as pd
+
+CHUNK_ROWS = 50_000
+
+# Format name -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/octet-stream'),
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def iter_chunks(df, chunk_rows=CHUNK_ROWS):
+    """Yield row slices of a DataFrame without copying the whole frame"""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def combined_chunks(history, forecast, chunk_rows=CHUNK_ROWS):
+    """
+    Historical readings followed by the forecast, one chunk at a time,
+    in the layout of the combined download (date, consumption_kwh, data_type).
+    """
+    history = history[['date', 'consumption_kwh']]
+    for chunk in iter_chunks(history, chunk_rows):
+        yield chunk.assign(data_type='historical')
+    forecast = forecast.rename(columns={'predicted_consumption': 'consumption_kwh'})
+    for chunk in iter_chunks(forecast, chunk_rows):
+        yield chunk.assign(data_type='forecast')
+
+
+def meter_chunks(meter_frames, chunk_rows=CHUNK_ROWS):
+    """Chunks for a multi-meter export from a mapping of meter_id -> DataFrame"""
+    for meter_id, df in meter_frames.items():
+        for chunk in iter_chunks(df, chunk_rows):
+            yield chunk.assign(meter_id=meter_id)
+
+
+def iter_csv(chunks):
+    """Encode chunks as CSV bytes, writing the header only once"""
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+
+
+def _write_csv(chunks, fileobj, compress):
+    stream = gzip.GzipFile(fileobj=fileobj, mode='wb') if compress else fileobj
+    try:
+        for block in iter_csv(chunks):
+            stream.write(block)
+    finally:
+        if compress:
+            stream.close()
+
+
+def _write_parquet(chunks, fileobj, compress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(fileobj, table.schema,
+                                          compression='zstd' if compress else 'snappy')
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_excel(chunks, fileobj):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('data')
+    header = True
+    for chunk in chunks:
+        if header:
+            sheet.append(list(chunk.columns))
+            header = False
+        for row in chunk.itertuples(index=False):
+            sheet.append([v.to_pydatetime() if isinstance(v, pd.Timestamp) else v for v in row])
+    workbook.save(fileobj)
+
+
+def write_export(chunks, fileobj, fmt='CSV', compress=False):
+    """
+    Stream DataFrame chunks into a binary file object in the given format.
+    CSV is gzip-compressed on the fly when `compress` is set; Parquet uses
+    zstd instead of snappy. Excel files are already zip-compressed.
+    """
+    if fmt == 'CSV':
+        _write_csv(chunks, fileobj, compress)
+    elif fmt == 'Parquet':
+        _write_parquet(chunks, fileobj, compress)
+    elif fmt == 'Excel':
+        _write_excel(chunks, fileobj)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def export_bytes(chunks, fmt='CSV', compress=False):
+    """Render an export into memory, for download buttons"""
+    buffer = io.BytesIO()
+    write_export(chunks, buffer, fmt, compress)
+    return buffer.getvalue()
+
+
+def export_filename(stem, fmt='CSV', compress=False):
+    """Timestamped file name with the right extension"""
+    extension = EXPORT_FORMATS[fmt][0]
+    suffix = '.gz' if compress and fmt == 'CSV' else ''
+    return f"{stem}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.{extension}{suffix}"
+
+
+def export_mime(fmt='CSV', compress=False):
+    """MIME type for a download of the given format"""
+    return 'application/gzip' if compress and fmt == 'CSV' else EXPORT_FORMATS[fmt][1]
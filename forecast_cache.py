@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Defaults: most users ask for the same few horizons within a working day
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+DEFAULT_MAX_ENTRIES = 256
+
+
+def window_hash(values):
+    """Hash the input window so identical history tails share cache entries"""
+    window = np.ascontiguousarray(np.asarray(values, dtype=np.float64))
+    return hashlib.sha1(window.tobytes()).hexdigest()
+
+
+class ForecastCache:
+    """
+    TTL + LRU cache of forecast arrays.
+
+    Entries are keyed by (model version, window hash, scenario) and hold the
+    longest horizon computed so far, so a cached 90-day forecast also answers
+    any shorter request by slicing.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, model_version, last_window, scenario):
+        return (model_version, window_hash(last_window), scenario)
+
+    def get(self, model_version, last_window, days_ahead, scenario='Standard'):
+        """Return a cached forecast of at least `days_ahead` steps, or None"""
+        key = self._key(model_version, last_window, scenario)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, predictions = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                elif len(predictions) >= days_ahead:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return predictions[:days_ahead].copy()
+            self.misses += 1
+            return None
+
+    def put(self, model_version, last_window, predictions, scenario='Standard'):
+        """Store a forecast, keeping the longer horizon if one is already cached"""
+        key = self._key(model_version, last_window, scenario)
+        predictions = np.asarray(predictions, dtype=np.float64)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and len(entry[1]) > len(predictions):
+                predictions = entry[1]
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, predictions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, model_version, last_window, days_ahead, compute, scenario='Standard'):
+        """Serve from cache or call `compute(days_ahead)` and cache the result"""
+        cached = self.get(model_version, last_window, days_ahead, scenario)
+        if cached is not None:
+            return cached
+        predictions = np.asarray(compute(days_ahead), dtype=np.float64)
+        self.put(model_version, last_window, predictions, scenario)
+        return predictions
+
+    def invalidate(self, model_version=None):
+        """Drop entries for one model version, or everything when None"""
+        with self._lock:
+            if model_version is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == model_version]:
+                del self._entries[key]
+
+    def stats(self):
+        """Basic counters for display"""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_forecast_cache = ForecastCache()
+
+
+def get_forecast_cache():
+    """Process-wide cache shared by all dashboard sessions"""
+    return _forecast_cache
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def _env_number(name, default, cast=float):
+    value = os.environ.get(name)
+    return cast(value) if value else default
+
+
+# Limits, overridable through the environment
+MAX_UPLOAD_MB = _env_number('ECOWATT_MAX_UPLOAD_MB', 50)
+MAX_SESSION_DATA_MB = _env_number('ECOWATT_MAX_SESSION_DATA_MB', 200)
+MAX_CONCURRENT_HEAVY = _env_number('ECOWATT_MAX_CONCURRENT_HEAVY', max((os.cpu_count() or 2) - 1, 1), int)
+SESSION_CPU_SECONDS = _env_number('ECOWATT_SESSION_CPU_SECONDS', 60)
+SESSION_WINDOW_SECONDS = _env_number('ECOWATT_SESSION_WINDOW_SECONDS', 300)
+HEAVY_WAIT_SECONDS = _env_number('ECOWATT_HEAVY_WAIT_SECONDS', 2)
+QUEUED_WAIT_SECONDS = _env_number('ECOWATT_QUEUED_WAIT_SECONDS', 600)
+MAX_PLOT_POINTS = _env_number('ECOWATT_MAX_PLOT_POINTS', 2000, int)
+MAX_ANALYTICS_ROWS = _env_number('ECOWATT_MAX_ANALYTICS_ROWS', 100_000, int)
+
+
+class ResourceLimitExceeded(Exception):
+    """Base class for governor refusals"""
+
+
+class BudgetExceeded(ResourceLimitExceeded):
+    """The session used up its CPU budget for the current window"""
+
+
+class ServerBusy(ResourceLimitExceeded):
+    """All heavy-action slots are taken"""
+
+
+class ExecutionGovernor:
+    """
+    Caps concurrent heavy actions across sessions and tracks a rolling CPU
+    budget per session. Callers catch the refusal and fall back to a cheaper
+    path (decimated plots, sampled analytics, queued training).
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_HEAVY, cpu_seconds=SESSION_CPU_SECONDS,
+                 window_seconds=SESSION_WINDOW_SECONDS, wait_seconds=HEAVY_WAIT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.cpu_seconds = cpu_seconds
+        self.window_seconds = window_seconds
+        self.wait_seconds = wait_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._usage = defaultdict(deque)
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def _used(self, session_id, now):
+        usage = self._usage[session_id]
+        while usage and now - usage[0][0] > self.window_seconds:
+            usage.popleft()
+        return sum(cpu for _, cpu in usage)
+
+    def remaining_budget(self, session_id):
+        """CPU seconds the session may still use in the current window"""
+        with self._lock:
+            return max(self.cpu_seconds - self._used(session_id, time.monotonic()), 0.0)
+
+    def over_budget(self, session_id):
+        return self.remaining_budget(session_id) <= 0
+
+    @contextmanager
+    def heavy(self, session_id, wait_seconds=None):
+        """
+        Run a heavy action in a concurrency slot, charging its CPU time to
+        the session. Only the calling thread's CPU is measured, so actions
+        run here must not fan out to worker processes. Raises BudgetExceeded or ServerBusy instead of waiting
+        indefinitely. A `session_id` of None is background work (e.g. drift
+        retrains): it needs a slot but has no budget.
+        """
+        if session_id is not None and self.over_budget(session_id):
+            raise BudgetExceeded("You have reached your compute budget. Please wait a few minutes.")
+        wait = self.wait_seconds if wait_seconds is None else wait_seconds
+        if not self._slots.acquire(timeout=wait):
+            raise ServerBusy("The server is busy with other requests.")
+        with self._lock:
+            self.active += 1
+        started = time.thread_time()
+        try:
+            yield
+        finally:
+            cpu = time.thread_time() - started
+            with self._lock:
+                self.active -= 1
+                if session_id is not None:
+                    self._usage[session_id].append((time.monotonic(), cpu))
+            self._slots.release()
+
+
+class TrainingQueue:
+    """
+    Single-worker queue that runs deferred training jobs one at a time.
+    Each job still runs in a governor slot and is charged to the session
+    that queued it, so queueing never bypasses the session's budget.
+    """
+
+    def __init__(self, governor, workers=1, wait_seconds=QUEUED_WAIT_SECONDS):
+        self.governor = governor
+        self.wait_seconds = wait_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ecowatt-train')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _run(self, session_id, fn, args, kwargs):
+        with self.governor.heavy(session_id, wait_seconds=self.wait_seconds):
+            return fn(*args, **kwargs)
+
+    def submit(self, session_id, fn, *args, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` on behalf of `session_id` (None for
+        background work); refuses sessions already over budget
+        """
+        if session_id is not None and self.governor.over_budget(session_id):
+            raise BudgetExceeded("You have reached your compute budget. Please wait a few minutes.")
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(self._run, session_id, fn, args, kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    @property
+    def pending(self):
+        return self._pending
+
+
+def upload_too_large(size_bytes):
+    """True if an upload exceeds the configured size cap"""
+    return size_bytes > MAX_UPLOAD_MB * 1024 * 1024
+
+
+def frame_too_large(df):
+    """True if a DataFrame exceeds the per-session memory cap"""
+    return df.memory_usage(deep=True).sum() > MAX_SESSION_DATA_MB * 1024 * 1024
+
+
+def decimate(dates, values, max_points=MAX_PLOT_POINTS):
+    """
+    Min/max decimation for plotting: each bucket keeps its lowest and highest
+    point, so peaks survive while the point count stays bounded.
+    Returns (dates, values) unchanged when already small enough.
+    """
+    dates = np.asarray(dates)
+    values = np.asarray(values)
+    n = len(values)
+    if n <= max_points:
+        return dates, values
+    buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    width = int(np.diff(edges).max())
+    # Pad every bucket to the same width so argmin/argmax run in one pass
+    index = edges[:-1, None] + np.arange(width)[None, :]
+    valid = index < edges[1:, None]
+    index = np.minimum(index, n - 1)
+    bucket_values = values[index].astype(np.float64)
+    low = np.where(valid, bucket_values, np.inf).argmin(axis=1)
+    high = np.where(valid, bucket_values, -np.inf).argmax(axis=1)
+    keep = np.unique(np.concatenate([index[np.arange(buckets), low], index[np.arange(buckets), high]]))
+    return dates[keep], values[keep]
+
+
+def sample_rows(df, max_rows=MAX_ANALYTICS_ROWS):
+    """Evenly strided sample of a DataFrame for approximate analytics"""
+    if len(df) <= max_rows:
+        return df, False
+    step = -(-len(df) // max_rows)
+    return df.iloc[::step], True
+
+
+_governor = ExecutionGovernor()
+_training_queue = TrainingQueue(_governor)
+
+
+def get_governor():
+    """Process-wide governor shared by all sessions"""
+    return _governor
+
+
+def get_training_queue():
+    """Process-wide queue for deferred training jobs"""
+    return _training_queue
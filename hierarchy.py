@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+HIERARCHY_FILE = 'hierarchy.csv'
+RECONCILE_METHODS = ('bottom_up', 'ols', 'wls_struct', 'mint_shrink')
+
+
+class Hierarchy:
+    """
+    Meter -> building -> region -> total hierarchy.
+
+    Node order is total, regions, buildings, meters. `S` is the sparse
+    summing matrix mapping meter series (rows of a bottom-level array) to
+    every node, so aggregating a whole fleet is one sparse matmul.
+    """
+
+    def __init__(self, mapping):
+        mapping = mapping[['meter_id', 'building', 'region']].drop_duplicates('meter_id')
+        mapping = mapping.astype(str).sort_values(['region', 'building', 'meter_id']).reset_index(drop=True)
+        self.meters = mapping['meter_id'].tolist()
+        n_meters = len(self.meters)
+
+        region_codes, regions = pd.factorize(mapping['region'], sort=True)
+        building_keys = mapping['region'] + '/' + mapping['building']
+        building_codes, buildings = pd.factorize(building_keys, sort=True)
+
+        self.nodes = (['total'] + [f'region:{r}' for r in regions]
+                      + [f'building:{b}' for b in buildings] + [f'meter:{m}' for m in self.meters])
+        self.levels = (['total'] + ['region'] * len(regions)
+                       + ['building'] * len(buildings) + ['meter'] * n_meters)
+
+        columns = np.arange(n_meters)
+        region_offset = 1
+        building_offset = region_offset + len(regions)
+        meter_offset = building_offset + len(buildings)
+        rows = np.concatenate([
+            np.zeros(n_meters, dtype=np.int64),
+            region_offset + region_codes,
+            building_offset + building_codes,
+            meter_offset + columns
+        ])
+        cols = np.tile(columns, 4)
+        self.S = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                   shape=(len(self.nodes), n_meters))
+        self.meter_offset = meter_offset
+
+    @classmethod
+    def from_file(cls, filename=HIERARCHY_FILE):
+        """Load a hierarchy from a CSV with meter_id, building, region columns"""
+        return cls(pd.read_csv(filename))
+
+    def level_slice(self, level):
+        """Row indices of all nodes at one level"""
+        return np.flatnonzero(np.array(self.levels) == level)
+
+    def bottom_matrix(self, df):
+        """
+        Pivot long-format readings (meter_id, date, consumption_kwh) into a
+        (n_meters, n_dates) array ordered like the hierarchy. Missing readings are 0.
+        """
+        df = df.assign(meter_id=df['meter_id'].astype(str))
+        wide = df.pivot_table(index='meter_id', columns='date', values='consumption_kwh', aggfunc='sum')
+        wide = wide.reindex(self.meters).fillna(0.0)
+        return wide.to_numpy(dtype=np.float64), pd.DatetimeIndex(wide.columns)
+
+    def aggregate(self, bottom):
+        """Sum bottom-level series of shape (n_meters, T) up to every node"""
+        return np.asarray(self.S @ bottom)
+
+
+def fit_node_models(series, lag_days=7, ridge=1e-6):
+    """
+    Fit one autoregressive linear model per node in a single batched solve.
+
+    `series` has shape (n_nodes, T). Each node's values are scaled by its mean
+    so nodes of very different size share a well-conditioned system. Returns
+    (coefficients, scales) where coefficients has shape (n_nodes, lag_days + 1).
+    """
+    scales = np.abs(series).mean(axis=1)
+    scales[scales == 0] = 1.0
+    scaled = series / scales[:, None]
+
+    windows = np.lib.stride_tricks.sliding_window_view(scaled, lag_days + 1, axis=1)
+    X = windows[:, :, :lag_days]
+    y = windows[:, :, lag_days]
+    X = np.concatenate([X, np.ones(X.shape[:2] + (1,))], axis=2)
+
+    XtX = np.einsum('nrk,nrj->nkj', X, X) + ridge * np.eye(lag_days + 1)
+    Xty = np.einsum('nrk,nr->nk', X, y)
+    coefficients = np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0]
+    return coefficients, scales
+
+
+def forecast_nodes(series, coefficients, scales, days_ahead):
+    """Recursive multi-step forecast for all nodes at once, shape (n_nodes, days_ahead)"""
+    lag_days = coefficients.shape[1] - 1
+    window = series[:, -lag_days:] / scales[:, None]
+    weights, intercept = coefficients[:, :lag_days], coefficients[:, lag_days]
+    forecasts = np.empty((series.shape[0], days_ahead))
+    for step in range(days_ahead):
+        pred = np.einsum('nk,nk->n', window, weights) + intercept
+        forecasts[:, step] = pred
+        window = np.concatenate([window[:, 1:], pred[:, None]], axis=1)
+    return forecasts * scales[:, None]
+
+
+def _shrunk_covariance(residuals):
+    """Residual covariance shrunk toward its diagonal (Schafer-Strimmer)"""
+    residuals = residuals - residuals.mean(axis=1, keepdims=True)
+    n_obs = residuals.shape[1]
+    cov = residuals @ residuals.T / n_obs
+    std = np.sqrt(np.diag(cov))
+    std[std == 0] = 1.0
+    standardized = residuals / std[:, None]
+    corr = standardized @ standardized.T / n_obs
+    squared = standardized ** 2
+    var_corr = (squared @ squared.T / n_obs - corr ** 2) * n_obs / max(n_obs - 1, 1) ** 2
+    off = ~np.eye(len(cov), dtype=bool)
+    denom = (corr[off] ** 2).sum()
+    lam = 0.0 if denom == 0 else float(np.clip(var_corr[off].sum() / denom, 0.0, 1.0))
+    shrunk = cov * (1.0 - lam)
+    shrunk[np.diag_indices_from(shrunk)] = np.diag(cov)
+    return shrunk
+
+
+def reconcile(hierarchy, base_forecasts, method='wls_struct', residuals=None):
+    """
+    Make forecasts at every node add up.
+
+    `base_forecasts` has shape (n_nodes, horizon). 'bottom_up' sums the meter
+    forecasts; 'ols', 'wls_struct' and 'mint_shrink' are MinT-style
+    projections y~ = S (S' W^-1 S)^-1 S' W^-1 y^, applied to all horizon
+    steps at once. 'mint_shrink' needs in-sample `residuals` of shape
+    (n_nodes, T).
+    """
+    if method not in RECONCILE_METHODS:
+        raise ValueError(f"method must be one of {RECONCILE_METHODS}")
+    S = hierarchy.S
+    if method == 'bottom_up':
+        return hierarchy.aggregate(base_forecasts[hierarchy.meter_offset:])
+
+    if method == 'mint_shrink':
+        if residuals is None:
+            raise ValueError("mint_shrink reconciliation requires residuals")
+        W = _shrunk_covariance(residuals)
+        W += 1e-9 * np.trace(W) / len(W) * np.eye(len(W))
+        Winv_S = np.linalg.solve(W, S.toarray())
+        A = S.T @ Winv_S
+        b = Winv_S.T @ base_forecasts
+        return hierarchy.aggregate(np.linalg.solve(A, b))
+
+    if method == 'ols':
+        weights = np.ones(S.shape[0])
+    else:
+        weights = np.asarray(S.sum(axis=1)).ravel()
+
+    # With diagonal W the projection equals y^ - W C' (C W C')^-1 C y^ for
+    # the constraint matrix C = [I, -S_agg]. Its system is only as large as
+    # the number of aggregate nodes, which is tiny next to the meter count.
+    n_agg = hierarchy.meter_offset
+    S_agg = S[:n_agg]
+    w_agg, w_bottom = weights[:n_agg], weights[n_agg:]
+    base_agg, base_bottom = base_forecasts[:n_agg], base_forecasts[n_agg:]
+    incoherence = base_agg - S_agg @ base_bottom
+    M = (S_agg @ sparse.diags(w_bottom) @ S_agg.T).toarray() + np.diag(w_agg)
+    lam = np.linalg.solve(M, incoherence)
+    bottom = base_bottom + w_bottom[:, None] * (S_agg.T @ lam)
+    return hierarchy.aggregate(bottom)
+
+
+def hierarchical_forecast(hierarchy, bottom, days_ahead=30, lag_days=7, method='wls_struct'):
+    """
+    Forecast every node of the hierarchy and reconcile the results.
+    Returns a DataFrame indexed by node with one column per forecast step.
+    """
+    series = hierarchy.aggregate(bottom)
+    coefficients, scales = fit_node_models(series, lag_days)
+    base = forecast_nodes(series, coefficients, scales, days_ahead)
+
+    residuals = None
+    if method == 'mint_shrink':
+        windows = np.lib.stride_tricks.sliding_window_view(series / scales[:, None], lag_days + 1, axis=1)
+        fitted = np.einsum('nrk,nk->nr', windows[:, :, :lag_days], coefficients[:, :lag_days])
+        fitted += coefficients[:, lag_days:]
+        residuals = (windows[:, :, lag_days] - fitted) * scales[:, None]
+
+    reconciled = reconcile(hierarchy, base, method, residuals)
+    return pd.DataFrame(reconciled, index=hierarchy.nodes,
+                        columns=[f'day_{i}' for i in range(1, days_ahead + 1)])
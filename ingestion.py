@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+DEDUPE_POLICIES = ('last', 'first', 'mean')
+
+
+def _dedupe_sorted(dates, values, policy):
+    """
+    Collapse duplicate timestamps in arrays already stably sorted by date.
+    Older records come before newer ones inside each run of equal dates.
+    Also returns the positions of the kept rows (None if nothing collapsed),
+    used to carry the other columns along; 'mean' keeps the newest row's.
+    """
+    if len(dates) == 0:
+        return dates, values, None
+    starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+    if len(starts) == len(dates):
+        return dates, values, None
+    if policy == 'first':
+        return dates[starts], values[starts], starts
+    ends = np.r_[starts[1:], len(dates)] - 1
+    if policy == 'last':
+        return dates[ends], values[ends], ends
+    counts = np.diff(np.r_[starts, len(dates)])
+    return dates[starts], np.add.reduceat(values, starts) / counts, ends
+
+
+def _fill(size):
+    return np.full(size, np.nan, dtype=object)
+
+
+# Newest-timestamp marker before any reading has arrived
+_NO_READING = np.datetime64(np.iinfo(np.int64).min + 1, 'ns')
+
+
+class ReadingIngestor:
+    """
+    Append-only store for one consumption series.
+
+    Incoming readings land in a small write buffer and are merged into the
+    history in batches. Only the part of the history that overlaps the
+    buffered time span is rewritten; readings newer than the history are
+    appended in place into preallocated arrays. Columns other than `date`
+    and `consumption_kwh` (e.g. `meter_id`) are carried along with their
+    readings; readings without a column the history has take its value when
+    the history holds only one (a single meter's id), and are refused
+    otherwise. `stats['late']` counts readings older than one received
+    before them, however the readings were batched.
+    """
+
+    def __init__(self, history=None, dedupe='last', flush_rows=1000):
+        if dedupe not in DEDUPE_POLICIES:
+            raise ValueError(f"dedupe must be one of {DEDUPE_POLICIES}")
+        self.dedupe = dedupe
+        self.flush_rows = flush_rows
+        self._dates = np.empty(0, dtype='datetime64[ns]')
+        self._values = np.empty(0, dtype=np.float64)
+        self._extra = {}
+        self._size = 0
+        self._buffer = []
+        self._buffered_rows = 0
+        self._newest = _NO_READING
+        self.stats = {'received': 0, 'duplicates': 0, 'late': 0, 'flushes': 0}
+        if history is not None and len(history):
+            self.append(history)
+            self.flush()
+            # Stats describe what arrived after the history, not the history itself
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def __len__(self):
+        return self._size + self._buffered_rows
+
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+
+    @property
+    def values(self):
+        return self._values[:self._size]
+
+    def append(self, readings):
+        """Buffer a DataFrame of `date`/`consumption_kwh` readings, flushing when full"""
+        dates = pd.to_datetime(readings['date']).to_numpy(dtype='datetime64[ns]')
+        values = readings['consumption_kwh'].to_numpy(dtype=np.float64)
+        if len(dates) == 0:
+            return
+        extra = {c: readings[c].to_numpy() for c in readings.columns if c not in ('date', 'consumption_kwh')}
+        for name in self._known_columns() - set(extra):
+            extra[name] = np.full(len(dates), self._single_value(name), dtype=object)
+        self._buffer.append((dates, values, extra))
+        self._buffered_rows += len(dates)
+        self.stats['received'] += len(dates)
+        # Late against everything received so far, in arrival order
+        newest_before = np.maximum.accumulate(np.r_[self._newest, dates[:-1]])
+        self.stats['late'] += int(np.count_nonzero(dates < newest_before))
+        self._newest = max(newest_before[-1], dates[-1])
+        if self._buffered_rows >= self.flush_rows:
+            self.flush()
+
+    def _known_columns(self):
+        return set(self._extra).union(*(e for _, _, e in self._buffer))
+
+    def _single_value(self, name):
+        """The one value a column holds across the history, for readings that lack it"""
+        parts = [self._extra[name][:self._size]] if name in self._extra else []
+        parts += [e[name] for _, _, e in self._buffer if name in e]
+        values = pd.unique(pd.Series(np.concatenate(parts), dtype=object).dropna())
+        if len(values) > 1:
+            raise ValueError(f"the readings have no '{name}' column and the history has several {name} values")
+        return values[0] if len(values) else np.nan
+
+    def _reserve(self, size):
+        if size <= len(self._dates):
+            return
+        capacity = max(size, 2 * len(self._dates), 1024)
+        dates = np.empty(capacity, dtype='datetime64[ns]')
+        values = np.empty(capacity, dtype=np.float64)
+        dates[:self._size] = self._dates[:self._size]
+        values[:self._size] = self._values[:self._size]
+        self._dates, self._values = dates, values
+        for name, column in self._extra.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._extra[name] = grown
+
+    def flush(self):
+        """Merge buffered readings into the history; returns rows written"""
+        if not self._buffer:
+            return 0
+        dates = np.concatenate([d for d, _, _ in self._buffer])
+        values = np.concatenate([v for _, v, _ in self._buffer])
+        # Other columns are held as object arrays; ones new to the store start empty
+        for _, _, extra in self._buffer:
+            for name in extra:
+                if name not in self._extra:
+                    self._extra[name] = _fill(len(self._dates))
+        extra = {name: np.concatenate([e[name].astype(object) if name in e else _fill(len(d))
+                                       for d, _, e in self._buffer])
+                 for name in self._extra}
+        self._buffer = []
+        self._buffered_rows = 0
+
+        # The buffer is small, so sorting it is cheap; stable keeps arrival order
+        order = np.argsort(dates, kind='stable')
+        dates, values = dates[order], values[order]
+        extra = {name: column[order] for name, column in extra.items()}
+
+        # Only history at or after the earliest buffered reading can change
+        cut = int(np.searchsorted(self.dates, dates[0], side='left'))
+        if cut < self._size:
+            dates = np.concatenate([self._dates[cut:self._size], dates])
+            values = np.concatenate([self._values[cut:self._size], values])
+            extra = {name: np.concatenate([self._extra[name][cut:self._size], column])
+                     for name, column in extra.items()}
+            order = np.argsort(dates, kind='stable')
+            dates, values = dates[order], values[order]
+            extra = {name: column[order] for name, column in extra.items()}
+
+        merged_dates, merged_values, kept = _dedupe_sorted(dates, values, self.dedupe)
+        self.stats['duplicates'] += len(dates) - len(merged_dates)
+
+        self._reserve(cut + len(merged_dates))
+        end = cut + len(merged_dates)
+        self._dates[cut:end] = merged_dates
+        self._values[cut:end] = merged_values
+        for name, column in extra.items():
+            self._extra[name][cut:end] = column if kept is None else column[kept]
+        self._size = end
+        self.stats['flushes'] += 1
+        return len(merged_dates)
+
+    def to_frame(self):
+        """Flush and return the history as a `date`/`consumption_kwh` DataFrame, plus any other columns"""
+        self.flush()
+        frame = pd.DataFrame({
+            'date': self.dates.copy(),
+            'consumption_kwh': self.values.copy()
+        })
+        for name, column in self._extra.items():
+            frame[name] = pd.Series(column[:self._size].copy()).infer_objects()
+        return frame
+
+
+def merge_readings(existing, new_readings, dedupe='last'):
+    """Merge a batch of new readings into an existing series DataFrame"""
+    ingestor = ReadingIngestor(existing, dedupe=dedupe)
+    ingestor.append(new_readings)
+    return ingestor.to_frame(), ingestor.stats
@@ -0,0 +1,306 @@
+"""Concurrent-session load test for the dashboard, run in a scratch copy of the app"""
+import argparse
+import glob
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+ACTIONS = ('login', 'upload', 'analyze', 'train', 'forecast', 'results')
+PERCENTILES = (50, 90, 95, 99)
+PASSWORD = 'loadtest-password'
+MODEL_FILE = 'energy_model.pkl'
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def prepare_workdir(workdir, n_users):
+    """Copy the app into `workdir`, switch to it and register the simulated users"""
+    for path in glob.glob(os.path.join(APP_DIR, '*.py')):
+        shutil.copy(path, workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    from auth import init_user_files, load_users, register_user
+    init_user_files()
+    existing = set(load_users()['username'])
+    for i in range(n_users):
+        username = f'loadtest{i}'
+        if username not in existing:
+            register_user(username, PASSWORD, f'{username}@example.com', f'Load Test {i}')
+
+
+def sample_csv(days, seed=0):
+    """A daily consumption upload in the format the Upload page accepts"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2022-01-01', periods=days)
+    seasonal = 300 + 80 * np.sin(2 * np.pi * dates.dayofyear / 365.25)
+    weekly = np.where(dates.dayofweek >= 5, 40, 0)
+    consumption = seasonal + weekly + rng.normal(0, 15, days)
+    frame = pd.DataFrame({'date': dates.strftime('%Y-%m-%d'), 'consumption_kwh': consumption.round(2)})
+    return frame.to_csv(index=False).encode()
+
+
+def deep_size(value):
+    """Approximate bytes held by one session-state value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class VirtualUser:
+    """One simulated browser session walking through the user dashboard"""
+
+    def __init__(self, index, script, days, timeout=120, think_time=0.0):
+        from streamlit.testing.v1 import AppTest
+        self.username = f'loadtest{index}'
+        self.days = days
+        self.iteration = 0
+        self.think_time = think_time
+        self.at = AppTest.from_file(script, default_timeout=timeout)
+        self.records = []
+        self.memory = {'session_bytes': [], 'rss_mb': [], 'traced_mb': [], 'top_allocations': []}
+
+    def _problem(self):
+        if len(self.at.exception):
+            return 'error', self.at.exception[0].value
+        if len(self.at.error):
+            return 'error', self.at.error[0].value
+        return None
+
+    def _timed(self, iteration, action, step):
+        started = time.perf_counter()
+        try:
+            outcome, detail = step() or self._problem() or ('ok', '')
+        except Exception as e:
+            outcome, detail = 'error', f"{type(e).__name__}: {e}"
+        self.records.append({'user': self.username, 'iteration': iteration, 'action': action,
+                             'seconds': time.perf_counter() - started, 'outcome': outcome, 'detail': detail})
+        if self.think_time:
+            time.sleep(self.think_time)
+
+    def _nav(self, key):
+        self.at.button(key=key).click().run()
+
+    def login(self):
+        self.at.run()
+        self.at.text_input[0].input(self.username)
+        self.at.text_input[1].input(PASSWORD)
+        self.at.button[0].click().run()
+        if not self.at.session_state.get('logged_in'):
+            return self._problem() or ('error', 'login did not complete')
+
+    def upload(self):
+        self._nav('nav_upload')
+        self.at.selectbox(key='data_source').select('Upload CSV').run()
+        self.at.checkbox(key='merge_upload').uncheck()
+        # A new file each iteration, so the page doesn't skip it as already loaded
+        self.at.file_uploader(key='upload_file').upload(
+            f'{self.username}-{self.iteration}.csv', sample_csv(self.days, seed=self.iteration), 'text/csv')
+        self.at.run()
+
+    def analyze(self):
+        self._nav('nav_analyze')
+
+    def train(self):
+        # The dashboard reuses the shared model file once any session has saved one
+        if 'model' in self.at.session_state:
+            return 'skipped', 'model already loaded'
+        self.at.button(key='train_model').click().run()
+        problem = self._problem()
+        if problem:
+            return problem
+        if 'training_job' in self.at.session_state:
+            return 'queued', 'server busy; training was queued'
+
+    def forecast(self):
+        if 'model' not in self.at.session_state:
+            return 'skipped', 'no trained model'
+        self._nav('nav_forecast')
+        self.at.button(key='generate_forecast').click().run()
+
+    def results(self):
+        if 'forecast' not in self.at.session_state:
+            return 'skipped', 'no forecast'
+        self._nav('nav_results')
+
+    def measure(self):
+        self.memory['session_bytes'].append(sum(deep_size(v) for v in self.at.session_state.values()))
+        self.memory['rss_mb'].append(peak_rss_mb())
+        if tracemalloc.is_tracing():
+            self.memory['traced_mb'].append(tracemalloc.get_traced_memory()[0] / 2**20)
+
+    def run(self, iterations, start):
+        start.wait()
+        self._timed(0, 'login', self.login)
+        baseline = None
+        for iteration in range(iterations):
+            self.iteration = iteration
+            for action in ACTIONS[1:]:
+                self._timed(iteration, action, getattr(self, action))
+            self.measure()
+            # Anything still growing after the first full workflow is a leak candidate
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                if baseline is None:
+                    baseline = snapshot
+                else:
+                    self.memory['top_allocations'] = [str(stat) for stat in
+                                                      snapshot.compare_to(baseline, 'lineno')[:5]]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (ru_maxrss is in KB on Linux); NaN if unavailable"""
+    if resource is None:
+        return float('nan')
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_session(task):
+    """Worker entry point: one simulated user in its own process"""
+    index, workdir, iterations, days, timeout, think_time, trace_memory, start = task
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    if trace_memory:
+        tracemalloc.start()
+    user = VirtualUser(index, os.path.join(workdir, 'main.py'), days, timeout, think_time)
+    user.run(iterations, start)
+    return user.records, user.memory
+
+
+def _growth(values):
+    return values[-1] - values[0] if len(values) > 1 else float('nan')
+
+
+def run_level(workdir, n_users, iterations, days, timeout, think_time, trace_memory=False):
+    """
+    Run one concurrency level; returns (records DataFrame, memory summary dict).
+
+    Each session runs in its own process because AppTest swaps a
+    process-global runtime on every run. Sessions share the app's files
+    (user store, model, data) and the host's CPU, but not in-memory
+    singletons such as caches and the compute governor.
+    """
+    # Start without a saved model so the sessions of this level train concurrently
+    if os.path.exists(os.path.join(workdir, MODEL_FILE)):
+        os.remove(os.path.join(workdir, MODEL_FILE))
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        start = manager.Barrier(n_users)
+        tasks = [(i, workdir, iterations, days, timeout, think_time, trace_memory, start) for i in range(n_users)]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=n_users, mp_context=context) as pool:
+            sessions = list(pool.map(run_session, tasks))
+        elapsed = time.perf_counter() - started
+
+    records = pd.DataFrame([r for user_records, _ in sessions for r in user_records])
+    records['users'] = n_users
+    memories = [memory for _, memory in sessions if memory['session_bytes']]
+
+    def mean(values):
+        values = [v for v in values if not np.isnan(v)]
+        return float(np.mean(values)) if values else float('nan')
+
+    leakiest = max(memories, key=lambda m: _growth(m['traced_mb']) if m['traced_mb'] else 0, default=None)
+    memory = {
+        'users': n_users,
+        'elapsed_s': elapsed,
+        'session_state_mb': mean([m['session_bytes'][-1] / 2**20 for m in memories]),
+        # Session state should stay flat once the workflow has run once
+        'session_growth_mb': mean([_growth(m['session_bytes']) / 2**20 for m in memories]),
+        'rss_mb': mean([m['rss_mb'][-1] for m in memories]),
+        'rss_growth_mb': mean([_growth(m['rss_mb']) for m in memories]),
+        'traced_growth_mb': mean([_growth(m['traced_mb']) for m in memories if m['traced_mb']]),
+        'top_allocations': leakiest['top_allocations'] if leakiest else [],
+    }
+    return records, memory
+
+
+def latency_summary(records):
+    """Latency percentiles and outcome counts per concurrency level and action"""
+    timed = records[records['outcome'] != 'skipped']
+    rows = []
+    for (users, action), group in timed.groupby(['users', 'action'], sort=False):
+        seconds = group['seconds'].to_numpy()
+        row = {'users': users, 'action': action, 'count': len(seconds)}
+        row.update({f'p{p}_s': float(np.percentile(seconds, p)) for p in PERCENTILES})
+        row['max_s'] = float(seconds.max())
+        row['errors'] = int((group['outcome'] == 'error').sum())
+        row['queued'] = int((group['outcome'] == 'queued').sum())
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="EcoWatt dashboard load test")
+    parser.add_argument('--users', default='1,2,4', help="comma-separated concurrency levels to step through")
+    parser.add_argument('--iterations', type=int, default=2, help="workflow repetitions per session")
+    parser.add_argument('--days', type=int, default=730, help="days of history in each upload")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds allowed per script run")
+    parser.add_argument('--think-time', type=float, default=0.0, help="pause between actions (seconds)")
+    parser.add_argument('--slo', type=float, help="stop ramping once any action's p95 exceeds this (seconds)")
+    parser.add_argument('--workdir', help="scratch directory for the app copy (default: a temp dir)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="track allocations with tracemalloc (slow; latencies are inflated)")
+    parser.add_argument('--output', help="also write every timed action as CSV")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    levels = sorted({int(n) for n in args.users.split(',')})
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='ecowatt-loadtest-'))
+    os.makedirs(workdir, exist_ok=True)
+    prepare_workdir(workdir, max(levels))
+
+    all_records = []
+    for n_users in levels:
+        print(f"Running {n_users} concurrent user(s) x {args.iterations} iteration(s)...")
+        records, memory = run_level(workdir, n_users, args.iterations, args.days, args.timeout, args.think_time,
+                                    args.trace_memory)
+        all_records.append(records)
+        summary = latency_summary(records)
+        print(summary.drop(columns='users').round(3).to_string(index=False))
+        rss = resource is not None
+        print(f"  elapsed {memory['elapsed_s']:.1f}s; per session: "
+              + (f"peak RSS {memory['rss_mb']:.0f} MB, " if rss else "")
+              + f"session state {memory['session_state_mb']:.2f} MB")
+        if args.iterations > 1:
+            print(f"  growth after the first iteration: session state {memory['session_growth_mb']:+.3f} MB"
+                  + (f", peak RSS {memory['rss_growth_mb']:+.1f} MB" if rss else "")
+                  + (f", traced {memory['traced_growth_mb']:+.2f} MB" if args.trace_memory else ""))
+        for line in memory['top_allocations'][:3]:
+            print(f"    {line}")
+        errors = records[records['outcome'] == 'error']
+        for detail in errors['detail'].drop_duplicates().head(3):
+            print(f"  error: {detail}")
+        if args.slo is not None and summary['p95_s'].max() > args.slo:
+            print(f"p95 latency exceeded {args.slo:.1f}s at {n_users} users; stopping the ramp.")
+            break
+
+    records = pd.concat(all_records, ignore_index=True)
+    if args.output:
+        records.to_csv(args.output, index=False)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if (records['outcome'] == 'error').any() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
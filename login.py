@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
-from auth import authenticate_user, register_user, init_user_files
+from auth import authenticate_user, register_user, init_user_files, LoginThrottled
 import re
+from sessions import get_session_manager
 
 def is_valid_email(email):
     """Validate email format"""
@@ -42,11 +43,18 @@ def login_section(user_type):
             if not username or not password:
                 st.error("Please fill in all fields")
             else:
-                user = authenticate_user(username, password, user_type)
+                try:
+                    user = authenticate_user(username, password, user_type)
+                except LoginThrottled as e:
+                    st.error(str(e))
+                    return
                 if user:
                     st.session_state.logged_in = True
                     st.session_state.user = user
                     st.session_state.user_type = user_type
+                    token = get_session_manager().issue(user, user_type)
+                    st.session_state.session_token = token
+                    st.session_state.session_cookie = token
                     st.session_state.page = 'admin_dashboard' if user_type == 'admin' else 'user_dashboard'
                     st.success(f"Welcome back, {user['full_name']}!")
                     st.rerun()
@@ -1,4 +1,50 @@
+import json
 import streamlit as st
+from sessions import SESSION_COOKIE, SESSION_TTL_SECONDS, get_session_manager
+
+def restore_session():
+    """Log in from the signed session cookie, or log out if the session was revoked"""
+    if 'session' in st.query_params:
+        # Tokens are no longer accepted in the URL; drop ones left in old links
+        del st.query_params['session']
+    token = st.session_state.get('session_token')
+    if token is None and not st.session_state.get('session_cookie_checked'):
+        # Cookies are fixed for the life of the connection, so only read them once
+        st.session_state.session_cookie_checked = True
+        token = st.context.cookies.to_dict().get(SESSION_COOKIE)
+    if not token:
+        return
+    session = get_session_manager().validate(token)
+    if session is None:
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.session_state.logged_in = False
+        st.session_state.page = 'login'
+        st.session_state.session_cookie_checked = True
+        st.session_state.session_cookie = ''
+        return
+    if not st.session_state.logged_in:
+        st.session_state.logged_in = True
+        st.session_state.user = dict(session['user'])
+        st.session_state.user_type = session['user_type']
+        st.session_state.session_token = token
+        st.session_state.page = 'admin_dashboard' if session['user_type'] == 'admin' else 'user_dashboard'
+
+def write_session_cookie():
+    """
+    Set (after login) or clear (after logout) the session cookie in the browser.
+    Written from script, so it cannot be HttpOnly: it is SameSite=Strict and
+    Secure over HTTPS, and pages must not render unescaped user-supplied HTML.
+    """
+    token = st.session_state.pop('session_cookie', None)
+    if token is None:
+        return
+    max_age = SESSION_TTL_SECONDS if token else 0
+    st.iframe(f"""<script>
+    const secure = window.parent.location.protocol === 'https:' ? '; Secure' : '';
+    window.parent.document.cookie = {json.dumps(SESSION_COOKIE)} + '=' + {json.dumps(token)}
+        + '; Max-Age={max_age}; Path=/; SameSite=Strict' + secure;
+    </script>""", height=1)
 
 # Main application entry point
 def main():
@@ -7,6 +53,10 @@ def main():
         st.session_state.logged_in = False
         st.session_state.page = 'login'
 
+    # Reconnecting tabs resume from their session cookie without hitting the user store
+    restore_session()
+    write_session_cookie()
+
     # Route to appropriate page
     if not st.session_state.logged_in or st.session_state.page == 'login':
         from login import login_page
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from storage import file_lock, file_version, save_json
+
+METRICS_FILE = 'system_metrics.json'
+DATA_FILE = 'energy_data.csv'
+MODEL_FILE = 'energy_model.pkl'
+
+# Number of points kept for the admin trend chart
+TREND_POINTS = 365
+
+_lock = threading.Lock()
+_cache = {'mtime': None, 'metrics': {}}
+
+
+def _file_mtime(filename):
+    return os.path.getmtime(filename) if os.path.exists(filename) else None
+
+
+def load_metrics():
+    """Return the stored metrics, re-reading the file only when it has changed"""
+    version = file_version(METRICS_FILE)
+    with _lock:
+        if version is None:
+            return {}
+        if version != _cache['mtime']:
+            with open(METRICS_FILE) as f:
+                _cache['metrics'] = json.load(f)
+            _cache['mtime'] = version
+        return dict(_cache['metrics'])
+
+
+def update_metrics(**fields):
+    """Merge fields into the metrics table and persist it"""
+    with file_lock(METRICS_FILE):
+        metrics = load_metrics()
+        metrics.update(fields)
+        metrics['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with _lock:
+            _cache['mtime'] = save_json(metrics, METRICS_FILE, indent=2, default=str)
+            _cache['metrics'] = metrics
+    return metrics
+
+
+def data_metrics(data):
+    """Summary metrics for a consumption DataFrame"""
+    dates = pd.to_datetime(data['date'])
+    values = data['consumption_kwh'].to_numpy(dtype=np.float64)
+    metrics = {
+        'data_rows': int(len(data)),
+        'data_start': str(dates.min().date()) if len(data) else None,
+        'data_end': str(dates.max().date()) if len(data) else None,
+        'data_days': int(dates.dt.normalize().nunique()),
+        'mean_kwh': float(values.mean()) if len(values) else None,
+        'total_kwh': float(values.sum())
+    }
+    if 'meter_id' in data.columns:
+        means = data.groupby('meter_id')['consumption_kwh'].mean()
+        metrics['meter_count'] = int(len(means))
+        metrics['meter_means'] = {str(k): float(v) for k, v in means.items()}
+
+    # Downsample the series for the trend chart
+    step = max(len(data) // TREND_POINTS, 1)
+    trend = pd.DataFrame({'date': dates.to_numpy(), 'value': values})
+    trend = trend.groupby(np.arange(len(trend)) // step).agg(date=('date', 'first'), value=('value', 'mean'))
+    metrics['trend'] = {
+        'dates': trend['date'].dt.strftime('%Y-%m-%d').tolist(),
+        'values': trend['value'].round(3).tolist()
+    }
+    return metrics
+
+
+def record_data(data, filename=DATA_FILE):
+    """Update data metrics after the system data file has been written"""
+    return update_metrics(data_mtime=_file_mtime(filename), **data_metrics(data))
+
+
+def record_user_counts(users=None, admins=None):
+    """Update user counts after a user table has been saved"""
+    fields = {}
+    if users is not None:
+        fields['user_count'] = int(len(users))
+    if admins is not None:
+        fields['admin_count'] = int(len(admins))
+    return update_metrics(**fields)
+
+
+def record_backtest(mse, model_version=None, test_points=None, filename=MODEL_FILE):
+    """
+    Update the latest model evaluation after a model has been trained and
+    saved. `mse` is None when there were too few rows to test on; the model
+    file is still recorded so the evaluation is not retried on every render.
+    """
+    return update_metrics(model_mse=None if mse is None else float(mse), model_version=model_version,
+                          model_test_points=test_points, model_mtime=_file_mtime(filename),
+                          model_evaluated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def data_metrics_stale(metrics, filename=DATA_FILE):
+    """True when the data file changed without the metrics being refreshed"""
+    return metrics.get('data_mtime') != _file_mtime(filename)
+
+
+def model_metrics_stale(metrics, filename=MODEL_FILE):
+    """True when the model file changed without a recorded backtest"""
+    return metrics.get('model_mtime') != _file_mtime(filename)
@@ -1,62 +1,145 @@
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.metrics import mean_squared_error
 import joblib
+import hashlib
+import pickle
 import os
+from forecast_cache import get_forecast_cache
+from preprocessing import clean_series
+from metrics_store import record_backtest
+from storage import save_joblib
+from timeseries import CompactSeries
 
-def prepare_data(df, lag_days=7):
+# Model settings used when a model carries no tuned configuration
+DEFAULT_CONFIG = {'lag_days': 7, 'feature_set': 'lags', 'alpha': 0.0}
+FEATURE_SETS = ('lags', 'lags+stats')
+
+def make_features(windows, feature_set='lags'):
     """
-    Prepare data for time series forecasting by creating lag features.
+    Build the feature matrix from newest-first lag windows (one per row).
+    'lags+stats' appends the window mean, min and max.
+    """
+    if feature_set == 'lags':
+        return windows
+    if feature_set == 'lags+stats':
+        return np.hstack([windows, windows.mean(axis=1, keepdims=True),
+                          windows.min(axis=1, keepdims=True), windows.max(axis=1, keepdims=True)])
+    raise ValueError(f"Unknown feature set: {feature_set}")
+
+def model_config(model):
     """
-    df = df.copy()
-    df['date'] = pd.to_datetime(df['date'])
-    df = df.set_index('date')
+    The configuration a model was trained with (tuned models carry it as
+    `ecowatt_config_`; older models fall back to the defaults).
+    """
+    return {**DEFAULT_CONFIG, **getattr(model, 'ecowatt_config_', {})}
+
+def feature_args(config):
+    """prepare_data keyword arguments for a model configuration"""
+    return {'lag_days': int(config['lag_days']), 'feature_set': config['feature_set']}
 
-    # Create lag features
-    for i in range(1, lag_days + 1):
-        df[f'lag_{i}'] = df['consumption_kwh'].shift(i)
+def build_model(alpha=0.0):
+    """
+    Unfitted regressor: plain least squares, or ridge when alpha > 0.
+    """
+    return Ridge(alpha=alpha) if alpha > 0 else LinearRegression()
 
-    # Drop rows with NaN values
-    df = df.dropna()
+def prepare_data(df, lag_days=7, clean=True, feature_set='lags'):
+    """
+    Prepare data for time series forecasting by creating lag features.
 
-    # Features and target
-    X = df[[f'lag_{i}' for i in range(1, lag_days + 1)]]
-    y = df['consumption_kwh']
+    Accepts a DataFrame or a CompactSeries. With `clean` the series is first
+    reindexed to its regular frequency and gaps are imputed, so each lag is
+    a fixed step in time rather than a row. Returns float32 arrays (X, y);
+    column i of X is the value i + 1 steps back, followed by any extra
+    columns of `feature_set`.
+    """
+    if isinstance(df, CompactSeries):
+        series = df
+        if clean and not series.is_regular:
+            series = CompactSeries.from_frame(clean_series(series.to_frame())[0])
+    elif clean:
+        series = CompactSeries.from_frame(clean_series(df)[0])
+    else:
+        series = CompactSeries.from_frame(df)
 
-    return X, y
+    X, y = series.lag_matrix(lag_days)
+    return make_features(X, feature_set), y
 
-def train_model(X_train, y_train):
+def train_model(X_train, y_train, config=None):
     """
-    Train a linear regression model.
+    Train a linear regression model. With a tuned `config` the model uses
+    its regularization and keeps the config so prediction can rebuild the
+    same features.
     """
-    model = LinearRegression()
+    model = build_model(config['alpha'] if config else 0.0)
     model.fit(X_train, y_train)
+    if config:
+        model.ecowatt_config_ = dict(config)
     return model
 
-def predict_future(model, last_known_data, days_ahead=30, lag_days=7):
+def predict_future(model, last_known_data, days_ahead=30, lag_days=None):
     """
     Predict future energy consumption.
+
+    `last_known_data` is an array (oldest value first) or a CompactSeries.
+    The window length and features come from the model's configuration
+    unless `lag_days` is given. Linear models are rolled forward with plain
+    NumPy dot products instead of one `model.predict` call per step.
     """
-    predictions = []
-    current_data = last_known_data.copy()
+    config = model_config(model)
+    lag_days = lag_days or int(config['lag_days'])
+    feature_set = config['feature_set']
+    if isinstance(last_known_data, CompactSeries):
+        last_known_data = last_known_data.tail(lag_days)
+    # Window ordered newest first, like the lag_1..lag_n training features
+    window = np.asarray(last_known_data, dtype=np.float64)[-lag_days:][::-1].copy()
+    predictions = np.empty(days_ahead)
+
+    coef = getattr(model, 'coef_', None)
+    n_features = make_features(window[None, :], feature_set).shape[1]
+    linear = coef is not None and np.ndim(coef) == 1 and len(coef) == n_features
+    for step in range(days_ahead):
+        features = window if feature_set == 'lags' else make_features(window[None, :], feature_set)[0]
+        if linear:
+            pred = float(features @ coef + model.intercept_)
+        else:
+            pred = float(model.predict(features[None, :])[0])
+        predictions[step] = pred
+
+        # Shift the window: the new prediction becomes lag_1
+        window[1:] = window[:-1]
+        window[0] = pred
 
-    for _ in range(days_ahead):
-        # Prepare features for prediction
-        features = np.array([current_data[-lag_days:]])
-        pred = model.predict(features)[0]
-        predictions.append(pred)
+    return predictions
 
-        # Update current data with prediction
-        current_data = np.append(current_data[1:], pred)
+def evaluate_model(model, X, y, split=0.8):
+    """
+    Mean squared error on the last (1 - split) share of the rows.
+    Returns (mse, test_points); mse is None when there are no test rows.
+    """
+    split_idx = int(len(X) * split)
+    X_test, y_test = X[split_idx:], y[split_idx:]
+    if len(X_test) == 0:
+        return None, 0
+    y_pred = model.predict(X_test)
+    return float(mean_squared_error(y_test, y_pred)), len(X_test)
 
-    return predictions
+def model_version(model):
+    """
+    Return a short content hash identifying a trained model.
+    """
+    return hashlib.sha1(pickle.dumps(model)).hexdigest()[:16]
 
-def save_model(model, filename='energy_model.pkl'):
+def save_model(model, filename='energy_model.pkl', expected_version=None):
     """
-    Save the trained model.
+    Save the trained model and drop forecasts cached for older versions.
+    With `expected_version` (from storage.file_version) the save fails with
+    VersionConflict if another session replaced the file in the meantime.
     """
-    joblib.dump(model, filename)
+    save_joblib(model, filename, expected_version)
+    get_forecast_cache().invalidate()
 
 def load_model(filename='energy_model.pkl'):
     """
@@ -68,8 +151,11 @@ def load_model(filename='energy_model.pkl'):
         return None
 
 if __name__ == "__main__":
-    # Load data
-    data = pd.read_csv('energy_data.csv')
+    # Load data across all retention tiers
+    from retention import load_history
+    data = load_history()
+    if data is None:
+        raise SystemExit("No energy data found; run data_generator.py first")
 
     # Prepare data
     X, y = prepare_data(data)
@@ -83,10 +169,10 @@ if __name__ == "__main__":
     model = train_model(X_train, y_train)
 
     # Evaluate
-    y_pred = model.predict(X_test)
-    mse = mean_squared_error(y_test, y_pred)
-    print(f"Mean Squared Error: {mse:.2f}")
+    mse, test_points = evaluate_model(model, X, y)
+    print(f"Mean Squared Error: {'n/a' if mse is None else f'{mse:.2f}'}")
 
     # Save model
     save_model(model)
+    record_backtest(mse, model_version(model), test_points)
     print("Model trained and saved.")
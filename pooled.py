@@ -0,0 +1,211 @@
+import os
+import threading
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+from model import build_model, load_model
+from timeseries import CompactSeries
+
+GLOBAL_MODEL_FILE = 'global_model.pkl'
+# Directory of per-meter series used by the batch CLI, where the global model is saved
+METER_DATA_DIR = os.environ.get('ECOWATT_METER_DIR', 'meters')
+
+DEFAULT_LAG_DAYS = 14
+DEFAULT_ALPHA = 1.0
+DEFAULT_CLUSTERS = 0
+
+# Floor on a meter's scale so flat or very short series don't blow up when normalized
+MIN_SCALE = 1e-3
+
+
+def series_stats(values):
+    """(offset, scale) used to normalize one meter: its mean and standard deviation"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return 0.0, 1.0
+    offset = float(values.mean())
+    scale = float(values.std()) if len(values) > 1 else 0.0
+    return offset, max(scale, MIN_SCALE * max(abs(offset), 1.0))
+
+
+def weekly_profile(series):
+    """Mean normalized value per weekday; the shape used to cluster meters"""
+    profile = np.zeros(7)
+    if len(series) == 0:
+        return profile
+    offset, scale = series_stats(series.values)
+    weekdays = (series.timestamps.astype('datetime64[D]').astype(np.int64) + 3) % 7
+    counts = np.bincount(weekdays, minlength=7)
+    sums = np.bincount(weekdays, weights=(series.values - offset) / scale, minlength=7)
+    np.divide(sums, counts, out=profile, where=counts > 0)
+    return profile
+
+
+class GlobalModel:
+    """
+    One regression shared by every meter.
+
+    Each meter is normalized by its own offset and scale, and the normalized
+    lag windows of all meters are stacked into one training matrix. Per-row
+    series features (log offset, log scale and, optionally, a one-hot
+    cluster of the weekly shape) let the shared coefficients adapt to each
+    meter. Meters with too little history for lag rows still get a
+    forecast: they only need an offset and scale, and any missing lags are
+    filled with their mean.
+    """
+
+    def __init__(self, lag_days=DEFAULT_LAG_DAYS, alpha=DEFAULT_ALPHA, n_clusters=DEFAULT_CLUSTERS):
+        self.lag_days = int(lag_days)
+        self.alpha = float(alpha)
+        self.n_clusters = int(n_clusters)
+        self.meters = {}
+        self.centers = None
+        self.coef_ = None
+        self.intercept_ = 0.0
+
+    def __len__(self):
+        return len(self.meters)
+
+    def _cluster(self, profiles):
+        if self.centers is None:
+            return np.zeros(len(profiles), dtype=int)
+        distances = ((profiles[:, None, :] - self.centers[None, :, :]) ** 2).sum(axis=2)
+        return distances.argmin(axis=1)
+
+    def _describe(self, series_by_meter):
+        """(offset, scale, cluster) per meter: stored for known meters, computed for new ones"""
+        known = {m: self.meters[m] for m in series_by_meter if m in self.meters}
+        new = [m for m in series_by_meter if m not in self.meters]
+        if new:
+            clusters = self._cluster(np.array([weekly_profile(series_by_meter[m]) for m in new]))
+            for meter_id, cluster in zip(new, clusters):
+                known[meter_id] = series_stats(series_by_meter[meter_id].values) + (int(cluster),)
+        return known
+
+    def _series_features(self, stats):
+        """Per-meter feature rows (M, 2 + n_clusters) from (offset, scale, cluster) tuples"""
+        stats = np.array(stats, dtype=np.float64).reshape(-1, 3)
+        features = np.zeros((len(stats), 2 + self.n_clusters))
+        features[:, 0] = np.log1p(np.maximum(stats[:, 0], 0.0))
+        features[:, 1] = np.log1p(stats[:, 1])
+        if self.n_clusters:
+            features[np.arange(len(stats)), 2 + stats[:, 2].astype(int)] = 1.0
+        return features
+
+    def fit(self, series_by_meter):
+        """Train on {meter_id: CompactSeries} (regular, gap-filled series)"""
+        self.meters = {}
+        self.centers = None
+        if self.n_clusters:
+            from sklearn.cluster import KMeans
+            profiles = np.array([weekly_profile(s) for s in series_by_meter.values()])
+            k = min(self.n_clusters, len(profiles))
+            self.centers = KMeans(n_clusters=k, n_init=10, random_state=0).fit(profiles).cluster_centers_
+        self.meters = self._describe(series_by_meter)
+
+        blocks, targets = [], []
+        for meter_id, series in series_by_meter.items():
+            offset, scale, _ = self.meters[meter_id]
+            X, y = series.lag_matrix(self.lag_days)
+            if len(y) == 0:
+                continue
+            embedding = self._series_features([self.meters[meter_id]]).astype(np.float32)
+            blocks.append(np.hstack([(X - offset) / scale, np.repeat(embedding, len(y), axis=0)]))
+            targets.append((y - offset) / scale)
+        if not blocks:
+            raise ValueError(f"no meter has more than {self.lag_days} days of history")
+
+        regressor = build_model(self.alpha).fit(np.vstack(blocks), np.concatenate(targets))
+        self.coef_ = regressor.coef_.astype(np.float64)
+        self.intercept_ = float(regressor.intercept_)
+        return self
+
+    def _windows(self, series_by_meter, stats):
+        """Normalized newest-first lag windows (M, lag_days); short histories are padded with the mean"""
+        windows = np.zeros((len(series_by_meter), self.lag_days))
+        for row, (series, (offset, scale, _)) in enumerate(zip(series_by_meter.values(), stats)):
+            recent = np.asarray(series.tail(self.lag_days), dtype=np.float64)[::-1]
+            windows[row, :len(recent)] = (recent - offset) / scale
+        return windows
+
+    def forecast(self, series_by_meter, days_ahead=30):
+        """
+        Batched forecast for {meter_id: CompactSeries}. All meters are rolled
+        forward together, one matrix-vector product per day. Returns
+        (meter ids, predictions of shape (M, days_ahead)).
+        """
+        meter_ids = list(series_by_meter)
+        described = self._describe(series_by_meter)
+        stats = [described[m] for m in meter_ids]
+        windows = self._windows(series_by_meter, stats)
+        lag_coef = self.coef_[:self.lag_days]
+        bias = self._series_features(stats) @ self.coef_[self.lag_days:] + self.intercept_
+
+        predictions = np.empty((len(meter_ids), days_ahead))
+        for step in range(days_ahead):
+            predictions[:, step] = windows @ lag_coef + bias
+            windows[:, 1:] = windows[:, :-1]
+            windows[:, 0] = predictions[:, step]
+        offsets, scales = np.array([s[0] for s in stats]), np.array([s[1] for s in stats])
+        return meter_ids, predictions * scales[:, None] + offsets[:, None]
+
+    def meter_model(self, meter_id, series=None):
+        """
+        The shared model specialised to one meter as a plain LinearRegression
+        on raw lag features, so it drops into predict_future, evaluate_model
+        and the drift checks. Unknown meters need their `series`. The view
+        needs a full lag window of history; shorter series are forecast with
+        forecast(), which pads the window.
+        """
+        if meter_id in self.meters:
+            offset, scale, cluster = self.meters[meter_id]
+        elif series is not None:
+            offset, scale, cluster = self._describe({meter_id: series})[meter_id]
+        else:
+            return None
+        lag_coef = self.coef_[:self.lag_days]
+        bias = float(self._series_features([(offset, scale, cluster)])[0] @ self.coef_[self.lag_days:])
+        # y = offset + scale * (w . (x - offset) / scale + b)  =  w . x + offset * (1 - sum w) + scale * b
+        model = LinearRegression()
+        model.coef_ = lag_coef.copy()
+        model.intercept_ = offset * (1.0 - lag_coef.sum()) + scale * (bias + self.intercept_)
+        model.n_features_in_ = self.lag_days
+        model.ecowatt_config_ = {'lag_days': self.lag_days, 'feature_set': 'lags', 'alpha': self.alpha}
+        return model
+
+
+def train_global(series_by_meter, lag_days=DEFAULT_LAG_DAYS, alpha=DEFAULT_ALPHA, n_clusters=DEFAULT_CLUSTERS):
+    """Fit a GlobalModel on {meter_id: CompactSeries} or {meter_id: DataFrame}"""
+    from preprocessing import clean_series
+    series_by_meter = {
+        str(m): s if isinstance(s, CompactSeries) else CompactSeries.from_frame(clean_series(s)[0])
+        for m, s in series_by_meter.items()
+    }
+    return GlobalModel(lag_days, alpha, n_clusters).fit(series_by_meter)
+
+
+def global_model_path(data_dir=METER_DATA_DIR):
+    """Where `cli.py train --global` saves the model for a meter data directory"""
+    return os.path.join(data_dir, GLOBAL_MODEL_FILE)
+
+
+_loaded = {'key': None, 'model': None}
+_loaded_lock = threading.Lock()
+
+
+def get_global_model(filename=None):
+    """
+    The saved global model (by default the one in METER_DATA_DIR), kept in
+    memory until the file changes; None if there is none
+    """
+    filename = filename or global_model_path()
+    try:
+        key = (os.path.abspath(filename), os.stat(filename).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    with _loaded_lock:
+        if _loaded['key'] != key:
+            _loaded['model'] = load_model(filename)
+            _loaded['key'] = key
+        return _loaded['model']
@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+DAY = np.timedelta64(1, 'D')
+
+# Scale factor turning a MAD into a standard-deviation estimate for normal data
+MAD_SCALE = 1.4826
+
+# A regular grid may be at most this many slots per reading (and at least MIN_GRID_SLOTS
+# long); readings stranded further out, e.g. a mistyped year, are dropped instead
+MAX_GRID_FACTOR = 20
+MIN_GRID_SLOTS = 10000
+
+# Values held at once while evaluating rolling windows (8 bytes each)
+ROLLING_CHUNK_ELEMENTS = 2 ** 20
+
+
+def infer_frequency(dates):
+    """Infer the sampling step of a sorted datetime64 array from its median spacing"""
+    diffs = np.diff(dates).astype(np.int64)
+    # Repeated timestamps are duplicates, not a zero-length step
+    diffs = diffs[diffs > 0]
+    if len(diffs) == 0:
+        return DAY
+    return np.timedelta64(int(np.median(diffs)), 'ns')
+
+
+def default_season(step):
+    """Seasonal period in samples: one day for intraday data, one week for daily data"""
+    if step < DAY:
+        return max(int(DAY // step), 1)
+    return max(int(np.timedelta64(7, 'D') // step), 1)
+
+
+def _densest_span(slots, max_slots):
+    """(first, last) positions of the sorted slots covering the most readings within `max_slots`"""
+    ends = np.searchsorted(slots, slots + max_slots, side='left')
+    first = int(np.argmax(ends - np.arange(len(slots))))
+    return first, int(ends[first]) - 1
+
+
+def regularize(dates, values, step):
+    """
+    Snap readings onto a regular grid of `step`, averaging duplicates.
+    Returns (grid_dates, grid_values, duplicates, dropped) with NaN where no
+    reading exists. The grid length is bounded by MAX_GRID_FACTOR; readings
+    outside the densest span that fits are dropped and counted.
+    """
+    order = np.argsort(dates, kind='stable')
+    dates, values = dates[order], values[order]
+    step_ns = max(int(step.astype('timedelta64[ns]').astype(np.int64)), 1)
+    slots = np.rint((dates - dates[0]).astype(np.int64) / step_ns).astype(np.int64)
+
+    dropped = 0
+    max_slots = max(MAX_GRID_FACTOR * len(slots), MIN_GRID_SLOTS)
+    if slots[-1] >= max_slots:
+        first, last = _densest_span(slots, max_slots)
+        dropped = len(slots) - (last - first + 1)
+        dates, values, slots = dates[first:last + 1], values[first:last + 1], slots[first:last + 1] - slots[first]
+    start = dates[0]
+
+    sums = np.bincount(slots, weights=np.nan_to_num(values), minlength=slots[-1] + 1)
+    counts = np.bincount(slots, weights=~np.isnan(values), minlength=slots[-1] + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid_values = np.where(counts > 0, sums / counts, np.nan)
+    grid_dates = start + np.arange(len(grid_values)) * np.timedelta64(step_ns, 'ns')
+    duplicates = len(slots) - len(np.unique(slots))
+    return grid_dates, grid_values, duplicates, dropped
+
+
+def _forward_fill_index(valid):
+    """Row index of the most recent valid entry in each column (-1 if none yet)"""
+    idx = np.where(valid, np.arange(valid.shape[0])[:, None], -1)
+    return np.maximum.accumulate(idx, axis=0)
+
+
+def impute_linear(values):
+    """Fill NaNs by linear interpolation, holding the edge values flat"""
+    missing = np.isnan(values)
+    if not missing.any() or missing.all():
+        return values.copy()
+    positions = np.arange(len(values))
+    filled = values.copy()
+    filled[missing] = np.interp(positions[missing], positions[~missing], values[~missing])
+    return filled
+
+
+def impute_seasonal(values, season):
+    """
+    Fill NaNs with the last observed value at the same seasonal phase
+    (seasonal-naive). Slots with no earlier observation fall back to linear.
+    """
+    n = len(values)
+    rows = -(-n // season)
+    padded = np.full(rows * season, np.nan)
+    padded[:n] = values
+    table = padded.reshape(rows, season)
+
+    last = _forward_fill_index(~np.isnan(table))
+    has_prior = last >= 0
+    filled = np.where(has_prior, table[np.maximum(last, 0), np.arange(season)], np.nan)
+    filled = filled.reshape(-1)[:n]
+    return impute_linear(filled)
+
+
+def rolling_median_mad(values, window):
+    """
+    Centered rolling median and MAD; windows are truncated at the edges.
+    Windows are evaluated in chunks of at most ROLLING_CHUNK_ELEMENTS values,
+    so memory stays bounded for long intraday series. Windows with no valid
+    value give NaN.
+    """
+    window = max(int(window) | 1, 3)
+    half = window // 2
+    padded = np.pad(values.astype(np.float64), half, constant_values=np.nan)
+    windows = sliding_window_view(padded, window)
+    median = np.full(len(windows), np.nan)
+    mad = np.full(len(windows), np.nan)
+    step = max(ROLLING_CHUNK_ELEMENTS // window, 1)
+    for start in range(0, len(windows), step):
+        chunk = windows[start:start + step]
+        valid = ~np.isnan(chunk).all(axis=1)
+        if not valid.any():
+            continue
+        chunk = chunk[valid]
+        chunk_median = np.nanmedian(chunk, axis=1)
+        rows = np.flatnonzero(valid) + start
+        median[rows] = chunk_median
+        mad[rows] = np.nanmedian(np.abs(chunk - chunk_median[:, None]), axis=1)
+    return median, mad
+
+
+def flag_outliers(values, window=15, threshold=3.5):
+    """Boolean mask of points further than `threshold` robust sigmas from the rolling median"""
+    median, mad = rolling_median_mad(values, window)
+    sigma = MAD_SCALE * mad
+    floor = 1e-9 * max(np.nanmax(np.abs(median), initial=0.0), 1.0)
+    return np.abs(values - median) > threshold * np.maximum(sigma, floor), median
+
+
+def _gap_runs(missing):
+    """Lengths of consecutive runs of missing slots"""
+    edges = np.diff(np.r_[0, missing.astype(np.int8), 0])
+    return np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+
+def clean_series(df, freq=None, impute='linear', season=None, outlier_window=None,
+                 outlier_threshold=3.5, replace_outliers=False):
+    """
+    Reindex a `date`/`consumption_kwh` series to a regular frequency, impute
+    gaps and flag outliers. Returns (cleaned DataFrame, quality report dict).
+
+    The cleaned frame adds boolean `is_imputed` and `is_outlier` columns.
+    The outlier window defaults to two seasonal periods so the cycle itself
+    is not mistaken for outliers.
+    """
+    if impute not in ('linear', 'seasonal'):
+        raise ValueError("impute must be 'linear' or 'seasonal'")
+    dates = pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]')
+    values = df['consumption_kwh'].to_numpy(dtype=np.float64)
+    rows_in = len(values)
+    if rows_in == 0:
+        empty = pd.DataFrame({'date': dates, 'consumption_kwh': values,
+                              'is_imputed': np.zeros(0, bool), 'is_outlier': np.zeros(0, bool)})
+        return empty, {'rows_in': 0, 'rows_out': 0, 'duplicates': 0, 'dropped': 0, 'missing': 0, 'gaps': 0,
+                       'longest_gap': 0, 'outliers': 0, 'completeness': 1.0, 'frequency': None}
+
+    step = np.timedelta64(pd.Timedelta(freq).value, 'ns') if freq else infer_frequency(np.sort(dates))
+    if season is None:
+        season = default_season(step)
+    if outlier_window is None:
+        outlier_window = 2 * season + 1
+
+    grid_dates, grid_values, duplicates, dropped = regularize(dates, values, step)
+    missing = np.isnan(grid_values)
+
+    # Detect outliers first so they never seed the imputation of a gap
+    outliers, median = flag_outliers(impute_linear(grid_values), outlier_window, outlier_threshold)
+    outliers &= ~missing
+    basis = np.where(outliers, np.nan, grid_values)
+    if impute == 'seasonal':
+        imputed = impute_seasonal(basis, season)
+    else:
+        imputed = impute_linear(basis)
+
+    filled = np.where(missing, imputed, grid_values)
+    if replace_outliers:
+        filled = np.where(outliers, median, filled)
+
+    runs = _gap_runs(missing)
+    cleaned = pd.DataFrame({
+        'date': grid_dates,
+        'consumption_kwh': filled,
+        'is_imputed': missing,
+        'is_outlier': outliers
+    })
+    report = {
+        'rows_in': rows_in,
+        'rows_out': len(cleaned),
+        'duplicates': int(duplicates),
+        'dropped': int(dropped),
+        'missing': int(missing.sum()),
+        'gaps': int(len(runs)),
+        'longest_gap': int(runs.max(initial=0)),
+        'outliers': int(outliers.sum()),
+        'completeness': float(1.0 - missing.mean()),
+        'frequency': pd.Timedelta(step)
+    }
+    return cleaned, report
@@ -0,0 +1,316 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from storage import atomic_write, file_lock, save_csv, save_json
+from timeindex import TimeIndex
+
+
+def _env_number(name, default, cast=float):
+    value = os.environ.get(name)
+    return cast(value) if value else default
+
+
+DATA_FILE = 'energy_data.csv'
+ARCHIVE_DIR = 'archive'
+MANIFEST_NAME = 'manifest.json'
+
+# Readings younger than RAW_DAYS stay at full resolution in the data file; older
+# ones are rolled up to hourly, and beyond HOURLY_DAYS to daily, aggregates
+RAW_DAYS = _env_number('ECOWATT_RAW_DAYS', 90, int)
+HOURLY_DAYS = _env_number('ECOWATT_HOURLY_DAYS', 730, int)
+PARTITION_CACHE_SIZE = _env_number('ECOWATT_PARTITION_CACHE', 24, int)
+
+TIERS = ('raw', 'hourly', 'daily')
+TIER_FREQ = {'hourly': 'h', 'daily': 'D'}
+STAT_COLUMNS = ['min_kwh', 'max_kwh', 'count']
+
+
+def rollup(df, freq):
+    """
+    Aggregate readings to `freq` buckets per meter: consumption is summed,
+    with the min and max reading and the reading count kept alongside.
+    Already-aggregated input (with the stat columns) rolls up consistently.
+    """
+    keys = [df['date'].dt.floor(freq).rename('date')]
+    if 'meter_id' in df.columns:
+        keys.append(df['meter_id'])
+    if 'count' in df.columns:
+        parts = df[['consumption_kwh'] + STAT_COLUMNS]
+    else:
+        parts = pd.DataFrame({'consumption_kwh': df['consumption_kwh'], 'min_kwh': df['consumption_kwh'],
+                              'max_kwh': df['consumption_kwh'], 'count': 1}, index=df.index)
+    grouped = parts.groupby(keys, sort=True).agg(
+        {'consumption_kwh': 'sum', 'min_kwh': 'min', 'max_kwh': 'max', 'count': 'sum'})
+    return grouped.reset_index()
+
+
+def _month_key(ts):
+    return pd.Timestamp(ts).strftime('%Y-%m')
+
+
+def _read_frame(path):
+    frame = pd.read_csv(path, dtype={'meter_id': str})
+    frame['date'] = pd.to_datetime(frame['date'])
+    return frame
+
+
+class TieredStore:
+    """
+    Readings stored in three tiers: recent raw readings in the data file,
+    then monthly gzip-compressed partitions of hourly and of daily
+    aggregates under the archive directory. A manifest records each
+    partition's date range so queries only decompress the partitions they
+    reach, and decompressed partitions are kept in a small LRU cache.
+
+    The manifest also records the raw cutoff: the data file is authoritative
+    from the cutoff on, the archive before it. Compaction writes partitions,
+    then the manifest, then trims the data file, and readers read the data
+    file before the manifest, so a query overlapping a compaction never sees
+    moved readings twice or not at all.
+    """
+
+    def __init__(self, data_file=DATA_FILE, archive_dir=ARCHIVE_DIR, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS,
+                 cache_size=PARTITION_CACHE_SIZE):
+        self.data_file = data_file
+        self.archive_dir = archive_dir
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.archive_dir, MANIFEST_NAME)
+
+    def manifest(self):
+        """{'raw_cutoff': timestamp string or None, 'partitions': {'<tier>/<YYYY-MM>': partition entry}}"""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'raw_cutoff': None, 'partitions': {}}
+        if 'partitions' not in manifest:
+            # Manifests written before the raw cutoff was recorded held only the partitions
+            manifest = {'raw_cutoff': None, 'partitions': manifest}
+        return manifest
+
+    def _partition_path(self, tier, month):
+        return os.path.join(self.archive_dir, tier, f"{month}.csv.gz")
+
+    def _read_partition(self, entry):
+        path = entry['path']
+        key = (path, os.stat(path).st_mtime_ns)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        frame = _read_frame(path)
+        with self._lock:
+            self._cache[key] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def _write_partition(self, partitions, tier, month, frame):
+        """
+        Write `frame` into a tier's month partition and update the manifest
+        entry. Buckets the frame covers replace those already stored rather
+        than adding to them, so repeating a move after a failure is harmless.
+        """
+        key = f"{tier}/{month}"
+        frame = rollup(frame, TIER_FREQ[tier])
+        path = self._partition_path(tier, month)
+        if os.path.exists(path):
+            stored = self._read_partition({'path': path})
+            keys = ['date'] + (['meter_id'] if 'meter_id' in frame.columns else [])
+            if set(keys) <= set(stored.columns):
+                covered = pd.MultiIndex.from_frame(frame[keys])
+                stored = stored[~pd.MultiIndex.from_frame(stored[keys]).isin(covered)]
+            frame = rollup(pd.concat([stored, frame], ignore_index=True), TIER_FREQ[tier])
+        path = self._partition_path(tier, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            frame.to_csv(f, index=False, compression='gzip')
+        partitions[key] = {'tier': tier, 'month': month, 'path': path, 'rows': int(len(frame)),
+                         'readings': int(frame['count'].sum()), 'bytes': os.path.getsize(path),
+                         'start': str(frame['date'].min()), 'end': str(frame['date'].max())}
+
+    def read_raw(self):
+        """The raw tier (the data file), or None if there is none"""
+        if not os.path.exists(self.data_file):
+            return None
+        return _read_frame(self.data_file)
+
+    def compact(self):
+        """
+        Move raw readings older than `raw_days` into hourly partitions and
+        hourly months older than `hourly_days` into daily partitions. Ages
+        are measured back from the newest reading. Returns counts of what moved.
+
+        Archived buckets still present in the data file (e.g. after an
+        interrupted compaction) are replaced by them, not added to.
+        """
+        moved = {'raw_to_hourly': 0, 'hourly_to_daily': 0}
+        with file_lock(self.data_file):
+            raw = self.read_raw()
+            if raw is None or raw.empty:
+                return moved
+            manifest = self.manifest()
+            partitions = manifest['partitions']
+            newest = raw['date'].max()
+
+            # Cut at midnight so no hour is split between the raw and hourly tiers
+            raw_cutoff = (newest - pd.Timedelta(days=self.raw_days)).normalize()
+            old = raw[raw['date'] < raw_cutoff]
+            if len(old):
+                for month, readings in old.groupby(old['date'].dt.strftime('%Y-%m')):
+                    self._write_partition(partitions, 'hourly', month, readings)
+                moved['raw_to_hourly'] = len(old)
+
+            # Whole months only, so each month lives in exactly one archive tier
+            daily_cutoff = _month_key(newest - pd.Timedelta(days=self.hourly_days))
+            retired = []
+            for key in sorted(k for k, e in partitions.items() if e['tier'] == 'hourly' and e['month'] < daily_cutoff):
+                entry = partitions.pop(key)
+                self._write_partition(partitions, 'daily', entry['month'], self._read_partition(entry))
+                retired.append(entry['path'])
+                moved['hourly_to_daily'] += 1
+
+            if len(old) or retired:
+                if len(old):
+                    manifest['raw_cutoff'] = str(raw_cutoff)
+                os.makedirs(self.archive_dir, exist_ok=True)
+                save_json(manifest, self.manifest_path, indent=2)
+            # Only once the manifest points at the new partitions are the old copies dropped
+            if len(old):
+                save_csv(raw[raw['date'] >= raw_cutoff], self.data_file)
+            for path in retired:
+                os.remove(path)
+        return moved
+
+    def replace(self, data):
+        """Replace all stored readings (e.g. with a newly generated dataset), then compact"""
+        with file_lock(self.data_file):
+            partitions = self.manifest()['partitions']
+            save_csv(data, self.data_file)
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+            for entry in partitions.values():
+                if os.path.exists(entry['path']):
+                    os.remove(entry['path'])
+        return self.compact()
+
+    def resolution(self, start=None, end=None):
+        """The coarsest tier a query over [start, end] reaches: 'raw', 'hourly' or 'daily'"""
+        tiers = {e['tier'] for e in self._partitions(self.manifest()['partitions'], start, end)}
+        return 'daily' if 'daily' in tiers else 'hourly' if 'hourly' in tiers else 'raw'
+
+    @staticmethod
+    def _partitions(partitions, start, end):
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        return [e for e in partitions.values()
+                if (start is None or pd.Timestamp(e['end']) >= start)
+                and (end is None or pd.Timestamp(e['start']) <= end)]
+
+    def _snapshot(self, start, end):
+        """
+        Consistent (raw readings, archive parts) for a range: the data file is
+        read before the manifest, and each side is cut at the manifest's raw
+        cutoff. Retried if a compaction retires a partition mid-read.
+        """
+        for attempt in range(3):
+            raw = self.read_raw()
+            manifest = self.manifest()
+            cutoff = manifest['raw_cutoff'] and pd.Timestamp(manifest['raw_cutoff'])
+            entries = sorted(self._partitions(manifest['partitions'], start, end), key=lambda e: e['start'])
+            try:
+                parts = [(e['tier'], self._read_partition(e)) for e in entries]
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+                continue
+            if cutoff:
+                parts = [(tier, p[p['date'] < cutoff]) for tier, p in parts]
+                if raw is not None:
+                    raw = raw[raw['date'] >= cutoff]
+            return raw, parts
+
+    def load(self, start=None, end=None, stats=False, native=False):
+        """
+        Readings between `start` and `end` (inclusive; None for open ends).
+
+        Only archive partitions overlapping the range are decompressed. A
+        query that stays in the raw tier returns raw readings unchanged.
+        One that reaches the archive returns every part, recent raw readings
+        included, rolled up to the coarsest tier reached, so the result is a
+        regular series with a single resolution (e.g. 200 days of 15-minute
+        readings with one hourly month come back hourly). With `native` each
+        tier keeps its own resolution instead. With `stats` the min/max/count
+        columns are included.
+        """
+        raw, parts = self._snapshot(start, end)
+        if raw is not None:
+            raw = TimeIndex(raw).between(start, end)
+        if not parts:
+            if raw is None:
+                return None
+            raw = raw.reset_index(drop=True)
+            if stats:
+                raw = raw.assign(min_kwh=raw['consumption_kwh'], max_kwh=raw['consumption_kwh'], count=1)
+            return raw
+
+        if raw is not None and len(raw):
+            parts.append(('raw', raw.assign(min_kwh=raw['consumption_kwh'], max_kwh=raw['consumption_kwh'], count=1)))
+        if native:
+            frame = pd.concat([p for _, p in parts], ignore_index=True).sort_values('date', kind='stable')
+            floor = pd.Timestamp(start) if start is not None else None
+        else:
+            freq = 'D' if any(tier == 'daily' for tier, _ in parts) else 'h'
+            frame = rollup(pd.concat([rollup(p, freq) for _, p in parts], ignore_index=True), freq)
+            floor = pd.Timestamp(start).floor(freq) if start is not None else None
+        if floor is not None:
+            frame = frame[frame['date'] >= floor]
+        if end is not None:
+            frame = frame[frame['date'] <= pd.Timestamp(end)]
+        columns = ['date'] + (['meter_id'] if 'meter_id' in frame.columns else []) + ['consumption_kwh']
+        return frame[columns + (STAT_COLUMNS if stats else [])].reset_index(drop=True)
+
+    def summary(self):
+        """One row per tier: partitions, stored rows, original readings, bytes and date range"""
+        rows = []
+        raw = self.read_raw()
+        if raw is not None and len(raw):
+            rows.append({'tier': 'raw', 'partitions': 1, 'rows': len(raw), 'readings': len(raw),
+                         'bytes': os.path.getsize(self.data_file),
+                         'start': raw['date'].min(), 'end': raw['date'].max()})
+        entries = pd.DataFrame(list(self.manifest()['partitions'].values()))
+        for tier in TIERS[1:]:
+            part = entries[entries['tier'] == tier] if len(entries) else entries
+            if len(part):
+                rows.append({'tier': tier, 'partitions': len(part), 'rows': int(part['rows'].sum()),
+                             'readings': int(part['readings'].sum()), 'bytes': int(part['bytes'].sum()),
+                             'start': pd.Timestamp(part['start'].min()), 'end': pd.Timestamp(part['end'].max())})
+        return pd.DataFrame(rows, columns=['tier', 'partitions', 'rows', 'readings', 'bytes', 'start', 'end'])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(data_file=DATA_FILE):
+    """Process-wide TieredStore per data file, sharing its partition cache"""
+    with _stores_lock:
+        if data_file not in _stores:
+            _stores[data_file] = TieredStore(data_file)
+        return _stores[data_file]
+
+
+def load_history(data_file=DATA_FILE, start=None, end=None):
+    """Tier-aware replacement for reading the data file directly; None if there is no data"""
+    return get_store(data_file).load(start, end)
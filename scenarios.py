@@ -0,0 +1,212 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from forecast_cache import window_hash
+
+# Days of the week treated as peak-tariff days (Monday=0) for load shifting
+PEAK_DAYS = (0, 1, 2, 3, 4)
+
+DEFAULT_MAX_BASES = 64
+
+# Columns of the scenario table shown in the dashboard
+SCENARIO_FIELDS = ('name', 'scale', 'efficiency', 'added_load', 'load_profile', 'growth',
+                   'price_change', 'elasticity', 'shift', 'start_day')
+# The numeric parameters, evaluated as broadcast columns
+NUMERIC_FIELDS = tuple(f for f in SCENARIO_FIELDS if f not in ('name', 'load_profile'))
+
+
+class Scenario:
+    """
+    A structured what-if adjustment of a base forecast.
+
+    scale         uniform multiplier (1.0 = unchanged)
+    efficiency    fractional saving from an efficiency upgrade, e.g. 0.15
+    added_load    kWh per day added by new equipment (EV charger, heat pump)
+    load_profile  optional weekday weights (Monday first) for the added load,
+                  also accepted as a comma-separated string
+    growth        compounded change per day, e.g. 0.001
+    price_change  fractional tariff change, e.g. 0.2 for a 20% rise
+    elasticity    demand response to price_change (negative: use less)
+    shift         fraction of peak-day load moved to off-peak days of the same week
+    start_day     first forecast day (0-based) the adjustment applies from
+    """
+
+    __slots__ = SCENARIO_FIELDS
+
+    def __init__(self, name, scale=1.0, efficiency=0.0, added_load=0.0, load_profile=None, growth=0.0,
+                 price_change=0.0, elasticity=0.0, shift=0.0, start_day=0):
+        self.name = name
+        self.scale = float(scale)
+        self.efficiency = float(efficiency)
+        self.added_load = float(added_load)
+        if isinstance(load_profile, str):
+            load_profile = [w for w in load_profile.replace(';', ',').split(',') if w.strip()] or None
+        self.load_profile = None if load_profile is None else tuple(float(w) for w in load_profile)
+        self.growth = float(growth)
+        self.price_change = float(price_change)
+        self.elasticity = float(elasticity)
+        self.shift = float(shift)
+        self.start_day = int(start_day)
+        if self.load_profile is not None and len(self.load_profile) != 7:
+            raise ValueError("load_profile needs one weight per weekday")
+        if not 0 <= self.efficiency < 1 or not 0 <= self.shift <= 1:
+            raise ValueError("efficiency and shift must be fractions between 0 and 1")
+        if self.price_change <= -1:
+            raise ValueError("price_change must be greater than -100%")
+
+    @property
+    def key(self):
+        """Hashable identity of the adjustment (the name is only a label)"""
+        return tuple(getattr(self, field) for field in self.__slots__ if field != 'name')
+
+    @classmethod
+    def from_record(cls, record):
+        """Build from a dict such as a row of the dashboard scenario table"""
+        values = {k: record[k] for k in SCENARIO_FIELDS if k in record and _is_set(record[k])}
+        return cls(**values)
+
+    def to_record(self):
+        """Table row; the load profile becomes a comma-separated string (empty for a flat load)"""
+        record = {field: getattr(self, field) for field in SCENARIO_FIELDS}
+        record['load_profile'] = '' if self.load_profile is None else ', '.join(f"{w:g}" for w in self.load_profile)
+        return record
+
+
+def _is_set(value):
+    """False for the blank cells of an edited table"""
+    if isinstance(value, str):
+        return bool(value.strip())
+    if isinstance(value, (tuple, list, np.ndarray)):
+        return True
+    return pd.notna(value)
+
+
+# Presets offered by the forecast page; the first two match the old fixed multipliers
+PRESETS = OrderedDict((s.name, s) for s in [
+    Scenario('Standard'),
+    Scenario('Conservative', scale=0.9),
+    Scenario('Optimistic', scale=1.1),
+    Scenario('Efficiency upgrade', efficiency=0.15),
+    Scenario('EV charger', added_load=8.0, load_profile=(0.8, 0.8, 0.8, 0.8, 0.8, 1.5, 1.5)),
+    Scenario('Tariff rise', price_change=0.2, elasticity=-0.3, shift=0.1),
+])
+
+
+def _parameters(scenarios):
+    """Stack scenario parameters into (S, 1) columns for broadcasting"""
+    def column(field):
+        return np.array([getattr(s, field) for s in scenarios], dtype=np.float64)[:, None]
+
+    profiles = np.array([s.load_profile or (1.0,) * 7 for s in scenarios], dtype=np.float64)
+    return {field: column(field) for field in NUMERIC_FIELDS}, profiles
+
+
+def apply_scenarios(base, scenarios, start_date):
+    """
+    Evaluate every scenario against one base forecast in a single vectorized
+    pass. Returns an array of shape (len(scenarios), len(base)).
+    """
+    base = np.asarray(base, dtype=np.float64)
+    horizon = len(base)
+    if not scenarios:
+        return np.empty((0, horizon))
+    p, profiles = _parameters(scenarios)
+    day = np.arange(horizon)
+    weekday = (pd.Timestamp(start_date).dayofweek + day) % 7
+    active = day[None, :] >= p['start_day']
+
+    # Multiplicative effects: scale, efficiency, growth and price response
+    factor = p['scale'] * (1.0 - p['efficiency']) * (1.0 + p['price_change']) ** p['elasticity']
+    factor = factor * (1.0 + p['growth']) ** np.maximum(day[None, :] - p['start_day'], 0)
+    out = base[None, :] * np.where(active, factor, 1.0)
+
+    # Added load, shaped by the weekday profile
+    out += np.where(active, p['added_load'] * profiles[:, weekday], 0.0)
+
+    # Shift a fraction of peak-day load onto the off-peak days of the same week,
+    # conserving the weekly total. Weeks without an off-peak day are left as is.
+    if (p['shift'] > 0).any():
+        peak = np.isin(weekday, PEAK_DAYS)
+        week = (day + weekday[0]) // 7
+        moved = np.where(active & peak[None, :], out * p['shift'], 0.0)
+        receivers = active & ~peak[None, :]
+        # Weekly sums as a (horizon, weeks) one-hot product keeps it batched over scenarios
+        weeks = np.eye(week[-1] + 1)[week]
+        moved_per_week = moved @ weeks
+        receiving_days = receivers.astype(np.float64) @ weeks
+        share = np.divide(moved_per_week, receiving_days, out=np.zeros_like(moved_per_week),
+                          where=receiving_days > 0)
+        # Keep energy where no off-peak day in that week is active to receive it
+        moved = np.where((receiving_days > 0)[:, week], moved, 0.0)
+        out += np.where(receivers, share[:, week], 0.0) - moved
+    return np.maximum(out, 0.0)
+
+
+def summarize(base, results, scenarios):
+    """Per-scenario totals and change against the base forecast"""
+    base_total = float(np.sum(base))
+    totals = results.sum(axis=1)
+    return pd.DataFrame({
+        'scenario': [s.name for s in scenarios],
+        'total_kwh': totals,
+        'average_kwh': results.mean(axis=1),
+        'peak_kwh': results.max(axis=1),
+        'change_pct': (totals - base_total) / base_total * 100 if base_total else np.nan
+    })
+
+
+class ScenarioEngine:
+    """
+    Caches scenario results per base forecast. Re-running a comparison only
+    evaluates scenarios not seen before for that base, still in one pass.
+    """
+
+    def __init__(self, max_bases=DEFAULT_MAX_BASES):
+        self.max_bases = max_bases
+        self._bases = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _base_key(self, base, start_date):
+        digest = hashlib.sha1(window_hash(base).encode() + str(pd.Timestamp(start_date)).encode())
+        return digest.hexdigest()
+
+    def evaluate(self, base, scenarios, start_date):
+        """Return the (scenario, horizon) array for `scenarios`, in order"""
+        base = np.asarray(base, dtype=np.float64)
+        base_key = self._base_key(base, start_date)
+        with self._lock:
+            cached = self._bases.setdefault(base_key, {})
+            self._bases.move_to_end(base_key)
+            missing = list({s.key: s for s in scenarios if s.key not in cached}.values())
+            self.hits += len(scenarios) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            rows = apply_scenarios(base, missing, start_date)
+            with self._lock:
+                for scenario, row in zip(missing, rows):
+                    cached[scenario.key] = row
+                while len(self._bases) > self.max_bases:
+                    self._bases.popitem(last=False)
+
+        if not scenarios:
+            return np.empty((0, len(base)))
+        return np.stack([cached[s.key] for s in scenarios])
+
+    def stats(self):
+        with self._lock:
+            return {'bases': len(self._bases), 'hits': self.hits, 'misses': self.misses}
+
+
+_engine = ScenarioEngine()
+
+
+def get_scenario_engine():
+    """Process-wide scenario engine shared by all sessions"""
+    return _engine
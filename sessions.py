@@ -0,0 +1,216 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from storage import file_lock, save_json
+
+SECRET_FILE = '.session_secret'
+REVOCATIONS_FILE = 'revoked_sessions.json'
+
+SESSION_TTL_SECONDS = 12 * 60 * 60
+# Browser cookie holding the token, so it never appears in URLs, history or proxy logs
+SESSION_COOKIE = 'ecowatt_session'
+SESSION_CACHE_SIZE = 10_000
+
+# User fields carried in the token so a session can be restored without the user store
+PROFILE_FIELDS = ('username', 'email', 'full_name', 'role', 'created_at')
+
+
+def _load_secret():
+    """Signing key from the environment, or a random key persisted next to the app"""
+    secret = os.environ.get('ECOWATT_SESSION_SECRET')
+    if secret:
+        return secret.encode()
+    if os.path.exists(SECRET_FILE):
+        with open(SECRET_FILE, 'rb') as f:
+            return f.read()
+    secret = secrets.token_bytes(32)
+    try:
+        fd = os.open(SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it first; wait for its key to be written and use that
+        for _ in range(50):
+            with open(SECRET_FILE, 'rb') as f:
+                existing = f.read()
+            if existing:
+                return existing
+            time.sleep(0.01)
+        raise RuntimeError(f"{SECRET_FILE} exists but is empty")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class SessionCache:
+    """TTL + LRU map of session id -> session dict"""
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_entries=SESSION_CACHE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry[1]
+
+    def put(self, sid, session):
+        with self._lock:
+            expires_at = min(session['exp'], time.time() + self.ttl_seconds)
+            self._entries[sid] = (expires_at, session)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def discard_user(self, username, user_type):
+        with self._lock:
+            stale = [sid for sid, (_, session) in self._entries.items()
+                     if session['user']['username'] == username and session['user_type'] == user_type]
+            for sid in stale:
+                del self._entries[sid]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SessionManager:
+    """
+    Issues HMAC-signed session tokens and validates them without touching the
+    user store. Revocations (logouts and deleted users) are persisted so they
+    survive a server restart.
+    """
+
+    def __init__(self, secret=None, ttl_seconds=SESSION_TTL_SECONDS, cache=None):
+        self._secret = secret
+        self.ttl_seconds = ttl_seconds
+        self.cache = cache or SessionCache(ttl_seconds)
+        self._revocations = None
+        self._revocations_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def secret(self):
+        if self._secret is None:
+            self._secret = _load_secret()
+        return self._secret
+
+    def _sign(self, body):
+        return _b64encode(hmac.new(self.secret, body.encode('ascii'), hashlib.sha256).digest())
+
+    def _load_revocations(self):
+        # Re-read only when another worker has changed the file
+        mtime = os.path.getmtime(REVOCATIONS_FILE) if os.path.exists(REVOCATIONS_FILE) else None
+        if self._revocations is None or mtime != self._revocations_mtime:
+            revocations = {'users': {}, 'sessions': {}}
+            if mtime is not None:
+                with open(REVOCATIONS_FILE) as f:
+                    revocations.update(json.load(f))
+            self._revocations = revocations
+            self._revocations_mtime = mtime
+        return self._revocations
+
+    def _save_revocations(self):
+        now = time.time()
+        revocations = self._revocations
+        # Revoked session ids only matter until their tokens expire
+        revocations['sessions'] = {sid: exp for sid, exp in revocations['sessions'].items() if exp > now}
+        save_json(revocations, REVOCATIONS_FILE)
+        self._revocations_mtime = os.path.getmtime(REVOCATIONS_FILE)
+
+    def issue(self, user, user_type):
+        """Create a signed token for a freshly authenticated user"""
+        now = time.time()
+        session = {
+            'sid': secrets.token_urlsafe(16),
+            'user': {k: str(user[k]) for k in PROFILE_FIELDS if k in user},
+            'user_type': user_type,
+            'iat': now,
+            'exp': now + self.ttl_seconds
+        }
+        body = _b64encode(json.dumps(session, separators=(',', ':')).encode())
+        self.cache.put(session['sid'], session)
+        return f"{body}.{self._sign(body)}"
+
+    def _is_revoked(self, session):
+        with self._lock:
+            revocations = self._load_revocations()
+            if session['sid'] in revocations['sessions']:
+                return True
+            revoked_at = revocations['users'].get(f"{session['user_type']}:{session['user']['username']}")
+            return revoked_at is not None and session['iat'] <= revoked_at
+
+    def validate(self, token):
+        """Return the session for a valid, unexpired, unrevoked token, else None"""
+        if not token or token.count('.') != 1:
+            return None
+        body, signature = token.split('.')
+        if not hmac.compare_digest(signature, self._sign(body)):
+            return None
+
+        try:
+            payload = json.loads(_b64decode(body))
+            sid = payload['sid']
+        except (ValueError, KeyError):
+            return None
+        if self._is_revoked(payload):
+            self.cache.discard(sid)
+            return None
+
+        session = self.cache.get(sid)
+        if session is None:
+            # Cache miss (e.g. after a restart): the signed payload is enough
+            if payload['exp'] <= time.time():
+                return None
+            session = payload
+            self.cache.put(sid, session)
+        return session
+
+    def revoke(self, token):
+        """Invalidate one token, e.g. on logout"""
+        session = self.validate(token)
+        if session is None:
+            return
+        self.cache.discard(session['sid'])
+        with self._lock, file_lock(REVOCATIONS_FILE):
+            self._load_revocations()['sessions'][session['sid']] = session['exp']
+            self._save_revocations()
+
+    def revoke_user(self, username, user_type='user'):
+        """Invalidate every session issued to a user so far"""
+        self.cache.discard_user(username, user_type)
+        with self._lock, file_lock(REVOCATIONS_FILE):
+            self._load_revocations()['users'][f"{user_type}:{username}"] = time.time()
+            self._save_revocations()
+
+
+_manager = SessionManager()
+
+
+def get_session_manager():
+    """Process-wide session manager"""
+    return _manager
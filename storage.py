@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_TIMEOUT = 10
+LOCK_POLL_SECONDS = 0.05
+
+_held = threading.local()
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a file lock could not be acquired in time"""
+
+
+class VersionConflict(RuntimeError):
+    """Raised when a file changed since the caller read it"""
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """
+    Exclusive advisory lock on `path` (via a sidecar `.lock` file), shared
+    across processes. Re-entrant within a thread so a locked
+    read-modify-write can call helpers that lock the same file.
+    """
+    lock_path = os.path.abspath(path) + '.lock'
+    held = getattr(_held, 'locks', None)
+    if held is None:
+        held = _held.locks = {}
+    if lock_path in held:
+        held[lock_path] += 1
+        try:
+            yield
+        finally:
+            held[lock_path] -= 1
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    deadline = time.monotonic() + timeout
+    try:
+        while not _try_lock(fd):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Timed out waiting for lock on {path}")
+            time.sleep(LOCK_POLL_SECONDS)
+        held[lock_path] = 1
+        try:
+            yield
+        finally:
+            del held[lock_path]
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def _create_temp(directory, basename):
+    """
+    Create a uniquely named temporary file next to the target. Unlike mkstemp
+    (always 0600) it is created with mode 0666, so the process umask applies
+    as for any new file, without reading the umask (setting it is process-wide).
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        tmp_path = os.path.join(directory, f'.{basename}.{os.urandom(6).hex()}.tmp')
+        try:
+            return os.open(tmp_path, flags, 0o666), tmp_path
+        except FileExistsError:
+            continue
+
+
+@contextmanager
+def atomic_write(path, mode='wb', **open_kwargs):
+    """
+    Write to a temporary file in the same directory and atomically rename it
+    over `path` on success, so readers never see a partial file. The file
+    keeps the permissions of the one it replaces (or the umask default for
+    a new file) rather than the private mode of the temporary file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = _create_temp(directory, os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            try:
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_version(path):
+    """Opaque version token for optimistic concurrency (None if missing)"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def check_version(path, expected_version):
+    """Raise VersionConflict if `path` no longer matches `expected_version`"""
+    if expected_version is not None and file_version(path) != expected_version:
+        raise VersionConflict(f"{path} was modified by another session")
+
+
+def save_csv(df, path, expected_version=None, **kwargs):
+    """Atomically write a DataFrame as CSV"""
+    kwargs.setdefault('index', False)
+    with file_lock(path):
+        check_version(path, expected_version)
+        with atomic_write(path, 'w', newline='') as f:
+            df.to_csv(f, **kwargs)
+    return file_version(path)
+
+
+def save_excel(df, path, expected_version=None, **kwargs):
+    """Atomically write a DataFrame as an Excel workbook"""
+    kwargs.setdefault('index', False)
+    with file_lock(path):
+        check_version(path, expected_version)
+        with atomic_write(path) as f:
+            df.to_excel(f, **kwargs)
+    return file_version(path)
+
+
+def save_json(obj, path, expected_version=None, **kwargs):
+    """Atomically write an object as JSON"""
+    with file_lock(path):
+        check_version(path, expected_version)
+        with atomic_write(path, 'w') as f:
+            json.dump(obj, f, **kwargs)
+    return file_version(path)
+
+
+def save_joblib(obj, path, expected_version=None):
+    """Atomically pickle an object with joblib"""
+    import joblib
+    with file_lock(path):
+        check_version(path, expected_version)
+        with atomic_write(path) as f:
+            joblib.dump(obj, f)
+    return file_version(path)
@@ -0,0 +1,193 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+CURRENCY = os.environ.get('ECOWATT_CURRENCY', '$')
+
+# Share of a day's consumption in each hour, used to price daily readings
+# under time-of-use rates (evening peak, low overnight).
+DAILY_PROFILE = np.array([2.5, 2.2, 2.0, 2.0, 2.1, 2.6, 3.6, 4.6, 4.8, 4.4, 4.1, 4.0,
+                          4.0, 3.9, 3.9, 4.1, 4.7, 5.8, 6.6, 6.7, 6.2, 5.2, 4.0, 3.0])
+DAILY_PROFILE = DAILY_PROFILE / DAILY_PROFILE.sum()
+
+# Average-to-peak ratio used to estimate peak demand (kW) from daily kWh
+LOAD_FACTOR = 0.6
+
+
+class Tariff:
+    """
+    A tariff plan. The energy charge is one of:
+
+    rate     flat price per kWh
+    tou      time-of-use [(start_hour, end_hour, price), ...] covering the day;
+             weekend_tou optionally replaces it on Saturday and Sunday
+    tiers    inclining blocks [(from_kwh, price), ...] per billing month,
+             the first block starting at 0
+
+    plus an optional demand charge per kW of monthly peak and a fixed
+    monthly charge (prorated for partial months).
+    """
+
+    def __init__(self, name, rate=None, tou=None, weekend_tou=None, tiers=None, demand_charge=0.0,
+                 fixed_charge=0.0):
+        if sum(x is not None for x in (rate, tou, tiers)) != 1:
+            raise ValueError("a tariff needs exactly one of rate, tou or tiers")
+        self.name = name
+        self.rate = rate
+        self.tou = None if tou is None else self._hourly(tou)
+        self.weekend_tou = self.tou if weekend_tou is None else self._hourly(weekend_tou)
+        self.tiers = None
+        if tiers is not None:
+            starts = np.array([t[0] for t in tiers], dtype=np.float64)
+            if starts[0] != 0 or np.any(np.diff(starts) <= 0):
+                raise ValueError("tiers must start at 0 kWh and increase")
+            self.tiers = (starts, np.array([t[1] for t in tiers], dtype=np.float64))
+        self.demand_charge = float(demand_charge)
+        self.fixed_charge = float(fixed_charge)
+
+    @staticmethod
+    def _hourly(periods):
+        prices = np.full(24, np.nan)
+        for start, end, price in periods:
+            hours = np.arange(start, end if end > start else end + 24) % 24
+            prices[hours] = price
+        if np.isnan(prices).any():
+            raise ValueError("time-of-use periods must cover all 24 hours")
+        return prices
+
+    def hourly_prices(self):
+        """(2, 24) price table for weekdays and weekends (non-tiered plans)"""
+        if self.rate is not None:
+            return np.full((2, 24), float(self.rate))
+        return np.stack([self.tou, self.weekend_tou])
+
+
+# Example plans offered on the Results tab
+PLANS = OrderedDict((t.name, t) for t in [
+    Tariff('Flat rate', rate=0.15, fixed_charge=10.0),
+    Tariff('Time of use', tou=[(0, 7, 0.08), (7, 16, 0.14), (16, 21, 0.30), (21, 24, 0.14)],
+           weekend_tou=[(0, 24, 0.10)], fixed_charge=10.0),
+    Tariff('Tiered', tiers=[(0, 0.11), (1000, 0.16), (2500, 0.24)], fixed_charge=8.0),
+    Tariff('Demand', rate=0.09, demand_charge=12.0, fixed_charge=15.0),
+])
+
+
+def _billing_periods(dates):
+    """Month code of every reading, the first row of each month and the months themselves"""
+    months = dates.astype('datetime64[M]')
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    codes = np.cumsum(np.r_[True, months[1:] != months[:-1]]) - 1
+    return codes, starts, months[starts]
+
+
+def _tiered_energy_cost(consumption, codes, starts, plans):
+    """
+    Cost of every reading under each tiered plan, shape (P, M, T).
+
+    The month-to-date total after each reading comes from one cumulative
+    sum; a reading that crosses a tier boundary is priced as
+    F(total after) - F(total before), where F is the plan's piecewise-linear
+    cumulative cost. Tier lookup is a single searchsorted over all plans'
+    boundaries, each plan shifted into its own numeric range.
+    """
+    running = np.cumsum(consumption, axis=1)
+    before_month = np.concatenate([np.zeros((consumption.shape[0], 1)), running[:, :-1]], axis=1)[:, starts]
+    after = running - before_month[:, codes]
+    # Clip float noise so no reading lands below the first boundary
+    before = np.maximum(after - consumption, 0.0)
+
+    span = max(float(after.max(initial=0.0)), max(p.tiers[0][-1] for p in plans)) + 1.0
+    lower, prices, base_cost = [], [], []
+    for starts_kwh, tier_prices in (p.tiers for p in plans):
+        lower.append(starts_kwh)
+        prices.append(tier_prices)
+        # Cost of consuming up to the start of each tier
+        base_cost.append(np.r_[0.0, np.cumsum(np.diff(starts_kwh) * tier_prices[:-1])])
+    offsets = np.arange(len(plans)) * span
+    boundaries = np.concatenate([b + o for b, o in zip(lower, offsets)])
+    lower, prices, base_cost = map(np.concatenate, (lower, prices, base_cost))
+
+    def cumulative_cost(q):
+        k = np.searchsorted(boundaries, q[None, :, :] + offsets[:, None, None], side='right') - 1
+        return base_cost[k] + prices[k] * (q[None, :, :] - lower[k])
+
+    return cumulative_cost(after) - cumulative_cost(before)
+
+
+def compute_costs(dates, consumption, plans):
+    """
+    Bill every meter under every plan in one pass.
+
+    `dates` is a sorted datetime64 array of length T shared by all meters
+    and `consumption` has shape (M, T) (or (T,) for one meter) in kWh per
+    reading. Returns a dict of arrays:
+    'cost' (P, M, T) energy cost per reading, and 'energy', 'demand',
+    'fixed', 'total', 'kwh' of shape (P, M).
+    """
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    consumption = np.atleast_2d(np.asarray(consumption, dtype=np.float64))
+    n_plans, (n_meters, n_steps) = len(plans), consumption.shape
+    codes, starts, months = _billing_periods(dates)
+    gaps = np.diff(dates)
+    gaps = gaps[gaps > np.timedelta64(0, 'ns')]
+    step_hours = float(np.median(gaps) / np.timedelta64(1, 'h')) if len(gaps) else 24.0
+
+    cost = np.zeros((n_plans, n_meters, n_steps))
+    weekend = (dates.astype('datetime64[D]').astype(np.int64) + 3) % 7 >= 5
+    flat = [i for i, p in enumerate(plans) if p.tiers is None]
+    if flat:
+        tables = np.stack([plans[i].hourly_prices() for i in flat])          # (F, 2, 24)
+        if step_hours < 24:
+            hours = (dates - dates.astype('datetime64[D]')) // np.timedelta64(1, 'h')
+            price = tables[:, weekend.astype(int), hours]                      # (F, T)
+        else:
+            # Daily readings: price each day by the typical hourly load shape
+            price = (tables @ DAILY_PROFILE)[:, weekend.astype(int)]
+        cost[flat] = price[:, None, :] * consumption[None, :, :]
+    tiered = [i for i, p in enumerate(plans) if p.tiers is not None]
+    if tiered:
+        cost[tiered] = _tiered_energy_cost(consumption, codes, starts, [plans[i] for i in tiered])
+
+    # Demand: monthly peak kW per meter, estimated from daily totals when needed
+    kw = consumption / step_hours
+    if step_hours >= 24:
+        kw = kw / LOAD_FACTOR
+    peaks = np.maximum.reduceat(kw, starts, axis=1)                           # (M, months)
+    demand_rates = np.array([p.demand_charge for p in plans])
+    demand = demand_rates[:, None] * peaks.sum(axis=1)[None, :]
+
+    # Fixed charges prorated by the share of each month covered
+    covered = np.bincount(codes, minlength=len(starts)) * step_hours / 24.0
+    days_in_month = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.float64)
+    month_share = np.minimum(covered / days_in_month, 1.0).sum()
+    fixed = np.array([p.fixed_charge for p in plans])[:, None] * np.full((1, n_meters), month_share)
+
+    energy = cost.sum(axis=2)
+    return {
+        'cost': cost,
+        'energy': energy,
+        'demand': demand,
+        'fixed': fixed,
+        'total': energy + demand + fixed,
+        'kwh': np.broadcast_to(consumption.sum(axis=1), (n_plans, n_meters)),
+    }
+
+
+def cost_table(dates, consumption, plans, meter_ids=None):
+    """Totals from compute_costs as a long DataFrame, one row per (plan, meter)"""
+    costs = compute_costs(dates, consumption, plans)
+    n_plans, n_meters = costs['total'].shape
+    meter_ids = list(meter_ids) if meter_ids is not None else list(range(n_meters))
+    table = pd.DataFrame({
+        'plan': np.repeat([p.name for p in plans], n_meters),
+        'meter_id': meter_ids * n_plans,
+        'kwh': costs['kwh'].ravel(),
+        'energy_cost': costs['energy'].ravel(),
+        'demand_cost': costs['demand'].ravel(),
+        'fixed_cost': costs['fixed'].ravel(),
+        'total_cost': costs['total'].ravel(),
+    })
+    table['effective_rate'] = table['total_cost'] / table['kwh'].where(table['kwh'] > 0)
+    return table
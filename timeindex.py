@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# Preset look-back windows offered by the dashboard date filters
+PERIODS = {
+    'Last 30 days': pd.DateOffset(days=30),
+    'Last 90 days': pd.DateOffset(days=90),
+    'Last 6 months': pd.DateOffset(months=6),
+    'Last year': pd.DateOffset(years=1),
+    'All': None,
+}
+DEFAULT_PERIOD = 'Last 6 months'
+
+
+def ensure_sorted(df, column='date'):
+    """Return `df` ordered by `column`, sorting (stably) only if it isn't already"""
+    if df[column].is_monotonic_increasing:
+        return df
+    return df.sort_values(column, kind='stable').reset_index(drop=True)
+
+
+class TimeIndex:
+    """
+    Binary-search range queries over a DataFrame sorted by date.
+
+    Lookups run `searchsorted` on the datetime64 column and return
+    positional slices, so results are views of the underlying data rather
+    than filtered copies. Build it once per dataset and reuse it.
+    """
+
+    def __init__(self, df, column='date'):
+        self.df = ensure_sorted(df, column)
+        self.column = column
+        self.dates = self.df[column].to_numpy(dtype='datetime64[ns]')
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def start(self):
+        return pd.Timestamp(self.dates[0]) if len(self.dates) else None
+
+    @property
+    def end(self):
+        return pd.Timestamp(self.dates[-1]) if len(self.dates) else None
+
+    def bounds(self, t0=None, t1=None):
+        """Row positions [i, j) of readings with t0 <= date <= t1 (open ends when None)"""
+        i = 0 if t0 is None else int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(t0), 'ns'), side='left'))
+        j = len(self.dates) if t1 is None else int(
+            np.searchsorted(self.dates, np.datetime64(pd.Timestamp(t1), 'ns'), side='right'))
+        return i, max(i, j)
+
+    def between(self, t0=None, t1=None):
+        """Rows between two timestamps, inclusive"""
+        i, j = self.bounds(t0, t1)
+        return self.df.iloc[i:j]
+
+    def last(self, n):
+        """The last n rows"""
+        return self.df.iloc[max(len(self.dates) - n, 0):]
+
+    def since(self, offset):
+        """Rows in the trailing window `offset` (e.g. pd.DateOffset(months=3)) up to the newest reading"""
+        if offset is None or not len(self.dates):
+            return self.df
+        return self.between(self.end - offset, None)
+
+    def values(self, column, t0=None, t1=None):
+        """(dates, values) NumPy views for a range, for plotting without a DataFrame"""
+        i, j = self.bounds(t0, t1)
+        return self.dates[i:j], self.df[column].to_numpy()[i:j]
+
+    def period_bounds(self, period):
+        """(t0, t1) for one of the PERIODS presets"""
+        offset = PERIODS[period]
+        if offset is None or not len(self.dates):
+            return self.start, self.end
+        return max(self.end - offset, self.start), self.end
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+NS_PER_SECOND = 1_000_000_000
+
+
+class CompactSeries:
+    """
+    Memory-lean consumption series: float32 values plus either a fixed step
+    from an int64 epoch start (regular series) or int32 second deltas
+    (irregular series). A regular daily series costs 4 bytes per point
+    instead of the 16+ of a float64/datetime64 DataFrame.
+    """
+
+    __slots__ = ('start', 'step', 'deltas', 'values')
+
+    def __init__(self, start, values, step=None, deltas=None):
+        self.start = int(start)
+        self.step = None if step is None else int(step)
+        self.deltas = deltas
+        self.values = np.asarray(values, dtype=np.float32)
+        if step is None and deltas is None and len(self.values) > 1:
+            raise ValueError("an irregular series needs timestamp deltas")
+
+    @classmethod
+    def from_arrays(cls, dates, values):
+        """Build from datetime64 timestamps (sorted) and values"""
+        stamps = np.asarray(dates, dtype='datetime64[ns]').astype(np.int64)
+        if len(stamps) == 0:
+            return cls(0, values, step=0)
+        diffs = np.diff(stamps)
+        if len(diffs) == 0 or (diffs == diffs[0]).all():
+            return cls(stamps[0], values, step=diffs[0] if len(diffs) else 0)
+
+        # Delta-encode: whole seconds fit in int32 for gaps up to ~68 years
+        if (diffs % NS_PER_SECOND == 0).all() and diffs.max() // NS_PER_SECOND < 2 ** 31:
+            deltas = (diffs // NS_PER_SECOND).astype(np.int32)
+        else:
+            deltas = diffs
+        return cls(stamps[0], values, deltas=deltas)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build from a `date`/`consumption_kwh` DataFrame (UI edge)"""
+        df = df.sort_values('date')
+        return cls.from_arrays(pd.to_datetime(df['date']).to_numpy(), df['consumption_kwh'].to_numpy())
+
+    @property
+    def is_regular(self):
+        return self.step is not None
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (0 if self.deltas is None else self.deltas.nbytes)
+
+    @property
+    def timestamps(self):
+        """Materialize the datetime64[ns] timestamps"""
+        n = len(self.values)
+        if self.is_regular:
+            stamps = self.start + np.arange(n, dtype=np.int64) * self.step
+        else:
+            deltas = self.deltas.astype(np.int64)
+            if self.deltas.dtype == np.int32:
+                deltas *= NS_PER_SECOND
+            stamps = np.empty(n, dtype=np.int64)
+            stamps[0] = self.start
+            np.cumsum(deltas, out=stamps[1:])
+            stamps[1:] += self.start
+        return stamps.astype('datetime64[ns]')
+
+    @property
+    def end(self):
+        """Last timestamp without materializing the whole index"""
+        if len(self.values) == 0:
+            return None
+        if self.is_regular:
+            last = self.start + (len(self.values) - 1) * self.step
+        else:
+            scale = NS_PER_SECOND if self.deltas.dtype == np.int32 else 1
+            last = self.start + int(self.deltas.sum(dtype=np.int64)) * scale
+        return np.datetime64(last, 'ns')
+
+    def tail(self, n):
+        """Last n values as a float32 view"""
+        return self.values[-n:] if n else self.values[:0]
+
+    def lag_matrix(self, lag_days):
+        """
+        Lag features and targets as views over the value buffer.
+        Column i holds the value i + 1 steps back (lag_1 first), matching
+        the feature order used by predict_future.
+        """
+        if len(self.values) <= lag_days:
+            return np.empty((0, lag_days), dtype=np.float32), np.empty(0, dtype=np.float32)
+        windows = sliding_window_view(self.values, lag_days + 1)
+        return windows[:, lag_days - 1::-1], windows[:, lag_days]
+
+    def to_frame(self):
+        """Convert back to a `date`/`consumption_kwh` DataFrame (UI edge)"""
+        return pd.DataFrame({
+            'date': self.timestamps,
+            'consumption_kwh': self.values.astype(np.float64)
+        })
@@ -0,0 +1,201 @@
+import itertools
+import math
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy.linalg import LinAlgWarning
+
+from model import FEATURE_SETS, build_model, feature_args, make_features, prepare_data, train_model
+from preprocessing import clean_series
+from timeseries import CompactSeries
+
+# Default search space
+LAG_CHOICES = (3, 7, 14, 21, 28)
+ALPHA_CHOICES = (0.0, 0.1, 1.0, 10.0)
+
+DEFAULT_FOLDS = 6
+DEFAULT_FOLD_SIZE = 14
+DEFAULT_ETA = 3
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Below this many rows process start-up costs more than the trials themselves
+PARALLEL_MIN_ROWS = 50_000
+
+# Worker-side handle on the shared lag matrix of the series being tuned
+_attached = {'name': None, 'shm': None, 'block': None}
+
+
+def search_space(lags=LAG_CHOICES, feature_sets=FEATURE_SETS, alphas=ALPHA_CHOICES):
+    """Grid of candidate configurations"""
+    return [{'lag_days': lag, 'feature_set': fs, 'alpha': alpha}
+            for lag, fs, alpha in itertools.product(lags, feature_sets, alphas)]
+
+
+def rolling_origin_folds(n_rows, n_folds=DEFAULT_FOLDS, fold_size=DEFAULT_FOLD_SIZE, min_train=None):
+    """
+    (origin, end) row ranges, most recent first: each fold trains on rows
+    before `origin` and scores rows origin..end.
+    """
+    min_train = min_train or 2 * fold_size
+    folds = []
+    for k in range(1, n_folds + 1):
+        origin = n_rows - k * fold_size
+        if origin < min_train:
+            break
+        folds.append((origin, origin + fold_size))
+    return folds
+
+
+def shared_lag_block(series, max_lag):
+    """
+    Lag matrix for the deepest lag plus the target, as one float32 block:
+    columns 0..max_lag-1 are lag_1..lag_max and the last column is y.
+    Shallower configs use the leading columns of the same rows.
+    """
+    X, y = series.lag_matrix(max_lag)
+    block = np.empty((len(y), max_lag + 1), dtype=np.float32)
+    block[:, :max_lag] = X
+    block[:, max_lag] = y
+    return block
+
+
+def _attach(name, shape):
+    """Map the shared block in a worker, reusing the mapping across trials"""
+    if _attached['name'] != name:
+        if _attached['shm'] is not None:
+            _attached['shm'].close()
+        shm = shared_memory.SharedMemory(name=name)
+        _attached.update(name=name, shm=shm, block=np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+    return _attached['block']
+
+
+def score_trial(block, config, fold):
+    """Mean squared one-step error of `config` on one rolling-origin fold"""
+    origin, end = fold
+    X = make_features(block[:, :config['lag_days']], config['feature_set'])
+    y = block[:, -1]
+    with warnings.catch_warnings():
+        # Neighbouring lags are nearly collinear; that is what the ridge penalty is for
+        warnings.simplefilter('ignore', LinAlgWarning)
+        model = build_model(config['alpha']).fit(X[:origin], y[:origin])
+    error = model.predict(X[origin:end]) - y[origin:end]
+    return float(np.mean(error.astype(np.float64) ** 2))
+
+
+def _init_worker():
+    # One BLAS thread per worker process so parallel trials don't oversubscribe cores
+    from threadpoolctl import threadpool_limits
+    _attached['limits'] = threadpool_limits(1)
+
+
+def _make_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+
+def _run_trial(task):
+    name, shape, config, fold = task
+    return score_trial(_attach(name, shape), config, fold)
+
+
+def successive_halving(configs, folds, evaluate, eta=DEFAULT_ETA):
+    """
+    Score every config on the most recent fold, keep the best 1/eta, then
+    widen the survivors to eta times as many folds, until one config or
+    all folds remain. `evaluate(tasks)` maps (config index, fold) pairs to
+    errors. Returns (best index, mean error per index, trials run).
+    """
+    errors = {i: [] for i in range(len(configs))}
+    alive = list(errors)
+    budget = 1
+    trials = 0
+    while True:
+        tasks = [(i, fold) for i in alive for fold in folds[len(errors[i]):budget]]
+        for (i, _), error in zip(tasks, evaluate(tasks)):
+            errors[i].append(error)
+        trials += len(tasks)
+        if budget >= len(folds):
+            break
+        alive.sort(key=lambda i: np.mean(errors[i]))
+        alive = alive[:max(math.ceil(len(alive) / eta), 1)]
+        budget = min(budget * eta, len(folds))
+    means = {i: float(np.mean(errors[i])) for i in errors}
+    best = min(alive, key=lambda i: means[i])
+    return best, means, trials
+
+
+def tune_series(series, configs=None, n_folds=DEFAULT_FOLDS, fold_size=DEFAULT_FOLD_SIZE,
+                eta=DEFAULT_ETA, workers=DEFAULT_WORKERS, executor=None):
+    """
+    Pick the best configuration for one series with rolling-origin
+    validation. Accepts a CompactSeries or a `date`/`consumption_kwh`
+    DataFrame (cleaned onto a regular grid first). Returns the winning
+    config with its cross-validated error, or None if the series is too
+    short to validate.
+    """
+    if not isinstance(series, CompactSeries):
+        series = CompactSeries.from_frame(clean_series(series)[0])
+    configs = configs or search_space()
+    max_lag = max(c['lag_days'] for c in configs)
+    block = shared_lag_block(series, max_lag)
+    folds = rolling_origin_folds(len(block), n_folds, fold_size, min_train=max(2 * fold_size, 4 * max_lag))
+    if not folds:
+        return None
+
+    if executor is None and (workers <= 1 or len(block) < PARALLEL_MIN_ROWS):
+        def evaluate(tasks):
+            return [score_trial(block, configs[i], fold) for i, fold in tasks]
+        best, means, trials = successive_halving(configs, folds, evaluate, eta)
+    else:
+        # Trials read the lag matrix from shared memory instead of rebuilding or pickling it
+        shm = shared_memory.SharedMemory(create=True, size=block.nbytes)
+        try:
+            np.ndarray(block.shape, dtype=np.float32, buffer=shm.buf)[:] = block
+            pool = executor or _make_pool(workers)
+
+            def evaluate(tasks):
+                jobs = [(shm.name, block.shape, configs[i], fold) for i, fold in tasks]
+                return list(pool.map(_run_trial, jobs, chunksize=max(len(jobs) // (4 * workers), 1)))
+            try:
+                best, means, trials = successive_halving(configs, folds, evaluate, eta)
+            finally:
+                if executor is None:
+                    pool.shutdown()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return {**configs[best], 'cv_mse': means[best], 'cv_folds': len(folds), 'trials': trials}
+
+
+def tune_meters(df, workers=DEFAULT_WORKERS, **kwargs):
+    """
+    Tune each meter of a multi-meter DataFrame independently, sharing one
+    process pool across meters. Returns {meter_id: config or None}.
+    """
+    results = {}
+    pool = _make_pool(workers) if workers > 1 else None
+    try:
+        for meter_id, readings in df.groupby('meter_id'):
+            results[meter_id] = tune_series(readings[['date', 'consumption_kwh']], workers=workers,
+                                            executor=pool, **kwargs)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
+
+def train_tuned(data, workers=DEFAULT_WORKERS, **kwargs):
+    """
+    Tune, then fit the winning configuration on the full series.
+    Returns (model, X, y) with the config stored on the model, or
+    (None, None, None) if the series is too short to tune.
+    """
+    series = data if isinstance(data, CompactSeries) else CompactSeries.from_frame(clean_series(data)[0])
+    config = tune_series(series, workers=workers, **kwargs)
+    if config is None:
+        return None, None, None
+    X, y = prepare_data(series, **feature_args(config))
+    return train_model(X, y, config), X, y